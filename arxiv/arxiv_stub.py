@@ -0,0 +1,205 @@
+import argparse
+import copy
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+from urllib.parse import parse_qs, urlsplit
+
+from lxml import etree
+
+from sickle_impl import getLogger, ns
+
+logger = getLogger(__name__)
+
+"""
+A local stand-in for the parts of arXiv the getter talks to, for benchmarks and tests that mustn't hit the real thing
+with its three second throttle. It serves
+    /api/query  the Atom feed of a metadata query, built from the entries of a recorded feed (smaple.xml)
+    /oai2       OAI-PMH ListRecords pages of arXivRaw records, chained by resumptionTokens
+    /pdf/<id>   a fixed PDF (paper.pdf), or arXiv's 'No PDF' page (nopdf.xml)
+each after `latency` seconds. A request fails with a 503 and a meta refresh page (wait10seconds.html) asking to retry
+after `retry_after` seconds at `error_rate`, and a PDF is missing at `no_pdf_rate`, both drawn from a seeded generator.
+The records are the ids 1501.00000 to 1501.<records - 1>.
+"""
+
+FIXTURES = os.path.dirname(os.path.abspath(__file__))
+LATENCY: float = 0.0  # conf, seconds before each response
+ERROR_RATE: float = 0.0  # conf, share of requests answered with a 503 refresh
+NO_PDF_RATE: float = 0.0  # conf, share of PDFs answered with the 'No PDF' page
+RETRY_AFTER: int = 1  # conf, seconds the refresh responses ask for; arXiv asks for 10
+RECORDS: int = 1000  # conf
+PAGE_SIZE: int = 100  # conf, records in a ListRecords page
+SEED: int = 1501
+OAI_NAMESPACES = ('xmlns="http://www.openarchives.org/OAI/2.0/" '
+                  'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"')
+
+
+def fixture(name: str) -> bytes:
+    with open(os.path.join(FIXTURES, name), 'rb') as fixture_file:
+        return fixture_file.read()
+
+
+def stub_ids(records: int) -> List[str]:
+    return [f"1501.{number:05d}" for number in range(records)]
+
+
+class StubArxiv(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, latency: float = LATENCY, error_rate: float = ERROR_RATE,
+                 no_pdf_rate: float = NO_PDF_RATE, retry_after: int = RETRY_AFTER, records: int = RECORDS,
+                 page_size: int = PAGE_SIZE, seed: int = SEED):
+        """
+        :param port: 0 for any free one
+        """
+        super().__init__(('127.0.0.1', port), StubHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.no_pdf_rate = no_pdf_rate
+        self.retry_after = retry_after
+        self.ids = stub_ids(records)
+        self.page_size = page_size
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        feed = etree.fromstring(fixture('smaple.xml'))
+        # the recorded entries, as qualified or not as arXiv answered them, are reused round robin
+        self.entries = feed.findall('atom:entry', ns)
+        for entry in self.entries:
+            entry.getparent().remove(entry)
+        self.feed = feed
+        self.pdf = fixture('paper.pdf')
+        self.no_pdf = fixture('nopdf.xml')
+        self.refresh = re.sub(rb'content="\d+"', f'content="{retry_after}"'.encode(), fixture('wait10seconds.html'))
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def start(self) -> 'StubArxiv':
+        self.thread = threading.Thread(target=self.serve_forever, name="arxiv_stub", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def chance(self, rate: float) -> bool:
+        with self.random_lock:
+            return rate > 0 and self.random.random() < rate
+
+    def query_feed(self, id_list: List[str], start: int, max_results: int) -> bytes:
+        """
+        :param id_list: ids, with or without their versions; every stub record when empty
+        """
+        ids = [re.sub(r'v\d+$', '', arxiv_id) for arxiv_id in id_list] or self.ids
+        page = ids[start:start + max_results]
+        feed = copy.deepcopy(self.feed)
+        for name, value in (('totalResults', len(ids)), ('startIndex', start), ('itemsPerPage', max_results)):
+            feed.find(f'opensearch:{name}', ns).text = str(value)
+        for arxiv_id in page:
+            entry = copy.deepcopy(self.entries[int(arxiv_id.split('.')[-1]) % len(self.entries)])
+            entry.find('atom:id', ns).text = f"http://arxiv.org/abs/{arxiv_id}v1"
+            entry.find('atom:link[@type="application/pdf"]', ns).attrib['href'] = f"{self.url}/pdf/{arxiv_id}v1"
+            feed.append(entry)
+        return etree.tostring(feed, xml_declaration=True, encoding='UTF-8')
+
+    def list_records(self, arguments: dict) -> bytes:
+        if 'resumptionToken' in arguments:
+            page = int(arguments['resumptionToken'])
+        else:
+            page = 0
+        start = page * self.page_size
+        ids = self.ids[start:start + self.page_size]
+        records = ''.join(
+            f"<record><header><identifier>oai:arXiv.org:{arxiv_id}</identifier><datestamp>2015-01-19</datestamp>"
+            f"<setSpec>cs</setSpec></header><metadata><arXivRaw xmlns=\"http://arxiv.org/OAI/arXivRaw/\">"
+            f"<id>{arxiv_id}</id><title>Stub record {arxiv_id}</title><categories>cs.LO</categories>"
+            f"</arXivRaw></metadata></record>" for arxiv_id in ids)
+        token = str(page + 1) if start + self.page_size < len(self.ids) else ''
+        return (f'<?xml version="1.0" encoding="UTF-8"?><OAI-PMH {OAI_NAMESPACES}>'
+                f'<responseDate>2020-04-04T00:00:00Z</responseDate><request verb="ListRecords">{self.url}/oai2</request>'
+                f'<ListRecords>{records}<resumptionToken cursor="{start}" completeListSize="{len(self.ids)}">{token}'
+                f'</resumptionToken></ListRecords></OAI-PMH>').encode('UTF-8')
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: StubArxiv
+
+    def do_GET(self):
+        self.answer(parse_qs(urlsplit(self.path).query))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('UTF-8')
+        self.answer(dict(parse_qs(urlsplit(self.path).query), **parse_qs(body)))
+
+    def answer(self, arguments: dict):
+        arguments = {name: values[-1] for name, values in arguments.items()}
+        path = urlsplit(self.path).path
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.chance(self.server.error_rate):
+            return self.send(503, self.server.refresh, 'text/html', {'Retry-After': str(self.server.retry_after)})
+        if path == '/api/query':
+            id_list = [arxiv_id for arxiv_id in arguments.get('id_list', '').split(',') if arxiv_id]
+            return self.send(200, self.server.query_feed(id_list, int(arguments.get('start', 0)),
+                                                         int(arguments.get('max_results', 10))), 'application/atom+xml')
+        if path == '/oai2' and arguments.get('verb') == 'ListRecords':
+            return self.send(200, self.server.list_records(arguments), 'text/xml')
+        if path.startswith('/pdf/'):
+            if self.server.chance(self.server.no_pdf_rate):
+                return self.send(200, self.server.no_pdf, 'text/html')
+            return self.send(200, self.server.pdf, 'application/pdf')
+        self.send(404, b'not found', 'text/plain')
+
+    def send(self, status: int, body: bytes, content_type: str, headers: dict = None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def add_stub_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--latency', type=float, default=LATENCY, help="seconds before each response")
+    parser.add_argument('--error-rate', type=float, default=ERROR_RATE,
+                        help="share of requests answered with a 503 asking to retry later")
+    parser.add_argument('--no-pdf-rate', type=float, default=NO_PDF_RATE,
+                        help="share of PDFs answered with the 'No PDF' page")
+    parser.add_argument('--retry-after', type=int, default=RETRY_AFTER, help="seconds the 503s ask to wait")
+    parser.add_argument('--records', type=int, default=RECORDS, help="records in the OAI-PMH set")
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE, help="records in a ListRecords page")
+    parser.add_argument('--seed', type=int, default=SEED, help="seed of the errors and missing PDFs")
+
+
+def stub_from_arguments(arguments: argparse.Namespace, port: int = 0) -> StubArxiv:
+    return StubArxiv(port, arguments.latency, arguments.error_rate, arguments.no_pdf_rate, arguments.retry_after,
+                     arguments.records, arguments.page_size, arguments.seed)
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the arXiv API, OAI-PMH and PDFs")
+    parser.add_argument('--port', type=int, default=8080)
+    add_stub_arguments(parser)
+    arguments = parser.parse_args(argv)
+    stub = stub_from_arguments(arguments, arguments.port)
+    print(f"serving {len(stub.ids)} records at {stub.url}/api/query, {stub.url}/oai2 and {stub.url}/pdf/")
+    try:
+        stub.serve_forever()
+    except KeyboardInterrupt:
+        stub.server_close()
+
+
+if __name__ == '__main__':
+    main()
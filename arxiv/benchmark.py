@@ -0,0 +1,279 @@
+import argparse
+import json
+import math
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+from multiprocessing import Pool
+from typing import Callable, Iterable, List, Optional
+
+from arxiv_stub import FIXTURES, add_stub_arguments, stub_from_arguments
+from http_client import HttpClient, get_client, set_client
+from rate_limiter import RateLimiter, rate_limit_wait
+from sickle_impl import getLogger
+
+logger = getLogger(__name__)
+
+"""
+Offline benchmarks of the corpus build's stages, against a local arxiv_stub server and fixed fixtures (paper.pdf and
+paper.txt), so a change's effect on performance can be measured without arXiv's throttle. Each stage reports the
+items it processed, its wall clock seconds and throughput, the p50 and p99 latency of an item, and the seconds it
+spent waiting on the rate limiter, which includes the pauses the stub's 503s ask for. A run is appended to the
+results file as one JSON line with the commit it ran on, so runs on different commits can be compared (--compare).
+"""
+
+RESULTS_PATH = "benchmarks.jsonl"  # conf
+REQUESTS_PER_SECOND: float = 1000  # conf, the limiter's pace against the stub; arXiv's is 1/3
+MAX_CONNECTIONS: int = 8  # conf
+HARVEST_RECORDS: int = 1000  # conf
+DOWNLOADS: int = 200  # conf
+CONVERSIONS: int = 50  # conf
+EXTRACTIONS: int = 1000  # conf
+STAGES = ('get_ids', 'download_pdfs', 'converter', 'extractor')
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    """
+    :return: the nearest rank percentile of the values, eg fraction 0.99 for the p99; None if there are none
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def summarize(latencies: List[float], seconds: float, waited: float, size: int = None) -> dict:
+    """
+    :param latencies: seconds each item took
+    :param seconds: wall clock seconds of the whole stage
+    :param waited: seconds the stage's requests waited on the rate limiter
+    :param size: bytes the stage processed, if it's measured in bytes too
+    """
+    summary = dict(items=len(latencies), seconds=round(seconds, 4),
+                   items_per_second=round(len(latencies) / seconds, 2) if seconds else None,
+                   p50_ms=None, p99_ms=None, waited_seconds=round(waited, 4))
+    if latencies:
+        summary.update(p50_ms=round(percentile(latencies, 0.5) * 1000, 3),
+                       p99_ms=round(percentile(latencies, 0.99) * 1000, 3))
+    if size is not None:
+        summary.update(bytes=size, megabytes_per_second=round(size / seconds / 1e6, 3) if seconds else None)
+    return summary
+
+
+def timed_items(items: Iterable, limit: int = None) -> List[float]:
+    """
+    :return: the seconds it took to get each item, up to limit of them
+    """
+    latencies = []
+    iterator = iter(items)
+    while limit is None or len(latencies) < limit:
+        start = time.perf_counter()
+        try:
+            next(iterator)
+        except StopIteration:
+            break
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def measure(stage: Callable[[], tuple]) -> dict:
+    """
+    :param stage: returns (latencies, size or None)
+    """
+    waited = rate_limit_wait.value()
+    start = time.perf_counter()
+    latencies, size = stage()
+    return summarize(latencies, time.perf_counter() - start, rate_limit_wait.value() - waited, size)
+
+
+def bench_get_ids(stub_url: str, records: int) -> tuple:
+    """
+    Harvest the stub's OAI-PMH set with Sickle_Impl.get_ids; an item is a harvested id
+    """
+    from sickle_impl import Sickle_Impl
+    harvester = Sickle_Impl(f"{stub_url}/oai2")
+    return timed_items(harvester.get_ids('cs'), records), None
+
+
+def bench_download_pdfs(stub_url: str, downloads: int, use_async: bool = False) -> tuple:
+    """
+    Query the stub for a batch of ids and download their qualified PDFs with download_pdfs; an item is a download,
+    from its submission to its end, and the metadata query is in the stage's seconds but no item's latency
+    """
+    import getter
+    from arxiv_stub import stub_ids
+    base_url, getter.base_url = getter.base_url, f"{stub_url}/api/query?"
+    engine = None
+    latencies, results = [], []
+    try:
+        engine = getter.AsyncDownloadEngine() if use_async else None
+        for download in getter.download_pdfs(stub_ids(downloads), 'computing', downloads, engine):
+            submitted = time.perf_counter()
+            download.add_done_callback(lambda done, submitted=submitted: latencies.append(
+                time.perf_counter() - submitted))
+            results.append(download)
+        paths = [download.result() for download in results]
+    finally:
+        if engine:
+            engine.close()
+        getter.base_url = base_url
+    return latencies, sum(os.path.getsize(path) for path in paths if path)
+
+
+def copy_fixture(name: str, folder: str, copies: int, file_name: Callable[[int], str]) -> str:
+    os.makedirs(folder, exist_ok=True)
+    for number in range(copies):
+        shutil.copyfile(os.path.join(FIXTURES, name), os.path.join(folder, file_name(number)))
+    return folder
+
+
+def bench_converter(work_folder: str, conversions: int, workers: int) -> tuple:
+    """
+    Convert copies of paper.pdf as Converter.convert_pdfs_to_text does; an item is a PDF, as long as pdftotext took
+    on it in its worker
+    """
+    from run_pdftotext import Converter
+    pdf_folder = copy_fixture('paper.pdf', os.path.join(work_folder, 'pdfs'), conversions,
+                              lambda number: f"export_arxiv_org_pdf_1501_{number:05d}v1.pdf")
+    converter = Converter(os.path.join(work_folder, 'text'), pdf_folder, workers=workers)
+    indexed_paths = enumerate(converter.pdf_paths())
+    if workers > 1:
+        with Pool(workers) as pool:
+            results = list(pool.imap_unordered(converter.convert_indexed_pdf, indexed_paths, converter.chunksize))
+    else:
+        results = [converter.convert_indexed_pdf(indexed_path) for indexed_path in indexed_paths]
+    if not all(converter.converted(*result)[1] for result in results):
+        raise ValueError("failed to convert paper.pdf")
+    return [seconds for index, pdf_path, text_path, seconds in results], \
+        conversions * os.path.getsize(os.path.join(FIXTURES, 'paper.pdf'))
+
+
+def bench_extractor(work_folder: str, extractions: int) -> tuple:
+    """
+    Extract the sections of copies of paper.txt with Extractor; an item is a document
+    """
+    from extract_background import Extractor, SECTIONS, load_match_extract
+    text_folder = copy_fixture('paper.txt', os.path.join(work_folder, 'extract'), extractions,
+                               lambda number: f"export_arxiv_org_pdf_1501_{number:05d}v1.txt")
+    extractor = Extractor(load_match_extract(), text_folder)
+    latencies = []
+    for path in extractor.documents():
+        start = time.perf_counter()
+        sections = extractor.extract_sections(path, SECTIONS)
+        latencies.append(time.perf_counter() - start)
+        if not sections:
+            raise ValueError(f"no sections extracted from {path}")
+    return latencies, extractions * os.path.getsize(os.path.join(FIXTURES, 'paper.txt'))
+
+
+def git_commit() -> Optional[str]:
+    """
+    :return: the commit the benchmarked code is at, with '-dirty' if it has uncommitted changes; None outside git
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=FIXTURES, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=FIXTURES,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('-dirty' if dirty else '')
+
+
+def run(arguments: argparse.Namespace) -> dict:
+    """
+    :return: the result of every stage asked for, by name; a stage that can't run here is skipped with the reason
+    """
+    stub = stub_from_arguments(arguments).start()
+    set_client(HttpClient(RateLimiter(arguments.rate, arguments.connections, arguments.connections)))
+    cwd = os.getcwd()
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory() as work_folder:
+            # download_pdfs saves into a folder named for the topic under the current one
+            os.chdir(work_folder)
+            stages = dict(get_ids=lambda: bench_get_ids(stub.url, arguments.records),
+                          download_pdfs=lambda: bench_download_pdfs(stub.url, arguments.downloads,
+                                                                    arguments.async_downloads),
+                          converter=lambda: bench_converter(work_folder, arguments.conversions, arguments.workers),
+                          extractor=lambda: bench_extractor(work_folder, arguments.extractions))
+            for name in arguments.stages:
+                logger.info(f"benchmarking {name}")
+                try:
+                    results[name] = measure(stages[name])
+                except ImportError as ie:
+                    logger.warning(f"skipping {name}: {ie}")
+                    results[name] = dict(skipped=str(ie))
+                logger.info(f"{name}: {results[name]}")
+    finally:
+        os.chdir(cwd)
+        get_client().close()
+        # the next get_client makes the default one again
+        set_client(None)
+        stub.stop()
+    return results
+
+
+def compare(previous: dict, current: dict) -> List[str]:
+    """
+    :return: a line for each stage both runs measured, with the change in its throughput and latencies
+    """
+    lines = []
+    for name, result in current['stages'].items():
+        before = previous['stages'].get(name, {})
+        changes = []
+        for key in ('items_per_second', 'p50_ms', 'p99_ms'):
+            if result.get(key) is not None and before.get(key):
+                changes.append(f"{key} {before[key]} -> {result[key]} ({(result[key] / before[key] - 1) * 100:+.1f}%)")
+        if changes:
+            lines.append(f"{name}: {', '.join(changes)}")
+    return lines
+
+
+def last_result(path: str, config: dict) -> Optional[dict]:
+    """
+    :return: the last result in the results file of a run with the same configuration
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as results_file:
+        results = [json.loads(line) for line in results_file if line.strip()]
+    matching = [result for result in results if result.get('config') == config]
+    return matching[-1] if matching else None
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Benchmark the corpus build's stages offline, against a local stub")
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+    parser.add_argument('--output', default=RESULTS_PATH, help="JSON lines file the run's result is appended to")
+    parser.add_argument('--compare', action='store_true',
+                        help="print the change from the last run in the output file with the same configuration")
+    parser.add_argument('--rate', type=float, default=REQUESTS_PER_SECOND, help="requests per second to the stub")
+    parser.add_argument('--connections', type=int, default=MAX_CONNECTIONS, help="requests in flight to the stub")
+    parser.add_argument('--downloads', type=int, default=DOWNLOADS, help="ids queried for PDFs to download")
+    parser.add_argument('--async-downloads', action='store_true', help="download on the asyncio engine")
+    parser.add_argument('--conversions', type=int, default=CONVERSIONS, help="copies of paper.pdf to convert")
+    parser.add_argument('--workers', type=int, default=1, help="conversion processes")
+    parser.add_argument('--extractions', type=int, default=EXTRACTIONS, help="copies of paper.txt to extract")
+    add_stub_arguments(parser)
+    arguments = parser.parse_args(argv)
+    config = {key: value for key, value in vars(arguments).items() if key not in ('output', 'compare')}
+    previous = last_result(arguments.output, config) if arguments.compare else None
+    result = dict(commit=git_commit(), time=datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                  python=platform.python_version(), platform=platform.platform(), config=config,
+                  stages=run(arguments))
+    with open(arguments.output, 'a') as results_file:
+        results_file.write(json.dumps(result) + '\n')
+    print(json.dumps(result['stages'], indent=2))
+    if previous:
+        print(f"compared with {previous['commit']} at {previous['time']}:")
+        print('\n'.join(compare(previous, result)))
+    return result
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+import json
+import sqlite3
+from typing import Iterable, List, Optional
+
+from sickle_impl import getLogger
+
+logger = getLogger(__name__)
+
+ARXIV_RAW_NS = '{http://arxiv.org/OAI/arXivRaw/}'
+# the arXivRaw fields we query on get their own columns; everything in the record is also kept as JSON
+COLUMNS = ('title', 'authors', 'categories', 'comments', 'journal-ref', 'doi', 'license', 'abstract')
+
+
+def record_fields(item) -> dict:
+    """
+    Flatten a harvested arXivRaw record
+    :param item: sickle Record from ListRecords in arXivRaw format
+    :return: every metadata field (the first value of single valued fields, lists otherwise) plus its versions
+    """
+    fields = {name: values[0] if len(values) == 1 else values for name, values in item.metadata.items()
+              if name not in ('version', 'date', 'size', 'source_type')}
+    fields['versions'] = [dict(version=version.attrib.get('version'),
+                               **{child.tag.replace(ARXIV_RAW_NS, ''): child.text for child in version})
+                          for version in item.xml.iterfind(f'.//{ARXIV_RAW_NS}version')]
+    return fields
+
+
+def pdf_link(arxiv_id: str, version: Optional[str] = None):
+    """
+    :return: the export mirror's pdf link for the given (or latest) version of an article, as link_from_entry makes
+    """
+    return f"http://export.arxiv.org/pdf/{arxiv_id}{version or ''}"
+
+
+class Catalog:
+    """
+    Local SQLite catalog of every harvested arXivRaw record, indexed on id, category, datestamp, doi and journal_ref,
+    so selecting the articles to download is a local query rather than a second pass of throttled API calls
+    """
+
+    def __init__(self, path: str = "catalog.sqlite3"):  # conf
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS record (
+                arxiv_id TEXT PRIMARY KEY,
+                datestamp TEXT,
+                latest_version TEXT,
+                title TEXT,
+                authors TEXT,
+                categories TEXT,
+                comments TEXT,
+                journal_ref TEXT,
+                doi TEXT,
+                license TEXT,
+                abstract TEXT,
+                metadata TEXT NOT NULL);
+            CREATE INDEX IF NOT EXISTS record_datestamp ON record (datestamp);
+            CREATE INDEX IF NOT EXISTS record_doi ON record (doi);
+            CREATE INDEX IF NOT EXISTS record_journal_ref ON record (journal_ref);
+            CREATE TABLE IF NOT EXISTS record_category (
+                category TEXT NOT NULL,
+                arxiv_id TEXT NOT NULL,
+                PRIMARY KEY (category, arxiv_id));
+            CREATE INDEX IF NOT EXISTS record_category_id ON record_category (arxiv_id);
+        """)
+        self.connection.commit()
+
+    def add(self, item):
+        """
+        Store (or replace) a harvested record, once it's committed; the harvest commits at each of its checkpoints, so
+        the records of every page before the checkpoint are in the catalog however the harvest ends
+        :param item: sickle Record from ListRecords in arXivRaw format
+        """
+        fields = record_fields(item)
+        arxiv_id = fields.get('id')
+        if not arxiv_id or isinstance(arxiv_id, list):
+            logger.warning(f"not cataloging {item.header.identifier} with id {arxiv_id}")
+            return
+        versions = fields['versions']
+        values = [fields.get(column) for column in COLUMNS]
+        values = [';'.join(value) if isinstance(value, list) else value for value in values]
+        self.connection.execute(
+            "INSERT OR REPLACE INTO record (arxiv_id, datestamp, latest_version, title, authors, categories, comments,"
+            " journal_ref, doi, license, abstract, metadata) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [arxiv_id, item.header.datestamp, versions[-1]['version'] if versions else None]
+            + values + [json.dumps(fields)])
+        self.connection.execute("DELETE FROM record_category WHERE arxiv_id = ?", (arxiv_id,))
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO record_category (category, arxiv_id) VALUES (?, ?)",
+            [(category, arxiv_id) for category in (fields.get('categories') or '').split()])
+
+    def commit(self):
+        self.connection.commit()
+
+    def get(self, arxiv_id: str) -> Optional[dict]:
+        row = self.connection.execute("SELECT metadata FROM record WHERE arxiv_id = ?", (arxiv_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def qualified(self, ids: Iterable[str] = None, categories: List[str] = None, term: str = None,
+                  since: str = None):
+        """
+        The local equivalent of querying the API and keeping the entries qualify_entry accepts
+        :param ids: restrict to these arXiv ids
+        :param categories: restrict to articles listed in any of these categories, eg 'cs.AI'
+        :param term: case insensitive word the title or abstract must contain, as in the API's all: search
+        :param since: restrict to records with a datestamp on or after this day
+        :return: (arXiv id, pdf link) for every article with a doi and a journal reference, most recent first
+        """
+        self.commit()
+        joins, clauses, parameters = [], ["r.doi IS NOT NULL", "r.journal_ref IS NOT NULL"], []
+        if ids is not None:
+            self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS batch_id (arxiv_id TEXT PRIMARY KEY)")
+            self.connection.execute("DELETE FROM batch_id")
+            self.connection.executemany("INSERT OR IGNORE INTO batch_id VALUES (?)", ((i,) for i in ids))
+            joins.append("JOIN batch_id b ON b.arxiv_id = r.arxiv_id")
+        if categories:
+            clauses.append(f"EXISTS (SELECT 1 FROM record_category c WHERE c.arxiv_id = r.arxiv_id "
+                           f"AND c.category IN ({','.join('?' * len(categories))}))")
+            parameters.extend(categories)
+        if term:
+            clauses.append("(r.title LIKE ? OR r.abstract LIKE ?)")
+            parameters.extend([f"%{term}%"] * 2)
+        if since:
+            clauses.append("r.datestamp >= ?")
+            parameters.append(since)
+        query = (f"SELECT r.arxiv_id, r.latest_version FROM record r {' '.join(joins)} "
+                 f"WHERE {' AND '.join(clauses)} ORDER BY r.datestamp DESC")
+        for arxiv_id, version in self.connection.execute(query, parameters).fetchall():
+            yield arxiv_id, pdf_link(arxiv_id, version)
+
+    def close(self):
+        self.commit()
+        self.connection.close()
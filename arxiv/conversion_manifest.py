@@ -0,0 +1,87 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+CONVERTED = 'converted'
+FAILED = 'failed'
+
+
+def file_sha256(path: str, block_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ConversionManifest:
+    """
+    Records, for each source PDF, the size, mtime and SHA-256 it was converted at, the text file it was converted to and
+    whether the conversion worked, so a re-run converts only the PDFs that are new or changed (and, when asked, the ones
+    that failed last time)
+    """
+
+    def __init__(self, path: str = "manifest.sqlite3", retry_failed: bool = False):
+        self.retry_failed = retry_failed
+        # a process pool's task feeder thread checks PDFs while the main thread records the converted ones
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS conversion (
+                pdf_path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                sha256 TEXT NOT NULL,
+                text_path TEXT,
+                status TEXT NOT NULL,
+                converted TEXT NOT NULL)""")
+        self.connection.commit()
+
+    def needs_conversion(self, pdf_path: str, stat: os.stat_result = None) -> bool:
+        """
+        :param stat: the PDF's stat, if the caller has it already (eg from a DirEntry)
+        :return: whether the PDF is new, changed, failed last time (if we're retrying failures) or lost its text file
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT size, mtime_ns, sha256, text_path, status FROM conversion "
+                                          "WHERE pdf_path = ?", (os.path.abspath(pdf_path),)).fetchone()
+        if row is None:
+            return True
+        size, mtime_ns, sha256, text_path, status = row
+        stat = stat or os.stat(pdf_path)
+        if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+            # touched, but maybe not changed
+            if stat.st_size != size or file_sha256(pdf_path) != sha256:
+                return True
+            with self.lock:
+                self.connection.execute("UPDATE conversion SET mtime_ns = ? WHERE pdf_path = ?",
+                                        (stat.st_mtime_ns, os.path.abspath(pdf_path)))
+                self.connection.commit()
+        if status == FAILED:
+            return self.retry_failed
+        return not (text_path and os.path.exists(text_path))
+
+    def record(self, pdf_path: str, text_path: Optional[str]):
+        """
+        Note the outcome of converting a PDF; a None text_path means it failed
+        """
+        stat = os.stat(pdf_path)
+        sha256 = file_sha256(pdf_path)
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO conversion (pdf_path, size, mtime_ns, sha256, text_path, status, converted) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (os.path.abspath(pdf_path), stat.st_size, stat.st_mtime_ns, sha256,
+                 text_path and os.path.abspath(text_path), CONVERTED if text_path else FAILED,
+                 time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime())))
+            self.connection.commit()
+
+    def counts(self) -> dict:
+        with self.lock:
+            return dict(self.connection.execute("SELECT status, count(*) FROM conversion GROUP BY status").fetchall())
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,257 @@
+import fnmatch
+import gzip
+import io
+import json
+import os
+import re
+import sqlite3
+import threading
+from typing import Callable, Iterator, List, Optional, Set, Tuple
+
+try:
+    import zstandard  # https://python-zstandard.readthedocs.io/ optional; without it, new shards are gzip compressed
+except ImportError:
+    zstandard = None
+
+from sickle_impl import getLogger
+
+logger = getLogger(__name__)
+
+"""
+A corpus as a few large shards instead of a file per document. Each shard is JSON lines, one record per document,
+compressed in blocks of about BLOCK_BYTES: the blocks are independent zstd frames (or gzip members), so the shard
+streams as one compressed file at disk bandwidth, and the shard's index, which maps each record's key to its block and
+line, lets a single document be read by decompressing one block. A shard being written is hidden until it's closed.
+"""
+
+SHARD_BYTES: int = 256 * 1024 * 1024  # conf, uncompressed bytes of records in a shard before the next is started
+BLOCK_BYTES: int = 1024 * 1024  # conf, uncompressed bytes of records compressed together
+ZSTD_LEVEL: int = 3  # conf
+ZSTD_SUFFIX = '.jsonl.zst'
+GZIP_SUFFIX = '.jsonl.gz'
+INDEX_SUFFIX = '.index.sqlite3'
+# the arXiv id in a file name url_to_file_name made from a pdf link, eg export_arxiv_org_pdf_1501_05260v3.pdf
+FILE_NAME_ARXIV_ID = re.compile(r'pdf_(?:(?P<new>\d{4})_(?P<number>\d{4,5})|(?P<archive>[a-z\-]+(?:_[A-Z]{2})?)_'
+                                r'(?P<old>\d{7}))(?P<version>v\d+)?$')
+
+
+def arxiv_id_of(path: str) -> Optional[str]:
+    """
+    :return: the arXiv id, with its version, of a downloaded PDF or a file named for it; None if it has none
+    """
+    match = FILE_NAME_ARXIV_ID.search(os.path.splitext(os.path.basename(path))[0])
+    if not match:
+        return None
+    if match.group('new'):
+        arxiv_id = f"{match.group('new')}.{match.group('number')}"
+    else:
+        arxiv_id = f"{match.group('archive').replace('_', '.')}/{match.group('old')}"
+    return arxiv_id + (match.group('version') or '')
+
+
+def record_key(record: dict) -> str:
+    return record.get('arxiv_id') or record['source_path']
+
+
+def shard_paths(folder: str, prefix: str = 'corpus') -> List[str]:
+    """
+    :return: the closed shards in a folder, in the order they were written
+    """
+    if not os.path.isdir(folder):
+        return []
+    return sorted(os.path.join(folder, name) for name in os.listdir(folder)
+                  if fnmatch.fnmatch(name, f"{prefix}-*{ZSTD_SUFFIX}") or fnmatch.fnmatch(name, f"{prefix}-*{GZIP_SUFFIX}"))
+
+
+def is_corpus(folder: str, prefix: str = 'corpus') -> bool:
+    return bool(shard_paths(folder, prefix))
+
+
+def index_path(shard_path: str) -> str:
+    for suffix in (ZSTD_SUFFIX, GZIP_SUFFIX):
+        if shard_path.endswith(suffix):
+            return shard_path[:-len(suffix)] + INDEX_SUFFIX
+    raise ValueError(f"{shard_path} isn't a corpus shard")
+
+
+def compress(data: bytes, suffix: str) -> bytes:
+    if suffix == ZSTD_SUFFIX:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def decompress(data: bytes, shard_path: str) -> bytes:
+    if shard_path.endswith(ZSTD_SUFFIX):
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def open_shard(shard_path: str):
+    """
+    :return: a binary file of the shard's records, decompressed as it's read
+    """
+    if shard_path.endswith(ZSTD_SUFFIX):
+        # the stream reader can't be read by line itself
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(shard_path, 'rb'),
+                                                                            read_across_frames=True, closefd=True))
+    return gzip.open(shard_path, 'rb')
+
+
+class CorpusWriter:
+    """
+    Appends records to the shards in a folder, starting a new shard after the last one already there, so an earlier
+    run's shards are never rewritten. Converter worker processes return their records to the one writer in the parent.
+    """
+
+    def __init__(self, folder: str, prefix: str = 'corpus', shard_bytes: int = SHARD_BYTES,
+                 block_bytes: int = BLOCK_BYTES):
+        self.folder = folder
+        self.prefix = prefix
+        self.shard_bytes = shard_bytes
+        self.block_bytes = block_bytes
+        self.suffix = ZSTD_SUFFIX if zstandard else GZIP_SUFFIX
+        # the pipeline's conversion threads share the writer
+        self.lock = threading.RLock()
+        os.makedirs(folder, exist_ok=True)
+        self.shard_number = len(shard_paths(folder, prefix))
+        self.shard = None
+
+    def _open_shard(self):
+        self.shard_path = os.path.join(self.folder, f"{self.prefix}-{self.shard_number:05d}{self.suffix}")
+        self.shard = open(self._part(self.shard_path), 'wb')
+        self.index = sqlite3.connect(self._part(index_path(self.shard_path)), check_same_thread=False)
+        self.index.execute("CREATE TABLE IF NOT EXISTS record (key TEXT PRIMARY KEY, source_path TEXT, "
+                           "block_offset INTEGER NOT NULL, block_length INTEGER NOT NULL, line INTEGER NOT NULL)")
+        self.shard_size = 0
+        self.block, self.block_size, self.block_keys = [], 0, []
+        self.on_close = []
+
+    @staticmethod
+    def _part(path: str) -> str:
+        folder, name = os.path.split(path)
+        return os.path.join(folder, f".{name}.part")
+
+    def add(self, record: dict, closed: Callable[[str], None] = None) -> str:
+        """
+        :param record: with a source_path and, if it has one, an arxiv_id; the rest is up to the caller, eg text and
+        page_offsets from Converter, sections from Extractor
+        :param closed: called with the shard's path once the shard holding the record is closed and visible, eg to
+        note the record is safely written; never, if the writer isn't closed
+        :return: path the shard holding the record will have once it's closed
+        """
+        line = json.dumps(record, ensure_ascii=False).encode('UTF-8') + b'\n'
+        with self.lock:
+            if self.shard is None:
+                self._open_shard()
+            shard_path = self.shard_path
+            self.block_keys.append((record_key(record), record.get('source_path'), len(self.block)))
+            self.block.append(line)
+            self.block_size += len(line)
+            self.shard_size += len(line)
+            if closed:
+                self.on_close.append(closed)
+            if self.block_size >= self.block_bytes:
+                self._write_block()
+            if self.shard_size >= self.shard_bytes:
+                self._close_shard()
+            return shard_path
+
+    def _write_block(self):
+        if not self.block:
+            return
+        compressed = compress(b''.join(self.block), self.suffix)
+        offset = self.shard.tell()
+        self.shard.write(compressed)
+        self.index.executemany("INSERT OR REPLACE INTO record VALUES (?, ?, ?, ?, ?)",
+                               [(key, source_path, offset, len(compressed), line)
+                                for key, source_path, line in self.block_keys])
+        self.block, self.block_size, self.block_keys = [], 0, []
+
+    def _close_shard(self):
+        self._write_block()
+        self.shard.flush()
+        os.fsync(self.shard.fileno())
+        self.shard.close()
+        self.index.commit()
+        self.index.close()
+        # the index first, so a visible shard always has one
+        os.replace(self._part(index_path(self.shard_path)), index_path(self.shard_path))
+        os.replace(self._part(self.shard_path), self.shard_path)
+        logger.info(f"closed {self.shard_path}")
+        self.shard = None
+        self.shard_number += 1
+        for closed in self.on_close:
+            closed(self.shard_path)
+
+    def close(self):
+        with self.lock:
+            if self.shard is not None:
+                self._close_shard()
+
+
+class CorpusReader:
+    """
+    The records of the shards in a folder: all of them in order with records(), or one by its key with get()
+    """
+
+    def __init__(self, folder: str, prefix: str = 'corpus'):
+        self.shards = shard_paths(folder, prefix)
+        self.indexes = {}
+
+    def records(self) -> Iterator[dict]:
+        for shard_path in self.shards:
+            yield from self.shard_records(shard_path)
+
+    @staticmethod
+    def shard_records(shard_path: str) -> Iterator[dict]:
+        with open_shard(shard_path) as shard:
+            for line in shard:
+                yield json.loads(line)
+
+    def __iter__(self):
+        return self.records()
+
+    def _index(self, shard_path: str) -> sqlite3.Connection:
+        if shard_path not in self.indexes:
+            self.indexes[shard_path] = sqlite3.connect(f"file:{index_path(shard_path)}?mode=ro", uri=True)
+        return self.indexes[shard_path]
+
+    def _locate(self, key: str) -> Tuple[Optional[str], Optional[tuple]]:
+        for shard_path in reversed(self.shards):
+            row = self._index(shard_path).execute("SELECT block_offset, block_length, line FROM record WHERE key = ?",
+                                                  (key,)).fetchone()
+            if row:
+                return shard_path, row
+        return None, None
+
+    def latest_shard(self, key: str) -> Optional[str]:
+        """
+        :return: the path of the latest shard with a record under the key, the one get reads it from, or None
+        """
+        return self._locate(key)[0]
+
+    def get(self, key: str) -> Optional[dict]:
+        """
+        :param key: arXiv id with its version, or the source path of a document without one
+        :return: the record, from the latest shard that has it, or None
+        """
+        shard_path, row = self._locate(key)
+        if not row:
+            return None
+        block_offset, block_length, line = row
+        with open(shard_path, 'rb') as shard:
+            shard.seek(block_offset)
+            block = decompress(shard.read(block_length), shard_path)
+        return json.loads(block.split(b'\n')[line])
+
+    def keys(self) -> Set[str]:
+        """
+        :return: the key of every record in the shards, read from their indexes
+        """
+        return {key for shard_path in self.shards
+                for (key,) in self._index(shard_path).execute("SELECT key FROM record")}
+
+    def close(self):
+        for index in self.indexes.values():
+            index.close()
+        self.indexes = {}
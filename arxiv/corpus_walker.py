@@ -0,0 +1,48 @@
+import fnmatch
+import os
+from os import DirEntry
+from typing import Iterator, Sequence
+
+
+def walk_corpus(folder: str, patterns: Sequence[str] = None, recursive: bool = True, shard: int = 0,
+                shards: int = 1) -> Iterator[DirEntry]:
+    """
+    Stream the files of a corpus, depth first and sorted by name within each folder, so the order is the same on every
+    run and every host. One sorted listing is held per level of depth, that of each folder the walk is inside, and the
+    DirEntry objects carry their cached file types and stat results to the caller. Hidden files, such as downloads in
+    progress, are skipped.
+    :param folder: corpus root
+    :param patterns: glob patterns the file names have to match, eg ('*.pdf',); every file if None
+    :param recursive: whether to descend into subfolders
+    :param shard: with shards, which of them to yield, counting from 0
+    :param shards: split the corpus round robin into this many shards
+    """
+    index = 0
+    for entry in _walk(folder, patterns, recursive):
+        if index % shards == shard:
+            yield entry
+        index += 1
+
+
+def _walk(folder: str, patterns: Sequence[str], recursive: bool) -> Iterator[DirEntry]:
+    with os.scandir(folder) as scanner:
+        entries = sorted((entry for entry in scanner if not entry.name.startswith('.')), key=lambda entry: entry.name)
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            if recursive:
+                yield from _walk(entry.path, patterns, recursive)
+        elif entry.is_file() and (not patterns or any(fnmatch.fnmatch(entry.name, pattern) for pattern in patterns)):
+            yield entry
+
+
+def mirror_path(path: str, input_root: str, output_root: str, extension: str = None) -> str:
+    """
+    Where a file under input_root goes under output_root: the same relative path, optionally with a new extension.
+    Creates the folders on the way.
+    """
+    relative_path = os.path.relpath(os.path.abspath(path), os.path.abspath(input_root))
+    if extension is not None:
+        relative_path = os.path.splitext(relative_path)[0] + extension
+    output_path = os.path.join(output_root, relative_path)
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    return output_path
@@ -1,61 +1,284 @@
+import argparse
+import json
+import math
+import mmap
 import re
 import os
 import tempfile
+from collections import namedtuple, Counter
+from functools import partial
+from multiprocessing import Pool
+
+from corpus_shards import CorpusReader, CorpusWriter, arxiv_id_of, is_corpus
+from corpus_walker import walk_corpus, mirror_path
+
+
+CHUNKSIZE = 16  # conf, documents handed to a worker process at a time
+
+
+class SizeStatistics:
+    """
+    Streaming count, least, mean, greatest and standard deviation (Welford's algorithm), so the sizes of a whole
+    corpus of extracts never have to be held at once
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.sum_squares = 0.0  # of differences from the mean
+        self.least = None
+        self.greatest = None
+
+    def add(self, size:int):
+        self.count += 1
+        delta = size - self.mean
+        self.mean += delta / self.count
+        self.sum_squares += delta * (size - self.mean)
+        self.least = size if self.least is None else min(self.least, size)
+        self.greatest = size if self.greatest is None else max(self.greatest, size)
+
+    def as_dict(self) -> dict:
+        return dict(count=self.count, least=self.least, mean=round(self.mean, 1), greatest=self.greatest,
+                    stddev=round(math.sqrt(self.sum_squares / self.count), 1) if self.count else None)
+
+
+class RunReport:
+    """
+    What an extraction run did: documents scanned, documents with something extracted, extracts saved (by section,
+    when extracting sections) and the distribution of extract sizes in characters
+    """
+
+    def __init__(self):
+        self.scanned = 0
+        self.matched = 0
+        self.extracted = 0
+        self.sections = Counter()
+        self.sizes = SizeStatistics()
+
+    def add(self, extract_sizes:dict):
+        """
+        :param extract_sizes: the size of each extract saved from one document, by section name
+        """
+        self.scanned += 1
+        if extract_sizes:
+            self.matched += 1
+        for name, size in extract_sizes.items():
+            self.extracted += 1
+            self.sections[name] += 1
+            self.sizes.add(size)
+
+    def as_dict(self) -> dict:
+        return dict(scanned=self.scanned, matched=self.matched, extracted=self.extracted,
+                    sections=dict(self.sections), sizes=self.sizes.as_dict())
+
+    def __str__(self):
+        return json.dumps(self.as_dict(), indent=2)
 
 
 class Extractor:
     # keys are find patterns, values are extract functions
-    def __init__(self, match_extract:dict, content_folder:str = "."):
+    def __init__(self, match_extract:dict, content_folder:str = ".", patterns=('*.txt',), use_mmap:bool = True):
+        """
+        :param content_folder: a folder of text files, or of the corpus shards Converter writes
+        :param use_mmap: outline documents by running the header pattern over a memory map of the file's bytes, so
+        only the extracted sections are ever decoded into strings
+        """
         self.match_extract = match_extract
         self.content_folder = os.path.abspath(content_folder)
+        self.patterns = patterns
+        self.use_mmap = use_mmap
+
+    def documents(self, walk: bool = True):
+        """
+        the documents under the content folder: the records of its corpus shards, streamed in order, if it has any, or
+        else the paths of its text files
+        """
+        if is_corpus(self.content_folder):
+            yield from CorpusReader(self.content_folder).records()
+        else:
+            for entry in walk_corpus(self.content_folder, self.patterns, walk):
+                yield entry.path
+
+    def document_path(self, document) -> str:
+        """
+        :return: a document's text file, or where it would be for a corpus record
+        """
+        if isinstance(document, dict):
+            return os.path.join(self.content_folder, os.path.splitext(document['source_path'])[0] + '.txt')
+        return document
 
     def extract(self, path):
         """
-        For a given file path, test each find pattern against the content until one matches
+        For a given file path (or corpus record), test each find pattern against the content until one matches
         If a match is found, use the corresponding extract function to extract the desired text
 
         @:returns None if no pattern matched. ie, functions should never return None
         @:return extracted section of document
         """
-        with open(path, 'r', 8192) as file:
-            text = '\n'.join(file.readlines())
-            file.close()
+        if isinstance(path, dict):
+            return self.extract_from(path['text'])
+        if not self.use_mmap:
+            with open(path, 'r', 8192) as file:
+                return self.extract_from(file.read())
+        with open(path, 'rb') as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return self.extract_from('')  # mmap can't map an empty file
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as text:
+                return self.extract_from(text)
 
-        for(regex, func) in self.match_extract:
-            rgx:re.Pattern = regex
-            if rgx.findall(text).count() > 0:  # probably should use finditer
+    def extract_from(self, text):
+        """
+        :param text: a str, or a bytes-like object such as an mmap, which the find patterns are run over as bytes
+        """
+        for(regex, func) in self.match_extract.items():
+            rgx:re.Pattern = regex if isinstance(text, str) else bytes_pattern(regex)
+            if rgx.search(text):
                 return func(text)
 
+    def extract_sections(self, path, sections:dict) -> dict:
+        """
+        Pull several sections out of a document from one outline of its headers
+        :param sections: keys are names for the sections, values are patterns their titles match, as in SECTIONS
+        :return: the sections found, by name
+        """
+        if isinstance(path, dict):
+            return self.sections_in(path['text'], sections)
+        if not self.use_mmap:
+            with open(path, 'r', 8192) as file:
+                return self.sections_in(file.read(), sections)
+        with open(path, 'rb') as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return {}  # mmap can't map an empty file
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as text:
+                return self.sections_in(text, sections)
+
+    @staticmethod
+    def sections_in(text, sections:dict) -> dict:
+        outline = Outline(text)
+        found = {name: outline.section(title) for name, title in sections.items()}
+        return {name: section for name, section in found.items() if section}
+
+    def extract_all_sections(self, sections:dict, walk: bool = False):
+        """
+        emit the requested sections of every document
+        :return: a 3-tuple of path, section name, document section
+        """
+        for document in self.documents(walk):
+            for name, section in self.extract_sections(document, sections).items():
+                yield self.document_path(document), name, section
+
     def extract_all(self, walk: bool = False):
         """
         emit the discovered document sections
         :param walk: whether to descend into subfolders
         :return: a 2-tuple of path, document section
         """
-        for path in os.listdir(self.content_folder):
-            if walk and os.path.isdir(path):
-                for extractedWithPath in Extractor(path).extractAll(walk):
-                    yield extractedWithPath
-            elif os.path.isfile(path):
-                extracted = self.extract(path)
-                if extracted: # skip the blanks as well as the Nones
-                    yield path, extracted
+        for document in self.documents(walk):
+            extracted = self.extract(document)
+            if extracted: # skip the blanks as well as the Nones
+                yield self.document_path(document), extracted
+
+
+    def save_extract(self, abs_root:str, path:str) -> dict:
+        """
+        extract one document and save the extract at its mirrored path under abs_root
+        :return: the extract's size, keyed by the extract's name (none if nothing was extracted)
+        """
+        extracted = self.extract(path)
+        if not extracted:  # skip the blanks as well as the Nones
+            return {}
+        out_path = mirror_path(self.document_path(path), self.content_folder, abs_root)
+        with open(out_path, 'w+') as file:
+            file.write(extracted)
+        return {'extract': len(extracted)}
+
+    def save_sections(self, sections:dict, abs_root:str, path:str) -> dict:
+        """
+        extract the requested sections of one document, each saved at the document's mirrored path under a subfolder
+        of abs_root named for the section
+        :return: the size of each section saved, by name
+        """
+        sizes = dict()
+        for name, section in self.extract_sections(path, sections).items():
+            out_path = mirror_path(self.document_path(path), self.content_folder, os.path.join(abs_root, name))
+            with open(out_path, 'w+') as file:
+                file.write(section)
+            sizes[name] = len(section)
+        return sizes
+
+    def run(self, save, walk:bool, workers:int, chunksize:int = CHUNKSIZE) -> RunReport:
+        """
+        apply save to every document, on a process pool if there's more than one worker, and report on the run
+        """
+        report = RunReport()
+        if workers > 1:
+            with Pool(workers) as pool:
+                for extract_sizes in pool.imap_unordered(save, self.documents(walk), chunksize):
+                    report.add(extract_sizes)
+        else:
+            for extract_sizes in map(save, self.documents(walk)):
+                report.add(extract_sizes)
+        print(report)
+        return report
+
+    def section_record(self, sections:dict, document) -> dict:
+        """
+        extract the requested sections of one document for the corpus shards
+        :return: the document's record of its sections
+        """
+        if isinstance(document, dict):
+            arxiv_id, source_path = document.get('arxiv_id'), document['source_path']
+        else:
+            arxiv_id, source_path = arxiv_id_of(document), os.path.relpath(document, self.content_folder)
+        return dict(arxiv_id=arxiv_id, source_path=source_path, sections=self.extract_sections(document, sections))
+
+    def extract_all_sections_to_corpus(self, sections:dict, corpus_folder:str, walk:bool = True, workers:int = 1,
+                                       chunksize:int = CHUNKSIZE) -> RunReport:
+        """
+        Save the requested sections of each document as a record in the corpus shards in corpus_folder, rather than a
+        file per section; the worker processes extract and this one writes
+        :return: report of documents scanned and matched, sections saved and their sizes
+        """
+        writer = CorpusWriter(corpus_folder, prefix='sections')
 
+        def save(record: dict) -> dict:
+            if record['sections']:
+                writer.add(record)
+            return {name: len(section) for name, section in record['sections'].items()}
 
-    def extract_and_save_all(self, root_folder=os.path.join(tempfile.gettempdir(), str(os.getpid()))):
+        report = RunReport()
+        extract = partial(self.section_record, sections)
+        if workers > 1:
+            with Pool(workers) as pool:
+                for record in pool.imap_unordered(extract, self.documents(walk), chunksize):
+                    report.add(save(record))
+        else:
+            for record in map(extract, self.documents(walk)):
+                report.add(save(record))
+        writer.close()
+        print(report)
+        return report
+
+    def extract_and_save_all(self, root_folder=os.path.join(tempfile.gettempdir(), str(os.getpid())), walk: bool = True,
+                             workers:int = 1) -> RunReport:
         """
         For any document matching a pattern, extract the desired section using the corresponding function
         :param root_folder: folder to which to save extracts... they'll have the same path the original had relative to
         the content root
-        :return: count of successfully saved documents # todo add statistics on size least mean greatest stddev
+        :param walk: whether to descend into subfolders
+        :param workers: processes extracting in parallel
+        :return: report of documents scanned and matched, extracts saved and their sizes: least mean greatest stddev
         """
-        abs_root = os.path.abspath(root_folder)
-        re_content_folder = re.compile(f"^({self.content_folder}")
-        path:str = ''
-        for path, extracted in self.extract_all():
-            out_path = re_content_folder.sub(abs_root, path)
-            with open(out_path, 'w+') as file:
-                file.write(extracted)
+        return self.run(partial(self.save_extract, os.path.abspath(root_folder)), walk, workers)
+
+    def extract_and_save_all_sections(self, sections:dict, root_folder=os.path.join(tempfile.gettempdir(), str(os.getpid())),
+                                      walk: bool = True, workers:int = 1) -> RunReport:
+        """
+        Save each requested section of each document in a subfolder of root_folder named for the section, at the path
+        the document had relative to the content root
+        :return: report of documents scanned and matched, sections saved and their sizes
+        """
+        return self.run(partial(self.save_sections, sections, os.path.abspath(root_folder)), walk, workers)
 
 roman_numeral:re.Pattern = re.compile("(M{0,2}C?M)?(C?D)?(C{0,2}X?C)?(X?L)?(X{0,2}I?X)?(I?V)?I{0,3}")
 def increment_roman_numeral(rn:str):
@@ -69,11 +292,11 @@ def increment_roman_numeral(rn:str):
     :param rn:
     :return:
     """
-    if not roman_numeral.match(rn):
+    if not roman_numeral.fullmatch(rn):
         return None
     if rn.endswith('III'):
         if rn.endswith('VIII'):
-            return rn.replace('IX')
+            return rn[:-4] + 'IX'
         else:
             return rn.replace('III', 'IV')
     elif rn.endswith('IX') and len(rn) > 3 and rn[-4] == 'X':
@@ -88,37 +311,136 @@ def increment_roman_numeral(rn:str):
         return f"{rn}I"
 
 
+# a numbered section header on a line of its own, eg 'II. BACKGROUND' or '2 Related Work'; subsection numbers like
+# 2.1 don't match, as their title would have to start with the digit after the period
+header_pattern:re.Pattern = re.compile(
+    f"^[ \\t]*(?P<number>\\d{{1,2}}|(?=[MDCLXVI])(?:{roman_numeral.pattern}))(?:[.]|[ \\t])[ \\t]*"
+    f"(?P<title>[A-Z][A-Za-z ,:&/'-]{{1,80}}?)[ \\t]*$", re.MULTILINE)
+
+
+
+def bytes_pattern(pattern:re.Pattern) -> re.Pattern:
+    """
+    :return: a str pattern compiled to match bytes, to scan memory mapped files without decoding them; the pattern has
+    to be ASCII
+    """
+    if isinstance(pattern.pattern, bytes):
+        return pattern
+    return re.compile(pattern.pattern.encode('ascii'), pattern.flags & ~re.UNICODE)
+
+
+header_bytes_pattern:re.Pattern = bytes_pattern(header_pattern)
+
+
+
+Header = namedtuple('Header', ['number', 'title', 'start', 'end'])
+
+
+def next_number(number:str) -> str:
+    return str(int(number) + 1) if number.isdigit() else increment_roman_numeral(number)
+
+
+def title_like(title:str) -> bool:
+    """
+    :return: whether a header's title is capitalized as a section title is, eg 'Related Work' or 'BACKGROUND', rather
+    than as a sentence, eg 'We prove it sound'; words of three letters or less don't count
+    """
+    return all(word[0].isupper() for word in title.split() if len(word) > 3)
+
+
+class Outline:
+    """
+    The numbered top level sections of a document, found in one linear scan of the text. The text can be a str or a
+    bytes-like object such as an mmap, which is scanned as bytes; only the sections asked for get decoded.
+
+    Every line that looks like a numbered header is a candidate; the outline is the longest run of candidates numbered
+    1, 2, 3... (or I, II, III...) in document order, which leaves out numbered list items and stray numbers that merely
+    look like headers. Of runs as long, the one with the most titles capitalized as titles wins, so a numbered list
+    right after '1 Introduction' doesn't stand in for the sections. Each section runs from the end of its header line
+    to the start of the next header.
+    """
+
+    def __init__(self, text:str):
+        self.text = text
+        is_str = isinstance(text, str)
+        candidates = {'arabic': [], 'roman': []}
+        for match in (header_pattern if is_str else header_bytes_pattern).finditer(text):
+            number = match.group('number') if is_str else match.group('number').decode('ascii')
+            title = match.group('title') if is_str else match.group('title').decode('ascii')
+            candidates['arabic' if number.isdigit() else 'roman'].append(
+                Header(number, title.strip(), match.start(), match.end()))
+        self.headers = max((self.best_run(headers, first) for headers, first in
+                            ((candidates['arabic'], '1'), (candidates['roman'], 'I'))), key=lambda run: run[0])[1]
+
+    @staticmethod
+    def best_run(candidates:list, first:str) -> tuple:
+        """
+        :param candidates: headers numbered in one style, in document order
+        :return: ((length, title like headers), headers) of the best run numbered from first, by length and then title
+        like headers; a dynamic program over the candidates, keeping the best run so far that each number would extend
+        """
+        extending = {first: ((0, 0), [])}
+        for header in candidates:
+            if header.number not in extending:
+                continue
+            (length, titled), run = extending[header.number]
+            score = (length + 1, titled + title_like(header.title))
+            following = next_number(header.number)
+            if following not in extending or score > extending[following][0]:
+                extending[following] = (score, run + [header])
+        return max(extending.values(), key=lambda run: run[0])
+
+    def section(self, title:str):
+        """
+        :param title: pattern the section title has to match, case insensitively, from its start
+        :return: the text of the first section with a matching title, or None
+        """
+        title_pattern = re.compile(title, re.IGNORECASE)
+        for index, header in enumerate(self.headers):
+            if title_pattern.match(header.title):
+                end = self.headers[index + 1].start if index + 1 < len(self.headers) else len(self.text)
+                section = self.text[header.end:end]
+                if not isinstance(section, str):
+                    section = section.decode('utf-8', errors='replace')
+                return section.strip('\n')
+        return None
+
+
+# section names and the patterns their titles match
+SECTIONS = {
+    'background': 'BACKGROUND',
+    'related_work': 'RELATED\\s+WORKS?|PRIOR\\s+WORK',
+    'methods': 'METHODS?\\b|METHODOLOGY|APPROACH',
+}
+
+
+def extract_background(text:str) -> str:
+    # Don't return None -- that's the signal the match failed
+    return Outline(text).section(SECTIONS['background']) or ''
+
+
 def load_match_extract() -> dict:
     # find a 'BACKGROUND" section preceded by an Arabic or Roman numeral
-    one_match = re.compile(f"^\\s*(\\d+|{roman_numeral.pattern})[.]|\\s*BACKGROUND")
-
-    def one_func(text:str) -> str:
-        extract = '' # Don't return None -- that's the signal the match failed
-        for item in one_match.finditer(text):
-            startpos = item.end + 1
-            # OK, get this section's number
-            number = text[item.start(1):item.end(1)]
-            print(f"found number {number}")
-            if roman_numeral.match(number) is None:
-                next_index = number + 1
-            else:
-                next_index:str = increment_roman_numeral(number)
-            next_header = f"^\\s*{next_index}[.]\\s*[ A-Z]+"
-            for follow in re.finditer(next_header, text):
-                endpos = follow.start()
-                if endpos < startpos:
-                    continue
-                extract = text[startpos:endpos]
-                break
-            break
-        return extract
-    # Send back the list of match patterns and extract functions
-    return {one_match:one_func}
+    one_match = re.compile(f"^[ \\t]*(\\d+|{roman_numeral.pattern})[.]?[ \\t]*BACKGROUND", re.MULTILINE | re.IGNORECASE)
+    # Send back the list of match patterns and extract functions; module level functions, so worker processes can
+    # unpickle them
+    return {one_match:extract_background}
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Extract the BACKGROUND, RELATED WORK and METHODS sections of a corpus")
+    parser.add_argument('content_folder', nargs='?', default="text/computing")
+    parser.add_argument('output_folder', nargs='?', default=os.path.join(tempfile.gettempdir(), str(os.getpid())))
+    parser.add_argument('workers', nargs='?', type=int, default=1, help="extraction processes")
+    parser.add_argument('--corpus', action='store_true',
+                        help="write compressed corpus shards to the output folder instead of a file per section")
+    arguments = parser.parse_args()
     match_extract = load_match_extract()
-    Extractor(match_extract, "text/computing").extract_and_save_all()
+    extractor = Extractor(match_extract, arguments.content_folder)
+    if arguments.corpus:
+        extractor.extract_all_sections_to_corpus(SECTIONS, arguments.output_folder, workers=arguments.workers)
+    else:
+        extractor.extract_and_save_all_sections(SECTIONS, arguments.output_folder, workers=arguments.workers)
 
 
 if __name__ == '__main__':
@@ -1,19 +1,48 @@
+import asyncio
+import threading
 import time
 
 from sickle_impl import Sickle_Impl, getLogger, to_ordinal, detect_refresh_request, ns
+from harvest_state import HarvestState
+from catalog import Catalog
+from http_client import HttpClient, ValidatorStore, get_client, set_client
+from work_queue import WorkQueue
+from pdf_store import PdfStore, STORE_ROOT, arxiv_key, get_store, set_store
+from query_cache import QueryCache
+from response_cache import OfflineCacheMiss, RESPONSE_TTL, ResponseCache
+from query_shards import FIRST_SUBMISSION, MINUTE, RESULT_CEILING, SUBMITTED_FORMAT, ShardLog, split_date_range
+from metrics import add_metrics_arguments, registry, start_metrics
 
 MAX_DELAY = 18000
+CHUNK_SIZE = 65536  # conf
+MAX_PDF_BYTES = 100 * 1024 * 1024  # conf, larger PDFs are skipped
+DOWNLOAD_TRIALS = 20  # conf, attempts at a PDF before its download fails
+MAX_PAGE_BYTES = 1024 * 1024  # most of a non-PDF response we read looking for a refresh request or 'No PDF' title
+ASYNC_CONCURRENCY = 1000  # conf, downloads in flight on the asyncio engine, most of them waiting their turn
+ID_BATCH_SIZE = 50000  # conf
+ID_LIST_SIZE = 2000  # conf, ids per metadata query; the API pages at most 2000 entries, so each query is one page
+IDS_QUEUE = 'ids'
+PDFS_QUEUE = 'pdfs'
+POLL_INTERVAL = 10  # conf, seconds an idle worker waits before looking at its queue again
+IDLE_TIMEOUT = 600  # conf, seconds a worker waits on an empty queue before it stops
 base_url = "http://export.arxiv.org/api/query?"
+import argparse
 import sys
 import requests  # https://requests.readthedocs.io/en/master/api/
 # import pdftotext
 from concurrent import futures
 from concurrent.futures import ThreadPoolExecutor
+import io
+import itertools
 import logging
 import os
+import re
+import tempfile
 from urllib import parse
 from lxml import etree
-from typing import List
+from collections import namedtuple
+from datetime import datetime
+from typing import Callable, Iterator, List, Tuple
 
 """
 https://arxiv.org/help/api/tou
@@ -30,12 +59,10 @@ logger.info("Logger initialized")
 # SET UP EXECUTOR
 executor = ThreadPoolExecutor(20, "arxiv_getter_")
 
-# SHOW RUNTIME ARGUMENTS
-print("; ".join(sys.argv))
+# defaults; main takes both from the command line
+topic = 'computing'
 
-topic = sys.argv[1]
-
-max_records = int(sys.argv[2])  # conf
+max_records = 2000  # conf
 
 # hard code the forty arXiv CS categories; they're unlikely to change before the whole system's replaced
 arxiv_categories = {
@@ -47,6 +74,24 @@ arxiv_categories_querystring = '+OR+'.join(
 
 # determine if downloaded bytes are marked as a PDF document
 pdf_test = lambda response_content: response_content[:4] == b'%PDF'
+BOM = b'\xef\xbb\xbf'
+ATOM_ENTRY = '{http://www.w3.org/2005/Atom}entry'
+OPENSEARCH_FIELDS = tuple(f"{{{ns['opensearch']}}}{name}" for name in ('totalResults', 'startIndex', 'itemsPerPage'))
+# what parse_feed kept of a page of a metadata query's results
+FeedPage = namedtuple('FeedPage', ['values', 'records_returned', 'total_results', 'start_index', 'items_per_page'])
+
+metadata_queries = registry.counter('metadata_queries_total', "metadata queries by HTTP status", ['status'])
+metadata_query_seconds = registry.histogram('metadata_query_seconds',
+                                            "metadata queries, from the rate limiter to the last byte")
+metadata_query_bytes = registry.counter('metadata_query_bytes_total', "bytes of metadata query responses")
+pdf_downloads = registry.counter('pdf_downloads_total',
+                                 "download_pdf calls by outcome: saved, stored (already had it), unchanged (304), "
+                                 "no_pdf, too_large or failed", ['outcome'])
+pdf_download_seconds = registry.histogram('pdf_download_seconds',
+                                          "download_pdf calls, including the rate limiter and every retry")
+pdf_download_bytes = registry.counter('pdf_download_bytes_total', "bytes of PDFs saved")
+backoff_seconds = registry.counter('backoff_seconds_total',
+                                   "seconds of retry backoff and of waits arXiv asked for, by where", ['stage'])
 
 
 def str2dict(tokens: str, field_delimiter=';', pair_delimiter='='):
@@ -115,56 +160,102 @@ def link_from_entry(entry: etree._Element):
 
 
 # TODO change to a POST request limiting to the passed IDs
-def query_arXiv(id_batch: List[str], base_url=base_url, max_records=max_records, batch_number=0, topic=topic, year=None,
-                delay_s=3):
+def query_arXiv(id_batch: List[str], base_url=base_url, max_records=max_records, batch_number=0, topic=topic,
+                submitted: Tuple[str, str] = None, delay_s=3, client: HttpClient = None, refresh: bool = False):
     """
     reaches out to legacy arXiv query service
     NOTE The sort order is hard coded here
+    :param submitted: restrict to articles submitted in this range of submitted_range timestamps; the pages of such a
+    query are in submission order, so they stay put as articles are updated
+    :param refresh: a retry of a query whose response was no good; a cached response to it is dropped, not replayed
     @:return byte array response from http call
     """
     # requests.get('http://export.arxiv.org/api/query?max_results=200&start=0&search_query=cat:cs+AND+all:computing&sort_by=lastUpdatedDate&sort_order=descending')
     query_text = f'({arxiv_categories_querystring})+AND+all:{topic}'
-    logger.info(f"In {delay_s} seconds, attempting metadata query {batch_number}")
-    time.sleep(delay_s)
+    if submitted:
+        query_text += f'+AND+submittedDate:[{submitted[0]}+TO+{submitted[1]}]'
+    client = client or get_client()
     data: dict = dict(max_results=max_records
                       , start=batch_number * max_records
                       , search_query=query_text
-                      , sort_by='lastUpdatedDate'
-                      , sort_order='descending'
-                      , id_list=','.join(id_batch))
-    query_response = requests.post(base_url, data)
+                      , sort_by='submittedDate' if submitted else 'lastUpdatedDate'
+                      , sort_order='ascending' if submitted else 'descending')
+    if id_batch:
+        data['id_list'] = ','.join(id_batch)
+    if refresh:
+        client.forget('POST', base_url, data=data)
+    if client.cached('POST', base_url, data=data):
+        # a cached response costs arXiv nothing, so nothing waits for it
+        logger.info(f"Answering metadata query {batch_number} from the response cache")
+        delay_s = 0
+    # the rate limiter spaces queries at the permitted rate; a longer retry delay backs off every thread
+    if delay_s > client.limiter.interval:
+        backoff_seconds.inc(delay_s, stage='query')
+        client.limiter.defer(delay_s)
+    logger.info(f"In {max(delay_s, client.limiter.interval)} seconds, attempting metadata query {batch_number}")
+    with metadata_query_seconds.time():
+        query_response = client.post(base_url, data)
+    metadata_queries.inc(status=query_response.status_code)
     if query_response.status_code == 200:
+        metadata_query_bytes.inc(len(query_response.content))
         return query_response.content
     else:
         logging.error(f'query failed with http status code {query_response.status_code}')
         raise Exception(f"failed query {batch_number} {max_records} {topic}")
 
 
-def get_pdf_links(id_batch: List[str], topic, batch_number=0, max_records=max_records, init_delay_s=3, ns: dict = ns):
+def parse_feed(response_bytes: bytes, handle: Callable[[etree._Element], object] = None) -> FeedPage:
+    """
+    One streaming pass over a page of Atom feed: each entry is handed to handle as soon as it has been parsed, and
+    cleared once it has, so the page is never held as a whole tree, and the opensearch totals are picked up on the way
+    :param handle: what to keep of an entry, eg its pdf link if it qualifies; None is not kept
+    :return: what handle kept, in feed order, with the entry count and opensearch totals
+    """
+    values, records_returned, totals = [], 0, {}
+    for event, element in etree.iterparse(io.BytesIO(response_bytes), events=('end',),
+                                          tag=(ATOM_ENTRY,) + OPENSEARCH_FIELDS):
+        if element.tag == ATOM_ENTRY:
+            records_returned += 1
+            value = handle(element) if handle else None
+            if value is not None:
+                values.append(value)
+        else:
+            totals[element.tag] = int(element.text)
+        element.clear()
+        # and the entries before it, which clear leaves in the feed
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+    missing = [field for field in OPENSEARCH_FIELDS if field not in totals]
+    if missing:
+        raise ValueError(f"no {', '.join(missing)} in the metadata query response")
+    return FeedPage(values, records_returned, *(totals[field] for field in OPENSEARCH_FIELDS))
+
+
+def query_feed(id_batch: List[str], topic, batch_number=0, max_records=max_records, init_delay_s=3, ns: dict = ns,
+               submitted: Tuple[str, str] = None, handle: Callable[[etree._Element], object] = None):
     """
     arXiv API user's manual: https://arxiv.org/help/api/user-manual
-    :return (whether arXiv returned as many entried as requested, filtered list of pdf download links)
+    :param handle: what to keep of each entry, as parse_feed
+    :return the FeedPage of a metadata query, retried with a Fibonacci backoff until it's complete; None if it never was
     """
     # set up the retry backoff
     last_delay = 0
     current_delay = init_delay_s
-    retry = True
-    while (retry and current_delay < MAX_DELAY):
+    while current_delay < MAX_DELAY:
         try:
             # We can't use requests.get's query string builder as it url encodes colons and spaces, which arXiv does not permit
-            response_bytes = query_arXiv(id_batch, base_url, max_records, batch_number, topic, current_delay)
+            # a retry must not replay the incomplete response the client cached from the last attempt
+            response_bytes = query_arXiv(id_batch, base_url, max_records, batch_number, topic, submitted,
+                                         delay_s=current_delay, refresh=last_delay > 0)
             # 4. Find sections with something like 'grep -E '^\s*((I?(X(I?V)?|V)I?)|I)I{0,2}\.\s+[A-Z]\s?[A-Z]+' computing/*.txt'
             # 5. Store each section in a subfolder named for the section title
-            response_tree: etree._Element = etree.fromstring(response_bytes)
-            pdf_links = [link_from_entry(entry) for entry in
-                         response_tree.getiterator('{http://www.w3.org/2005/Atom}entry') if qualify_entry(entry, ns)]
+            feed_page = parse_feed(response_bytes, handle)
             # Calculate the total entries; this will tell you if you're on the last page
-            records_returned = len(response_tree.findall('atom:entry', ns))
-            (total_results, start_index, items_per_page) = map(
-                lambda param: int(response_tree.find(f"opensearch:{param}", ns).text)
-                , ('totalResults', 'startIndex', 'itemsPerPage')
-            )
+            (records_returned, total_results, start_index, items_per_page) = feed_page[1:]
             retry = (start_index + items_per_page <= total_results) and (records_returned < items_per_page)
+        except OfflineCacheMiss:
+            # retrying the replay won't find the response
+            raise
         except Exception as exc:
             logger.error(exc)
             retry = True
@@ -179,16 +270,28 @@ def get_pdf_links(id_batch: List[str], topic, batch_number=0, max_records=max_re
             logger.info(f'''query return {records_returned} total entries, whereas we have only found {start_index}
 of an expected {total_results}.''')
         else:
-            logger.info(f'query returned {records_returned} total entries and {len(pdf_links)} qualified entries')
-            return (records_returned == max_records, pdf_links)
+            return feed_page
     # We kept trying, but we didn't make it
-    return (False, None)
+
+
+def get_pdf_links(id_batch: List[str], topic, batch_number=0, max_records=max_records, init_delay_s=3, ns: dict = ns,
+                  submitted: Tuple[str, str] = None):
+    """
+    :return (whether arXiv returned as many entried as requested, filtered list of pdf download links)
+    """
+    feed_page = query_feed(id_batch, topic, batch_number, max_records, init_delay_s, ns, submitted,
+                           lambda entry: link_from_entry(entry) if qualify_entry(entry, ns) else None)
+    if feed_page is None:
+        return (False, None)
+    pdf_links, records_returned = feed_page.values, feed_page.records_returned
+    logger.info(f'query returned {records_returned} total entries and {len(pdf_links)} qualified entries')
+    return (records_returned == max_records, pdf_links)
 
 
 def yield_pdf_links(id_batch: List[str], query_text: str, max_records: int):
     batch_index = 0
     logger.debug("reset batch id")
-    # TODO catch the big-topic exception if the number is over 50,000 and break the query up by year
+    # a topic wide search, which can have more results than the API serves, is yield_sharded_pdf_links
     more_batches = True
     while more_batches == True:
         (more_batches, pdf_links) = get_pdf_links(id_batch, query_text, batch_index, max_records)
@@ -197,93 +300,671 @@ def yield_pdf_links(id_batch: List[str], query_text: str, max_records: int):
         batch_index += 1
 
 
-def download_pdf(target_dir: str, pdf_url: str):
+def count_results(topic: str, submitted: Tuple[str, str] = None) -> int:
+    """
+    :return: opensearch:totalResults of a search, probed with a query for no entries
+    """
+    feed_page = query_feed([], topic, 0, 0, submitted=submitted)
+    if feed_page is None:
+        raise Exception(f"failed to count the results of {topic} submitted {submitted}")
+    return feed_page.total_results
+
+
+def yield_sharded_pdf_links(topic: str, max_records: int = max_records, since: datetime = FIRST_SUBMISSION,
+                            until: datetime = None, log: ShardLog = None, ceiling: int = RESULT_CEILING):
+    """
+    Every page of a topic wide search, however many results it has. The submission dates are split, by probing, into
+    shards that each fit under the API's result ceiling, and the shards are fetched page by page in submission order.
+    With a log, the plan and each page fetched are recorded as they go, so a re-run resumes where the last one stopped,
+    and once a search is done, the next one without an until only covers what was submitted since.
+    :return: the pdf links of each page's qualified entries; None if a query failed, after which it stops
+    """
+    log = log or ShardLog(':memory:')
+    start, since = since, since.strftime(SUBMITTED_FORMAT)
+    until = until.strftime(SUBMITTED_FORMAT) if until else log.unfinished(topic, since)
+    shards = until and log.shards(topic, since, until)
+    if not shards:
+        covered = log.covered(topic, since)
+        if covered and not until:
+            start = max(start, datetime.strptime(covered, SUBMITTED_FORMAT) + MINUTE)
+        until = until or time.strftime(SUBMITTED_FORMAT, time.gmtime())
+        if start > datetime.strptime(until, SUBMITTED_FORMAT):
+            logger.info(f"the {topic} search is up to date")
+            return
+        shards = log.plan(topic, since, until, split_date_range(
+            lambda submitted: count_results(topic, submitted), start, datetime.strptime(until, SUBMITTED_FORMAT),
+            ceiling))
+        logger.info(f"split the {topic} search into {len(shards)} shards of {sum(shard.total for shard in shards)}"
+                    f" results")
+    for shard in shards:
+        if shard.next_start >= shard.total:
+            continue
+        # a page starts where the last run stopped, even if max_records has changed since
+        batch_number = shard.next_start // max_records
+        while batch_number * max_records < min(shard.total, ceiling):
+            (more_batches, pdf_links) = get_pdf_links([], topic, batch_number, max_records,
+                                                      submitted=(shard.start, shard.end))
+            yield pdf_links
+            if pdf_links is None:
+                return
+            batch_number += 1
+            log.advance(topic, since, until, shard, batch_number * max_records)
+            if not more_batches:
+                break
+        log.advance(topic, since, until, shard, shard.total)
+        logger.debug(f"completed shard {shard.start} to {shard.end}")
+
+
+def entry_id(entry: etree._Element, ns: dict = ns) -> str:
+    """
+    :return: the arXiv id of a feed entry, without its version, as the OAI harvest has it
+    """
+    # eg http://arxiv.org/abs/2101.00001v1 or http://arxiv.org/abs/cs/0112017v1
+    return re.sub(r'v\d+$', '', entry.find('atom:id', ns).text.split('/abs/')[-1])
+
+
+def plan_id_chunks(id_batch: List[str], cached: dict, chunk_size: int = ID_LIST_SIZE):
+    """
+    Split a batch of ids into id_list chunks of the ids the cache doesn't have, each small enough to come back in one
+    page, so no query is paged and no page re-sends the id list
+    :return: (span, chunk) pairs: every id since the last chunk, in order and without duplicates, and those to query
+    """
+    span, chunk = [], []
+    for arxiv_id in dict.fromkeys(id_batch):
+        span.append(arxiv_id)
+        if arxiv_id not in cached:
+            chunk.append(arxiv_id)
+            if len(chunk) == chunk_size:
+                yield span, chunk
+                span, chunk = [], []
+    if span:
+        yield span, chunk
+
+
+def yield_planned_pdf_links(id_batch: List[str], topic: str, cache: QueryCache = None,
+                            chunk_size: int = ID_LIST_SIZE):
+    """
+    The pdf links of the qualified articles in a batch of ids, as yield_pdf_links, in as few throttled queries as
+    plan_id_chunks makes of it. Ids the cache has are answered from it; the results of the rest are added to it.
+    :return: for each chunk, the pdf links of its qualified ids in the order of id_batch; None if its query failed
+    """
+    cached = cache.get(topic, id_batch) if cache else {}
+    logger.debug(f"{len(cached)} of {len(id_batch)} ids already queried on {topic}")
+    for span, chunk in plan_id_chunks(id_batch, cached, chunk_size):
+        if chunk:
+            feed_page = query_feed(chunk, topic, 0, len(chunk), handle=lambda entry: (
+                entry_id(entry), link_from_entry(entry) if qualify_entry(entry, ns) else None))
+            if feed_page is None:
+                yield None
+                continue
+            # ids the topic search didn't return are as settled as those that didn't qualify
+            results = dict.fromkeys(chunk)
+            results.update((arxiv_id, link) for arxiv_id, link in feed_page.values if arxiv_id in results)
+            if cache and feed_page.records_returned < feed_page.total_results:
+                # a feed short of its own total may have left out ids that qualify; only those it had are settled
+                logger.warning(f"feed of {feed_page.records_returned} of {feed_page.total_results} results, "
+                               f"caching only the ids it returned")
+                cache.put(topic, {arxiv_id: results[arxiv_id] for arxiv_id, link in feed_page.values
+                                  if arxiv_id in results})
+            elif cache:
+                cache.put(topic, results)
+            cached.update(results)
+            logger.info(f"queried {len(chunk)} ids, {sum(1 for link in results.values() if link)} qualified")
+        yield [cached[arxiv_id] for arxiv_id in span if cached[arxiv_id]]
+
+
+def first_chunk(chunks: Iterator[bytes]) -> bytes:
+    """
+    :param chunks: a streamed response body
+    :return: the first chunk with content, without leading whitespace or the UTF-8 byte order mark some PDFs start with
+    """
+    for chunk in chunks:
+        chunk = chunk.lstrip()
+        if chunk:
+            return chunk[3:] if chunk[0:3] == BOM else chunk
+    return b''
+
+
+def read_limited(head: bytes, chunks: Iterator[bytes], limit: int = MAX_PAGE_BYTES) -> bytes:
+    """
+    :return: the rest of a (non-PDF) response body, up to limit bytes
+    """
+    page = bytearray(head)
+    for chunk in chunks:
+        if len(page) >= limit:
+            break
+        page.extend(chunk)
+    return bytes(page[:limit])
+
+
+def save_pdf(pdf_path: str, head: bytes, chunks: Iterator[bytes], max_bytes: int = MAX_PDF_BYTES) -> bool:
+    """
+    Stream a PDF to a hidden temporary file beside pdf_path, then fsync it and rename it into place, so pdf_path only
+    ever exists complete
+    :return: whether the PDF was saved; it isn't if it's larger than max_bytes
+    """
+    directory, file_name = os.path.split(pdf_path)
+    too_large = False
+    with tempfile.NamedTemporaryFile('wb', dir=directory or '.', prefix=f".{file_name}.", suffix='.part',
+                                     delete=False) as part:
+        try:
+            size = 0
+            for chunk in itertools.chain([head], chunks):
+                size += len(chunk)
+                if max_bytes and size > max_bytes:
+                    too_large = True
+                    break
+                part.write(chunk)
+            part.flush()
+            os.fsync(part.fileno())
+        except BaseException:
+            part.close()
+            os.unlink(part.name)
+            raise
+    if too_large:
+        logger.error(f"{pdf_path} is over the {max_bytes} byte limit, abandoning it")
+        os.unlink(part.name)
+        return False
+    os.replace(part.name, pdf_path)
+    pdf_download_bytes.inc(size)
+    return True
+
+
+def stored_pdf(pdf_path: str, pdf_url: str, store: PdfStore = None):
+    """
+    :return: the pdf at pdf_path, linked from the store if it has it, or None if it has to be downloaded
+    """
+    key = store and arxiv_key(pdf_url)
+    if key and store.get(*key):
+        logger.debug(f"{pdf_url} already in the store")
+        return store.link(*key, pdf_path)
+    if os.path.exists(pdf_path):
+        logger.debug(f"{pdf_path} already downloaded")
+        # downloaded before there was a store
+        return store_pdf(pdf_path, pdf_url, store)
+
+
+def store_pdf(pdf_path: str, pdf_url: str, store: PdfStore = None) -> str:
+    """
+    :return: path to the saved pdf, once the store (if any) has it
+    """
+    key = store and arxiv_key(pdf_url)
+    return store.add(*key, pdf_path, pdf_url) if key else pdf_path
+
+
+@pdf_download_seconds.timed
+def download_pdf(target_dir: str, pdf_url: str, refresh: bool = False, client: HttpClient = None,
+                 max_bytes: int = MAX_PDF_BYTES, store: PdfStore = None):
     """
     :param target_dir: directory in which to store the downloaded article in Adobe's portable document format
     :param pdf_url: link to pdf
-    :return: path to saved pdf file or None if the download failed
+    :param refresh: ask arXiv whether an already downloaded pdf has changed, and download it again if it has
+    :param client: HTTP client, the shared one by default
+    :param max_bytes: skip PDFs larger than this
+    :param store: content addressed store shared by every topic, the process-wide one (if set) by default
+    :return: path to saved pdf file, or None if arXiv has no PDF for the link or it's over max_bytes
+    :raises requests.exceptions.RetryError: once every trial has failed, so the download can be tried again later
     """
+    client = client or get_client()
+    store = store or get_store()
     pdf_path = f'{target_dir}/{url_to_file_name(pdf_url)}.pdf'
-    if os.path.exists(pdf_path):
-        logger.debug(f"{pdf_path} already downloaded")
-        return pdf_path
+    if not refresh:
+        saved_path = stored_pdf(pdf_path, pdf_url, store)
+        if saved_path:
+            pdf_downloads.inc(outcome='stored')
+            return saved_path
+    already_downloaded = os.path.exists(pdf_path)
     logger.debug(f"""\n\n\n*** DOWNLOADING FOR ARTICLE {pdf_url} ***""")
     is_pdf = False
     # retrieve the pdf file
     # set up a fibonacci backoff
     last_backoff = 0
     backoff = 1  # conf
-    for trial in range(20):  # conf
+    for trial in range(DOWNLOAD_TRIALS):
         # Fibonacci elements and cumulative wait times in seconds and hours
         #   1   1   2   3   5   8   13      21      34      55      89      144     233     377     610     987         1597            2584            4181            6765
         #   1   2   4   7   12  20  33      54      88      143     232     376     609     986     1596    2583        4180            6764            10945           17020
         #                                                                                                               1:09:40         1:52:44         3:02:25         4:43:40
-        pdf_response = requests.get(pdf_url)
-        http_status = pdf_response.status_code
-        pdf_bytes = pdf_response.content.strip()
-        # Some PDFs start with a UTF-8 byte order mark
-        if b'\xef\xbb\xbf' == pdf_bytes[0:3]:
-            pdf_bytes=pdf_bytes[3:]
-            logger.debug(f"removed leading BOM from {pdf_url} returned with HTTP status {http_status}")
+        with client.stream(pdf_url, conditional=already_downloaded, remember=True) as pdf_response:
+            http_status = pdf_response.status_code
+            if http_status == 304:
+                logger.debug(f"{pdf_path} is unchanged since it was downloaded")
+                pdf_downloads.inc(outcome='unchanged')
+                return pdf_path
+            # only the first chunk is needed to tell a PDF from an arXiv error page
+            chunks = pdf_response.iter_content(CHUNK_SIZE)
+            head = first_chunk(chunks)
+            if http_status == 200 and pdf_test(head):
+                content_length = int(pdf_response.headers.get('Content-Length', 0))
+                if max_bytes and content_length > max_bytes:
+                    logger.error(f"{pdf_url} is {content_length} bytes, over the {max_bytes} byte limit")
+                    pdf_downloads.inc(outcome='too_large')
+                    break
+                is_pdf = save_pdf(pdf_path, head, chunks, max_bytes)
+                if is_pdf:
+                    logger.debug(f"{pdf_url}: created {pdf_path}")
+                    pdf_downloads.inc(outcome='saved')
+                    return store_pdf(pdf_path, pdf_url, store)
+                pdf_downloads.inc(outcome='too_large')
+                break
+            pdf_bytes = read_limited(head, chunks)
         refresh_period = detect_refresh_request(pdf_bytes, ns) # Had to downgrade to 3.6; had an assignment operator below for this
         if http_status == 403:
-            raise Exception(pdf_response.content.decode('UTF-8'))
-        elif http_status == 200 and pdf_test(pdf_bytes):
-            is_pdf = True
-            break
+            pdf_downloads.inc(outcome='failed')
+            raise Exception(pdf_bytes.decode('UTF-8'))
         elif http_status == 200 and no_pdf(pdf_bytes, ns):
             logger.debug(f"arXiv logged a missing PDF at {pdf_url}")
+            pdf_downloads.inc(outcome='no_pdf')
             break
         elif refresh_period:
             logger.info(f"arXiv asked us to wait {refresh_period} seconds on {to_ordinal(trial)} attempt for {pdf_url}")
-            time.sleep(refresh_period)
+            # hold every downloader, not just this one; the next request through the limiter waits it out
+            backoff_seconds.inc(refresh_period, stage='refresh')
+            client.limiter.defer(refresh_period)
         else:
             logger.debug(f"{pdf_url}: download failed on {to_ordinal(trial)} attempt, waiting for {backoff} seconds")
+            backoff_seconds.inc(backoff, stage='download')
             time.sleep(backoff)
             next_backoff = last_backoff + backoff
             last_backoff = backoff
             backoff = next_backoff
+    else:
+        pdf_downloads.inc(outcome='failed')
+        raise requests.exceptions.RetryError(f"{pdf_url}: no PDF after {DOWNLOAD_TRIALS} attempts")
 
     if is_pdf:
-        # Write the pdf file out to the file system
-        with open(pdf_path, 'bw', 4096, closefd=True) as pdf_file:
-            pdf_file.write(pdf_bytes)
-            logger.debug(f"{pdf_url}: created {pdf_path}")
         return pdf_path
 
 
-def download_pdfs(id_batch: List[str], topic: str, max_records: int):
+class AsyncDownloadEngine:
+    """
+    Downloads PDFs as coroutines on an event loop in a background thread. A download waiting on the rate limiter or
+    sleeping off a backoff costs a suspended coroutine rather than a blocked thread, so thousands can be in flight and a
+    few slow URLs can't tie up the rest. submit returns a concurrent.futures.Future, as executor.submit does, so the
+    callers of download_pdfs don't change.
+    """
+
+    def __init__(self, concurrency: int = ASYNC_CONCURRENCY, client: HttpClient = None,
+                 max_bytes: int = MAX_PDF_BYTES, store: PdfStore = None):
+        import httpx  # https://www.python-httpx.org/async/ only needed by this engine
+        self.httpx = httpx
+        client = client or get_client()
+        self.store = store or get_store()
+        self.limiter = client.limiter
+        self.validators = client.validators
+        self.cache = client.cache
+        self.max_bytes = max_bytes
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="arxiv_getter_asyncio", daemon=True)
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self._open(concurrency, dict(client.session.headers)), self.loop).result()
+
+    async def _open(self, concurrency: int, headers: dict):
+        self.in_flight = asyncio.Semaphore(concurrency)
+        # only as many coroutines as there are connections poll the limiter for one
+        self.connections = asyncio.Semaphore(self.limiter.max_connections)
+        self.client = self.httpx.AsyncClient(headers=headers, timeout=self.httpx.Timeout(None),
+                                             limits=self.httpx.Limits(max_connections=self.limiter.max_connections))
+
+    def submit(self, target_dir: str, pdf_url: str, refresh: bool = False) -> futures.Future:
+        return asyncio.run_coroutine_threadsafe(self.download_pdf(target_dir, pdf_url, refresh), self.loop)
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self.client.aclose(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    async def download_pdf(self, target_dir: str, pdf_url: str, refresh: bool = False):
+        """
+        download_pdf for the event loop
+        :param refresh: ask arXiv whether an already downloaded pdf has changed, and download it again if it has
+        :return: path to saved pdf file, or None if arXiv has no PDF for the link or it's over max_bytes
+        """
+        async with self.in_flight:
+            try:
+                with pdf_download_seconds.time():
+                    return await self._download_pdf(target_dir, pdf_url, refresh)
+            except self.httpx.TransportError as te:
+                # surface transport failures as the threaded engine does
+                raise requests.exceptions.ConnectionError(f"{pdf_url}: {te!r}") from te
+
+    async def _download_pdf(self, target_dir: str, pdf_url: str, refresh: bool):
+        pdf_path = f'{target_dir}/{url_to_file_name(pdf_url)}.pdf'
+        if not refresh:
+            # the store's SQLite index and hashing stay off the loop
+            saved_path = await self.loop.run_in_executor(None, stored_pdf, pdf_path, pdf_url, self.store)
+            if saved_path:
+                pdf_downloads.inc(outcome='stored')
+                return saved_path
+        if self.cache and self.cache.offline:
+            raise OfflineCacheMiss(f"no downloads in offline replay: {pdf_url}")
+        already_downloaded = os.path.exists(pdf_path)
+        logger.debug(f"""\n\n\n*** DOWNLOADING FOR ARTICLE {pdf_url} ***""")
+        is_pdf = False
+        last_backoff = 0
+        backoff = 1  # conf
+        for trial in range(DOWNLOAD_TRIALS):
+            # conditional and remembered, as HttpClient.stream makes it, with the validators' SQLite off the loop
+            headers = await self.loop.run_in_executor(None, self.validators.headers, pdf_url) \
+                if already_downloaded and self.validators else {}
+            async with self.connections, self.limiter.request_async():
+                async with self.client.stream('GET', pdf_url, headers=headers) as pdf_response:
+                    http_status = pdf_response.status_code
+                    if self.validators:
+                        await self.loop.run_in_executor(None, self.validators.update, pdf_url, pdf_response)
+                    if http_status == 304:
+                        logger.debug(f"{pdf_path} is unchanged since it was downloaded")
+                        pdf_downloads.inc(outcome='unchanged')
+                        return pdf_path
+                    chunks = pdf_response.aiter_bytes(CHUNK_SIZE)
+                    head = b''
+                    async for chunk in chunks:
+                        head = chunk.lstrip()
+                        if head:
+                            head = head[3:] if head[0:3] == BOM else head
+                            break
+                    if http_status == 200 and pdf_test(head):
+                        content_length = int(pdf_response.headers.get('Content-Length', 0))
+                        if self.max_bytes and content_length > self.max_bytes:
+                            logger.error(f"{pdf_url} is {content_length} bytes, over the {self.max_bytes} byte limit")
+                            pdf_downloads.inc(outcome='too_large')
+                            break
+                        is_pdf = await self.save_pdf(pdf_path, head, chunks)
+                        if is_pdf:
+                            logger.debug(f"{pdf_url}: created {pdf_path}")
+                            pdf_downloads.inc(outcome='saved')
+                            return await self.loop.run_in_executor(None, store_pdf, pdf_path, pdf_url, self.store)
+                        pdf_downloads.inc(outcome='too_large')
+                        break
+                    page = bytearray(head)
+                    async for chunk in chunks:
+                        if len(page) >= MAX_PAGE_BYTES:
+                            break
+                        page.extend(chunk)
+                    pdf_bytes = bytes(page[:MAX_PAGE_BYTES])
+            refresh_period = detect_refresh_request(pdf_bytes, ns)
+            if http_status == 403:
+                pdf_downloads.inc(outcome='failed')
+                raise Exception(pdf_bytes.decode('UTF-8'))
+            elif http_status == 200 and no_pdf(pdf_bytes, ns):
+                logger.debug(f"arXiv logged a missing PDF at {pdf_url}")
+                pdf_downloads.inc(outcome='no_pdf')
+                break
+            elif refresh_period:
+                logger.info(f"arXiv asked us to wait {refresh_period} seconds on {to_ordinal(trial)} attempt for {pdf_url}")
+                backoff_seconds.inc(refresh_period, stage='refresh')
+                self.limiter.defer(refresh_period)
+            else:
+                logger.debug(f"{pdf_url}: download failed on {to_ordinal(trial)} attempt, waiting for {backoff} seconds")
+                backoff_seconds.inc(backoff, stage='download')
+                await asyncio.sleep(backoff)
+                next_backoff = last_backoff + backoff
+                last_backoff = backoff
+                backoff = next_backoff
+        else:
+            pdf_downloads.inc(outcome='failed')
+            raise requests.exceptions.RetryError(f"{pdf_url}: no PDF after {DOWNLOAD_TRIALS} attempts")
+
+        if is_pdf:
+            return pdf_path
+
+    async def save_pdf(self, pdf_path: str, head: bytes, chunks) -> bool:
+        """
+        save_pdf for an async body: stream to a hidden temporary file, fsync it off the loop and rename it into place
+        """
+        directory, file_name = os.path.split(pdf_path)
+        with tempfile.NamedTemporaryFile('wb', dir=directory or '.', prefix=f".{file_name}.", suffix='.part',
+                                         delete=False) as part:
+            try:
+                size = len(head)
+                part.write(head)
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if self.max_bytes and size > self.max_bytes:
+                        break
+                    part.write(chunk)
+                part.flush()
+                await self.loop.run_in_executor(None, os.fsync, part.fileno())
+            except BaseException:
+                part.close()
+                os.unlink(part.name)
+                raise
+        if self.max_bytes and size > self.max_bytes:
+            logger.error(f"{pdf_path} is over the {self.max_bytes} byte limit, abandoning it")
+            os.unlink(part.name)
+            return False
+        os.replace(part.name, pdf_path)
+        pdf_download_bytes.inc(size)
+        return True
+
+
+def submit_download(target_dir: str, pdf_link: str, engine: AsyncDownloadEngine = None) -> futures.Future:
+    if engine:
+        return engine.submit(target_dir, pdf_link)
+    return executor.submit(download_pdf, target_dir, pdf_link)
+
+
+def download_pdfs(id_batch: List[str], topic: str, max_records: int, engine: AsyncDownloadEngine = None,
+                  cache: QueryCache = None):
+    """
+    :param engine: asyncio download engine; downloads run on the thread pool without one
+    :param cache: ids already queried on the topic, which are not queried again
+    :return: futures of the downloaded pdf paths
+    """
     topic_dir = parse.quote_plus(topic)
     os.makedirs(topic_dir, exist_ok=True)
-    for pdf_links in yield_pdf_links(id_batch, topic, max_records):
+    for pdf_links in yield_planned_pdf_links(id_batch, topic, cache, min(max_records, ID_LIST_SIZE)):
+        if pdf_links is None:
+            logger.error(f"skipping ids of a failed metadata query between {id_batch[0]} and {id_batch[-1]}")
+            continue
         for pdf_link in pdf_links:
-            yield executor.submit(download_pdf, topic, pdf_link)
+            yield submit_download(topic_dir, pdf_link, engine)
 
 
-def main():
-    for id_batch in Sickle_Impl().get_batched_ids(50000, 'cs'):
-        logger.info(f"starting batch from {id_batch[0]} to {id_batch[-1]}")
-        download_path_futures = download_pdfs(id_batch, topic, max_records)
-        for download_path in download_path_futures:
+def download_cataloged_pdfs(catalog: Catalog, id_batch: List[str], topic: str, engine: AsyncDownloadEngine = None):
+    """
+    download_pdfs without the API round trips: the qualifying articles are selected from the local catalog
+    """
+    topic_dir = parse.quote_plus(topic)
+    os.makedirs(topic_dir, exist_ok=True)
+    categories = [f"{key}.{val}" for key in arxiv_categories for val in arxiv_categories[key]]
+    for arxiv_id, pdf_link in catalog.qualified(id_batch, categories, topic):
+        yield submit_download(topic_dir, pdf_link, engine)
+
+
+def download_searched_pdfs(topic: str, max_records: int, since: datetime = FIRST_SUBMISSION, until: datetime = None,
+                           engine: AsyncDownloadEngine = None):
+    """
+    Download every qualified article of a topic wide search, resuming the search where the last run stopped
+    """
+    topic_dir = parse.quote_plus(topic)
+    os.makedirs(topic_dir, exist_ok=True)
+    for pdf_links in yield_sharded_pdf_links(topic, max_records, since, until, ShardLog()):
+        for download_path in [submit_download(topic_dir, pdf_link, engine) for pdf_link in pdf_links or []]:
             try:
                 if download_path.result(3600):
                     logger.debug(f"Saved PDF to {download_path.result()}")
             except futures.TimeoutError as te:
                 logger.error(f"{download_path} timed out")
-            except requests.exceptions.ConnectionError as ce:
+            except (requests.exceptions.ConnectionError, requests.exceptions.RetryError, OfflineCacheMiss) as ce:
                 logger.error(f"{download_path} download failed with {ce}")
 
 
-if __name__ == "__main__":
-    # execute only if run as a script
-    main()
+def parse_arguments(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Download the PDFs of the arXiv CS articles on a topic")
+    parser.add_argument('topic', help="word the articles must contain, as in the API's all: search")
+    parser.add_argument('max_records', type=int, help="entries per page of metadata query results")
+    parser.add_argument('metadata_source', nargs='?', choices=('api', 'catalog', 'search'), default='api',
+                        help="select the qualified articles of the harvested records with the API or from the local "
+                             "catalog, or search the API for the topic without harvesting")
+    parser.add_argument('--since', type=lambda day: datetime.strptime(day, '%Y-%m-%d'), default=FIRST_SUBMISSION,
+                        help="with search, the first day of submissions, YYYY-MM-DD")
+    parser.add_argument('--until', type=lambda day: datetime.strptime(day, '%Y-%m-%d'),
+                        help="with search, the day after the last day of submissions, YYYY-MM-DD; by default, now")
+    parser.add_argument('--engine', choices=('threads', 'asyncio'), default='threads',
+                        help="download on the thread pool or as coroutines on an asyncio event loop")
+    parser.add_argument('--concurrency', type=int, default=ASYNC_CONCURRENCY,
+                        help="downloads in flight on the asyncio engine")
+    parser.add_argument('--stage', choices=('all', 'enqueue', 'query', 'download'), default='all',
+                        help="run every stage in this process, or work one stage of the queue")
+    parser.add_argument('--queue', default="work_queue.sqlite3", help="work queue file shared by the stage workers")
+    parser.add_argument('--store', default=STORE_ROOT,
+                        help="content addressed PDF store shared by every topic; the topic folder links into it")
+    parser.add_argument('--no-store', action='store_true', help="keep the PDFs in the topic folder only")
+    parser.add_argument('--cache', help="answer repeated metadata queries and OAI pages from this response cache")
+    parser.add_argument('--cache-ttl', type=float, default=RESPONSE_TTL, help="seconds a cached response is fresh")
+    parser.add_argument('--offline', action='store_true',
+                        help="replay the response cache, however old, and request nothing that isn't in it")
+    add_metrics_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str] = None):
+    # SHOW RUNTIME ARGUMENTS
+    print("; ".join(sys.argv))
+    arguments = parse_arguments(argv)
+    snapshots = start_metrics(arguments.metrics_port, arguments.metrics_snapshot, arguments.metrics_interval)
+    try:
+        build_corpus(arguments)
+    finally:
+        if snapshots:
+            snapshots.stop()
+
+
+def build_corpus(arguments: argparse.Namespace):
+    topic, max_records = arguments.topic, arguments.max_records
+    if not arguments.no_store:
+        set_store(PdfStore(arguments.store))
+    if arguments.cache or arguments.offline:
+        set_client(HttpClient(validators=ValidatorStore(), cache=ResponseCache(
+            arguments.cache or "response_cache.sqlite3", arguments.cache_ttl, offline=arguments.offline)))
+    engine = AsyncDownloadEngine(arguments.concurrency) if arguments.engine == 'asyncio' else None
+    if arguments.stage != 'all':
+        worker = getter(topic, max_records, WorkQueue(arguments.queue), engine)
+        if arguments.stage == 'enqueue':
+            worker.enqueue(state=HarvestState(f"{parse.quote_plus(topic)}_harvest_state.sqlite3"), incremental=True)
+        elif arguments.stage == 'query':
+            worker.query()
+        else:
+            worker.dequeue()
+        return
+    if arguments.metadata_source == 'search':
+        download_searched_pdfs(topic, max_records, arguments.since, arguments.until, engine)
+        return
+    # each topic's corpus keeps its own harvest checkpoint, so a restart resumes and a re-run only sees new records
+    state = HarvestState(f"{parse.quote_plus(topic)}_harvest_state.sqlite3")
+    catalog = Catalog()
+    cache = QueryCache()
+    for id_batch in Sickle_Impl().get_batched_ids(50000, 'cs', state=state, incremental=True, catalog=catalog):
+        logger.info(f"starting batch from {id_batch[0]} to {id_batch[-1]}")
+        # records whose datestamp changed, eg that just got a doi, have to be queried again whatever the cache last
+        # heard of them
+        cache.forget(state.changed())
+        if arguments.metadata_source == 'catalog':
+            download_path_futures = download_cataloged_pdfs(catalog, id_batch, topic, engine)
+        else:
+            download_path_futures = download_pdfs(id_batch, topic, max_records, engine, cache)
+        for download_path in download_path_futures:
+            try:
+                if download_path.result(3600):
+                    logger.debug(f"Saved PDF to {download_path.result()}")
+            except futures.TimeoutError as te:
+                logger.error(f"{download_path} timed out")
+            except (requests.exceptions.ConnectionError, requests.exceptions.RetryError, OfflineCacheMiss) as ce:
+                logger.error(f"{download_path} download failed with {ce}")
+        # the batch's downloads are over, so a resumed harvest needn't yield its ids again
+        state.acknowledge()
+    state.acknowledge()
 
 
 class getter:
-    """ write a parallelized enqueuer to execute the API query in batches and send the article numbers to a list
-    parallelized dequeuers will take batches of them off the list and sent them to Google cloud functions which will
-    retrieve and store the PDFs
+    """
+    The corpus build as stages connected by a durable WorkQueue, so each stage can stall, crash or be scaled out to more
+    processes (or hosts sharing the queue file) without holding up or re-running the others:
+    enqueue harvests arXiv ids from the OAI API onto the ids queue,
+    query takes batches of ids off it, runs the metadata query on them and puts the qualified PDF links on the pdfs queue,
+    dequeue takes batches of links off that and downloads them.
     """
 
-    def enqueue(self):
-        pass
+    def __init__(self, topic: str, max_records: int = max_records, queue: WorkQueue = None,
+                 engine: AsyncDownloadEngine = None, idle_timeout: float = IDLE_TIMEOUT, harvester: Sickle_Impl = None):
+        """
+        :param harvester: OAI harvester of the ids to enqueue, arXiv's by default
+        """
+        self.topic = topic
+        self.max_records = max_records
+        self.queue = queue or WorkQueue()
+        self.engine = engine
+        self.idle_timeout = idle_timeout
+        self.harvester = harvester
+
+    def enqueue(self, batch_size: int = ID_BATCH_SIZE, **harvest_args):
+        """
+        :param harvest_args: passed on to Sickle_Impl.get_ids
+        """
+        state = harvest_args.get('state')
+        cache = QueryCache() if state else None
+        for id_batch in (self.harvester or Sickle_Impl()).get_batched_ids(batch_size, 'cs', **harvest_args):
+            if cache:
+                # records whose datestamp changed have to be queried again
+                cache.forget(state.changed())
+            added = self.queue.put(IDS_QUEUE, id_batch)
+            logger.info(f"queued {added} new of {len(id_batch)} ids from {id_batch[0]} to {id_batch[-1]}")
+            if state:
+                # the queue has them now
+                state.acknowledge()
+        if state:
+            state.acknowledge()
+
+    def poll(self, queue: str, batch_size: int):
+        """
+        yield batches of tasks until the queue has been empty for the idle timeout
+        """
+        idle_since = time.time()
+        while time.time() - idle_since < self.idle_timeout:
+            tasks = self.queue.get(queue, batch_size)
+            if tasks:
+                yield tasks
+                idle_since = time.time()
+            else:
+                time.sleep(POLL_INTERVAL)
+        logger.info(f"{queue} queue idle for {self.idle_timeout} seconds: {self.queue.counts(queue)}")
+
+    def query(self, batch_size: int = ID_BATCH_SIZE):
+        cache = QueryCache()
+        for tasks in self.poll(IDS_QUEUE, batch_size):
+            id_batch = [task.payload for task in tasks]
+            try:
+                target_dir = parse.quote_plus(self.topic)
+                os.makedirs(target_dir, exist_ok=True)
+                for pdf_links in yield_planned_pdf_links(id_batch, self.topic, cache,
+                                                         min(self.max_records, ID_LIST_SIZE)):
+                    if pdf_links is None:
+                        raise Exception(f"metadata query for ids {id_batch[0]} to {id_batch[-1]} failed")
+                    self.queue.put(PDFS_QUEUE, [dict(target_dir=target_dir, url=pdf_link) for pdf_link in pdf_links])
+                self.queue.ack(tasks)
+            except Exception as exc:
+                logger.error(exc)
+                self.queue.fail(tasks, str(exc))
+
+    def dequeue(self, batch_size: int = 20):
+        for tasks in self.poll(PDFS_QUEUE, batch_size):
+            for task, download_path in [(task, submit_download(task.payload['target_dir'], task.payload['url'],
+                                                               self.engine)) for task in tasks]:
+                try:
+                    # None is arXiv saying there's no PDF, or a PDF we won't keep; retrying won't change either. A
+                    # download that ran out of trials raises, and is failed for a later retry
+                    if download_path.result(3600):
+                        logger.debug(f"Saved PDF to {download_path.result()}")
+                    self.queue.ack([task])
+                except futures.TimeoutError as te:
+                    logger.error(f"{task.payload['url']} timed out")
+                    self.queue.fail([task], "timed out")
+                except Exception as exc:
+                    logger.error(f"{task.payload['url']} download failed with {exc}")
+                    self.queue.fail([task], str(exc))
+
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    main()
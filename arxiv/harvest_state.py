@@ -0,0 +1,145 @@
+import sqlite3
+import time
+from typing import List, Optional
+
+from sickle_impl import getLogger
+
+logger = getLogger(__name__)
+
+
+
+class HarvestState:
+    """
+    Checkpoint store for OAI-PMH harvests, kept in a small SQLite file so a crashed or interrupted harvest can resume
+    from the page it was working on instead of starting ListRecords over.
+
+    One row per (set, metadataPrefix) tracks the window being harvested (from/until), the resumptionToken that fetched
+    the page currently being consumed and when the last complete harvest started, so nightly runs can ask only for
+    records stamped since then. Harvested IDs are kept with their datestamps; a re-fetched page only re-yields records
+    that changed.
+
+    What the harvest records, checkpoints and completes is only staged until the consumer of the ids acknowledges that
+    it has finished with every id yielded so far, so ids it was still holding when the process died are harvested
+    again on resume rather than taken as done.
+    """
+
+    def __init__(self, path: str = "harvest_state.sqlite3"):  # conf
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS harvest (
+                oai_set TEXT NOT NULL,
+                metadata_prefix TEXT NOT NULL,
+                from_date TEXT,
+                until_date TEXT,
+                resumption_token TEXT,
+                started TEXT,
+                completed TEXT,
+                last_completed_start TEXT,
+                PRIMARY KEY (oai_set, metadata_prefix));
+            CREATE TABLE IF NOT EXISTS harvested_id (
+                oai_set TEXT NOT NULL,
+                arxiv_id TEXT NOT NULL,
+                datestamp TEXT,
+                PRIMARY KEY (oai_set, arxiv_id));
+        """)
+        self.connection.commit()
+        # staged ids by (set, id), those of them harvested before with another datestamp, and the staged checkpoint
+        # and completion of each (set, metadataPrefix)
+        self.staged = {}
+        self.staged_changes = set()
+        self.staged_tokens = {}
+        self.staged_complete = set()
+
+    def begin(self, oai_set: str, metadata_prefix: str, from_date: Optional[str] = None,
+              until_date: Optional[str] = None) -> Optional[str]:
+        """
+        Start or resume a harvest of the given window
+        :return: the resumptionToken to continue an interrupted harvest of the same window, or None to start afresh
+        """
+        row = self.connection.execute(
+            "SELECT from_date, until_date, resumption_token, completed FROM harvest "
+            "WHERE oai_set = ? AND metadata_prefix = ?", (oai_set, metadata_prefix)).fetchone()
+        if row and row[3] is None and row[0] == from_date and row[1] == until_date and row[2]:
+            logger.info(f"resuming {oai_set} {metadata_prefix} harvest from resumptionToken {row[2]}")
+            return row[2]
+        now = time.strftime('%Y-%m-%d', time.gmtime())
+        self.connection.execute(
+            "INSERT INTO harvest (oai_set, metadata_prefix, from_date, until_date, started) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (oai_set, metadata_prefix) DO UPDATE SET from_date = excluded.from_date, "
+            "until_date = excluded.until_date, resumption_token = NULL, started = excluded.started, completed = NULL",
+            (oai_set, metadata_prefix, from_date, until_date, now))
+        self.connection.commit()
+        return None
+
+    def checkpoint(self, oai_set: str, metadata_prefix: str, resumption_token: Optional[str]):
+        """
+        Stage the resumptionToken that fetched the page now being consumed, to be saved with the ids recorded so far
+        """
+        self.staged_tokens[(oai_set, metadata_prefix)] = resumption_token
+
+    def complete(self, oai_set: str, metadata_prefix: str):
+        """
+        Stage the end of the harvest, to be saved when its last ids are acknowledged
+        """
+        self.staged_complete.add((oai_set, metadata_prefix))
+
+    def acknowledge(self):
+        """
+        Save what the harvest has staged, once the consumer has finished with every id yielded so far
+        """
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO harvested_id (oai_set, arxiv_id, datestamp) VALUES (?, ?, ?)",
+            [(oai_set, arxiv_id, datestamp) for (oai_set, arxiv_id), datestamp in self.staged.items()])
+        self.connection.executemany(
+            "UPDATE harvest SET resumption_token = ? WHERE oai_set = ? AND metadata_prefix = ?",
+            [(token, oai_set, metadata_prefix) for (oai_set, metadata_prefix), token in self.staged_tokens.items()])
+        self.connection.executemany(
+            "UPDATE harvest SET resumption_token = NULL, completed = ?, last_completed_start = started "
+            "WHERE oai_set = ? AND metadata_prefix = ?",
+            [(time.strftime('%Y-%m-%d', time.gmtime()), oai_set, metadata_prefix)
+             for oai_set, metadata_prefix in self.staged_complete])
+        self.connection.commit()
+        self.staged, self.staged_changes, self.staged_tokens, self.staged_complete = {}, set(), {}, set()
+
+    def last_completed(self, oai_set: str, metadata_prefix: str) -> Optional[str]:
+        """
+        :return: the day the last complete harvest started, a safe 'from' datestamp for the next incremental harvest
+        """
+        row = self.connection.execute(
+            "SELECT last_completed_start FROM harvest WHERE oai_set = ? AND metadata_prefix = ?",
+            (oai_set, metadata_prefix)).fetchone()
+        return row[0] if row else None
+
+    def seen(self, oai_set: str, arxiv_id: str, datestamp: Optional[str]) -> bool:
+        """
+        :return: whether this record has already been harvested with this datestamp, in this run or an earlier one
+        """
+        if (oai_set, arxiv_id) in self.staged:
+            return self.staged[(oai_set, arxiv_id)] == datestamp
+        row = self.connection.execute(
+            "SELECT datestamp FROM harvested_id WHERE oai_set = ? AND arxiv_id = ?", (oai_set, arxiv_id)).fetchone()
+        return row is not None and row[0] == datestamp
+
+    def record(self, oai_set: str, arxiv_id: str, datestamp: Optional[str]) -> bool:
+        """
+        Stage a harvested id, to be saved when it's acknowledged
+        :return: whether it was harvested before with another datestamp, ie its record changed, rather than first seen
+        """
+        row = self.connection.execute(
+            "SELECT datestamp FROM harvested_id WHERE oai_set = ? AND arxiv_id = ?", (oai_set, arxiv_id)).fetchone()
+        changed = row is not None and row[0] != datestamp
+        if changed:
+            self.staged_changes.add((oai_set, arxiv_id))
+        self.staged[(oai_set, arxiv_id)] = datestamp
+        return changed
+
+    def changed(self) -> List[str]:
+        """
+        :return: the ids staged since the last acknowledgement whose records changed since they were first harvested
+        """
+        return [arxiv_id for oai_set, arxiv_id in self.staged_changes]
+
+    def close(self):
+        # whatever wasn't acknowledged is harvested again
+        self.connection.close()
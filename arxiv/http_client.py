@@ -0,0 +1,165 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from rate_limiter import arxiv_limiter, RateLimiter
+from response_cache import OfflineCacheMiss, ResponseCache, request_key
+
+POOL_CONNECTIONS: int = 4  # conf
+POOL_MAXSIZE: int = 20  # conf, as many as there are downloader threads
+USER_AGENT: str = "arXiv_getter (https://github.com/ionFreeman/arXiv_getter)"
+VALIDATORS_PATH: str = "validators.sqlite3"  # conf
+
+
+class ValidatorStore:
+    """
+    Remembers the ETag and Last-Modified headers of responses, across runs, so the same URL can be requested again
+    conditionally
+    """
+
+    def __init__(self, path: str = VALIDATORS_PATH):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS validator (url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT)")
+        self.connection.commit()
+
+    def headers(self, url: str) -> dict:
+        """
+        :return: If-None-Match and If-Modified-Since headers for what we last saw at the url
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT etag, last_modified FROM validator WHERE url = ?",
+                                          (url,)).fetchone()
+        if row is None:
+            return {}
+        return {name: value for name, value in (('If-None-Match', row[0]), ('If-Modified-Since', row[1])) if value}
+
+    def update(self, url: str, response: requests.Response):
+        etag, last_modified = response.headers.get('ETag'), response.headers.get('Last-Modified')
+        if response.status_code != 200 or not (etag or last_modified):
+            return
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO validator (url, etag, last_modified) VALUES (?, ?, ?)",
+                                    (url, etag, last_modified))
+            self.connection.commit()
+
+
+class HttpClient:
+    """
+    One pooled, keep-alive requests.Session for every request to arXiv, so they stop paying a handshake each. All
+    requests take their turn from the rate limiter. Tests can point it at a local stub server with set_client, or
+    replay a response cache offline.
+    """
+
+    def __init__(self, limiter: RateLimiter = arxiv_limiter, validators: Optional[ValidatorStore] = None,
+                 adapter: Optional[HTTPAdapter] = None, pool_connections: int = POOL_CONNECTIONS,
+                 pool_maxsize: int = POOL_MAXSIZE, max_retries: int = 0, timeout: Optional[float] = None,
+                 cache: Optional[ResponseCache] = None):
+        """
+        :param cache: answer repeated requests (other than conditional ones and streamed downloads) from it
+        """
+        self.limiter = limiter
+        self.validators = validators
+        self.cache = cache
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({'User-Agent': USER_AGENT, 'Accept-Encoding': 'gzip, deflate'})
+        adapter = adapter or HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                                         max_retries=max_retries)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _send(self, method: str, url: str, conditional: bool, remember: bool, kwargs: dict) -> requests.Response:
+        if conditional and self.validators:
+            kwargs['headers'] = {**self.validators.headers(url), **kwargs.get('headers', {})}
+        kwargs.setdefault('timeout', self.timeout)
+        response = self.session.request(method, url, **kwargs)
+        if (conditional or remember) and self.validators:
+            self.validators.update(url, response)
+        return response
+
+    def request(self, method: str, url: str, conditional: bool = False, remember: bool = False,
+                **kwargs) -> requests.Response:
+        """
+        :param conditional: send If-None-Match/If-Modified-Since from the last response we remembered for this url;
+        the caller has to handle a 304 Not Modified
+        :param remember: keep this response's validators for a later conditional request
+        """
+        key = None
+        if self.cache and not conditional:
+            key = request_key(method, url, kwargs.get('params'), kwargs.get('data'))
+            response = self.cache.get(key)
+            if response is not None:
+                return response
+            if self.cache.offline:
+                raise OfflineCacheMiss(f"no cached response to {method} {url}")
+        with self.limiter.request():
+            response = self._send(method, url, conditional, remember, kwargs)
+        if key:
+            self.cache.put(key, method, url, response)
+        return response
+
+    @contextmanager
+    def stream(self, url: str, conditional: bool = False, remember: bool = False, **kwargs):
+        """
+        GET whose body is read inside the with block, which keeps hold of the connection until the body is read
+        """
+        if self.cache and self.cache.offline:
+            raise OfflineCacheMiss(f"no downloads in offline replay: {url}")
+        with self.limiter.request():
+            response = self._send('GET', url, conditional, remember, dict(kwargs, stream=True))
+            try:
+                yield response
+            finally:
+                response.close()
+
+    def cached(self, method: str, url: str, params=None, data=None) -> bool:
+        """
+        :return: whether the request would be answered from the cache, without a rate limiter slot
+        """
+        return bool(self.cache) and self.cache.fresh(request_key(method, url, params, data))
+
+    def forget(self, method: str, url: str, params=None, data=None):
+        """
+        Drop the cached response to a request, so the next one goes to arXiv, eg to retry a feed that was incomplete
+        """
+        if self.cache:
+            self.cache.delete(request_key(method, url, params, data))
+
+    def get(self, url: str, conditional: bool = False, remember: bool = False, **kwargs) -> requests.Response:
+        return self.request('GET', url, conditional, remember, **kwargs)
+
+    def post(self, url: str, data=None, **kwargs) -> requests.Response:
+        return self.request('POST', url, data=data, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+_client: Optional[HttpClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> HttpClient:
+    """
+    :return: the process-wide client, created on first use
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient(validators=ValidatorStore())
+        return _client
+
+
+def set_client(client: HttpClient):
+    """
+    Replace the process-wide client, eg with one pointed at a stub server
+    """
+    global _client
+    with _client_lock:
+        _client = client
@@ -0,0 +1,230 @@
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Sequence, Tuple
+
+"""
+Counters, histograms and timers for the corpus build, in one process-wide registry. It is exposed in the Prometheus
+text format (https://prometheus.io/docs/instrumenting/exposition_formats/) by serve_metrics and written out as JSON
+by SnapshotWriter. Rates, eg bytes/s or PDFs/s, are the counters over uptime_seconds (or rate() in Prometheus).
+"""
+
+SNAPSHOT_INTERVAL: float = 60  # conf, seconds between JSON snapshots
+# seconds, from a cached response to a PDF over a slow link
+BUCKETS: Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _label_text(labelnames: Sequence[str], labelvalues: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, labelvalues)] + ([extra] if extra else [])
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def exposition(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self.lock:
+            return self.values.get(self._key(labels), 0)
+
+    def exposition(self):
+        yield from super().exposition()
+        with self.lock:
+            values = sorted(self.values.items())
+        for key, value in values:
+            yield f"{self.name}{_label_text(self.labelnames, key)} {value}"
+
+    def as_dict(self) -> dict:
+        with self.lock:
+            return {','.join(key) or 'total': value for key, value in sorted(self.values.items())}
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self.lock:
+            # per bucket counts (the last for values over every bound), sum and count
+            counts, total, count = self.values.get(key, ([0] * (len(self.buckets) + 1), 0.0, 0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.values[key] = (counts, total + value, count + 1)
+
+    def timed(self, function):
+        """
+        Decorator observing the seconds each call of function takes
+        """
+        @functools.wraps(function)
+        def timed_function(*args, **kwargs):
+            with self.time():
+                return function(*args, **kwargs)
+        return timed_function
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observe the seconds the with block takes, whether it finishes or raises
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def exposition(self):
+        yield from super().exposition()
+        with self.lock:
+            values = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self.values.items())
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound}"'
+                yield f"{self.name}_bucket{_label_text(self.labelnames, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_label_text(self.labelnames, key)} {total}"
+            yield f"{self.name}_count{_label_text(self.labelnames, key)} {count}"
+
+    def as_dict(self) -> dict:
+        with self.lock:
+            return {','.join(key) or 'total': dict(count=count, sum=total, mean=total / count if count else None)
+                    for key, (counts, total, count) in sorted(self.values.items())}
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics: Dict[str, Metric] = {}
+        self.started = time.time()
+
+    def _register(self, cls, name: str, help: str, **kwargs):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = cls(name, help, **kwargs)
+            return self.metrics[name]
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter, name, help, labelnames=labelnames)
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = BUCKETS) -> Histogram:
+        return self._register(Histogram, name, help, labelnames=labelnames, buckets=buckets)
+
+    def exposition(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = [f"# HELP uptime_seconds seconds since the registry was created", "# TYPE uptime_seconds gauge",
+                 f"uptime_seconds {time.time() - self.started}"]
+        for metric in metrics:
+            lines.extend(metric.exposition())
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return dict(time=time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime()), uptime_seconds=time.time() - self.started,
+                    metrics={metric.name: metric.as_dict() for metric in metrics})
+
+
+registry = Registry()
+
+
+def serve_metrics(port: int, host: str = '127.0.0.1', registry: Registry = registry) -> ThreadingHTTPServer:
+    """
+    Serve the registry in the Prometheus text format, on every path, from a daemon thread
+    """
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = registry.exposition().encode('UTF-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+class SnapshotWriter:
+    """
+    Writes the registry's snapshot to a JSON file every interval, and once more when stopped, replacing the file
+    whole each time so a reader never sees half of one
+    """
+
+    def __init__(self, path: str, interval: float = SNAPSHOT_INTERVAL, registry: Registry = registry):
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="metrics_snapshot", daemon=True)
+        self.thread.start()
+
+    def write(self):
+        part = f"{self.path}.part"
+        with open(part, 'w') as snapshot:
+            json.dump(self.registry.snapshot(), snapshot, indent=2)
+        os.replace(part, self.path)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.write()
+
+
+def start_metrics(port: int = None, snapshot: str = None, interval: float = SNAPSHOT_INTERVAL):
+    """
+    Serve the metrics on port and write snapshots to the snapshot file, if given, eg from a command line
+    :return: the SnapshotWriter to stop at the end of the run, if there is one
+    """
+    if port:
+        serve_metrics(port)
+    if snapshot:
+        return SnapshotWriter(snapshot, interval)
+
+
+def add_metrics_arguments(parser):
+    parser.add_argument('--metrics-port', type=int, help="serve Prometheus metrics on this local port")
+    parser.add_argument('--metrics-snapshot', help="write a JSON snapshot of the metrics to this file")
+    parser.add_argument('--metrics-interval', type=float, default=SNAPSHOT_INTERVAL,
+                        help="seconds between metrics snapshots")
@@ -0,0 +1,235 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import numpy as np  # https://numpy.org/doc/stable/ the signatures are computed on arrays, every permutation at once
+
+from corpus_shards import arxiv_id_of
+from corpus_walker import walk_corpus
+from sickle_impl import getLogger
+
+logger = getLogger(__name__)
+
+"""
+Near duplicate detection with MinHash and locality sensitive hashing
+(http://infolab.stanford.edu/~ullman/mmds/ch3n.pdf). A document's shingles are its runs of SHINGLE_WORDS words; its
+signature keeps, for each of PERMUTATIONS hash functions, the least hash of any shingle, and two signatures agree in
+about the Jaccard similarity of the shingle sets. The signature is cut into BANDS bands: documents sharing a band are
+candidates, and a candidate whose signature agrees in at least THRESHOLD of its places joins that document's group.
+Versions of the same arXiv paper, and copies of one version cross-listed in several categories, are grouped by id,
+whatever their similarity.
+"""
+
+SHINGLE_WORDS: int = 5  # conf
+PERMUTATIONS: int = 128  # conf
+BANDS: int = 16  # conf, 8 rows each: documents over about 0.7 similar are very likely to share a band
+THRESHOLD: float = 0.8  # conf, estimated Jaccard similarity of a near duplicate
+NEAR_DUPLICATES_PATH = "near_duplicates.sqlite3"  # conf, shared by the topics a paper may be cross-listed in
+SEED: int = 1501  # signatures are only comparable when computed with the same hash functions
+SHINGLE_BLOCK: int = 4096  # shingles hashed at a time, bounding the PERMUTATIONS x SHINGLE_BLOCK array
+WORD = re.compile(r'\w+')
+VERSION = re.compile(r'v(\d+)$')
+
+
+def shingle_hashes(text: str, shingle_words: int = SHINGLE_WORDS) -> np.ndarray:
+    """
+    :return: the distinct 64 bit hashes of a text's shingles
+    """
+    words = WORD.findall(text.lower())
+    if not words:
+        return np.empty(0, dtype=np.uint64)
+    vocabulary, word_ids = np.unique(np.array(words), return_inverse=True)
+    word_hashes = np.array([int.from_bytes(hashlib.blake2b(word.encode('UTF-8'), digest_size=8).digest(), 'little')
+                            for word in vocabulary], dtype=np.uint64)[word_ids]
+    width = min(shingle_words, len(words))
+    shingles = np.zeros(len(words) - width + 1, dtype=np.uint64)
+    # a polynomial hash of each window of words; uint64 arithmetic wraps around
+    for offset in range(width):
+        shingles = shingles * np.uint64(1000003) + word_hashes[offset:len(words) - width + 1 + offset]
+    return np.unique(shingles)
+
+
+class MinHasher:
+    def __init__(self, permutations: int = PERMUTATIONS, seed: int = SEED):
+        generator = np.random.default_rng(seed)
+        # odd multipliers make each a * x + b mod 2^64 a permutation of the hashes
+        self.a = generator.integers(1, 2 ** 63, size=(permutations, 1), dtype=np.uint64) | np.uint64(1)
+        self.b = generator.integers(0, 2 ** 63, size=(permutations, 1), dtype=np.uint64)
+
+    def signature(self, shingles: np.ndarray) -> Optional[np.ndarray]:
+        """
+        :return: the least hash of any shingle under each permutation, or None for a document with no words
+        """
+        if len(shingles) == 0:
+            return None
+        signature = np.full(len(self.a), np.iinfo(np.uint64).max, dtype=np.uint64)
+        for start in range(0, len(shingles), SHINGLE_BLOCK):
+            block = shingles[start:start + SHINGLE_BLOCK]
+            np.minimum(signature, (self.a * block + self.b).min(axis=1), out=signature)
+        return signature
+
+
+def similarity(signature: np.ndarray, other: np.ndarray) -> float:
+    """
+    :return: the estimated Jaccard similarity of the documents of two signatures
+    """
+    return float(np.mean(signature == other))
+
+
+def version(arxiv_id: str) -> int:
+    """
+    :return: the version number of an arXiv id, 0 if it has none
+    """
+    match = VERSION.search(arxiv_id)
+    return int(match.group(1)) if match else 0
+
+
+class NearDuplicates:
+    """
+    The groups of near duplicate documents, in SQLite with their signatures and LSH buckets, so documents added by
+    later runs, or for other topics sharing the file, are grouped with those of earlier ones. A document is keyed by its
+    path, with its arXiv id alongside, so cross-listed copies of a paper in different folders are documents of one
+    group. Each group's representative is the first of it that was added, until a later version of the
+    representative's paper is added, which takes its place: the corpus keeps up with a paper's revisions.
+    """
+
+    def __init__(self, path: str = NEAR_DUPLICATES_PATH, permutations: int = PERMUTATIONS, bands: int = BANDS,
+                 threshold: float = THRESHOLD):
+        if permutations % bands:
+            raise ValueError(f"{bands} bands don't divide {permutations} permutations")
+        self.hasher = MinHasher(permutations)
+        self.bands = bands
+        self.rows = permutations // bands
+        self.threshold = threshold
+        # the pipeline's deduplication and conversion threads share it
+        self.lock = threading.Lock()
+        # and the pipelines of other topics
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS document (
+                key TEXT PRIMARY KEY,
+                arxiv_id TEXT,
+                paper TEXT,
+                representative TEXT NOT NULL,
+                signature BLOB);
+            CREATE INDEX IF NOT EXISTS document_paper ON document (paper);
+            CREATE TABLE IF NOT EXISTS bucket (
+                band INTEGER NOT NULL,
+                bucket BLOB NOT NULL,
+                key TEXT NOT NULL);
+            CREATE INDEX IF NOT EXISTS bucket_band ON bucket (band, bucket);
+        """)
+        self.connection.commit()
+
+    @staticmethod
+    def paper(arxiv_id: Optional[str]) -> Optional[str]:
+        """
+        :return: the arXiv id without its version
+        """
+        return VERSION.sub('', arxiv_id) if arxiv_id else None
+
+    def representative(self, key: str) -> Optional[str]:
+        with self.lock:
+            row = self.connection.execute("SELECT representative FROM document WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def later_version(self, arxiv_id: Optional[str]) -> Optional[str]:
+        """
+        :param arxiv_id: arXiv id with its version
+        :return: the key of a later version of the same paper, if one was added
+        """
+        paper = self.paper(arxiv_id)
+        if paper is None:
+            return None
+        with self.lock:
+            rows = self.connection.execute("SELECT key, arxiv_id FROM document WHERE paper = ?", (paper,)).fetchall()
+        later = [(version(other_id), key) for key, other_id in rows if version(other_id) > version(arxiv_id)]
+        return max(later)[1] if later else None
+
+    def add(self, key: str, text: str, arxiv_id: str = None) -> str:
+        """
+        :param key: the document's path
+        :param arxiv_id: the document's arXiv id with its version, if it has one
+        :return: the representative of the document's group, the key itself if it's the first of its group or a later
+        version of the representative's paper
+        """
+        known = self.representative(key)
+        if known:
+            return known
+        signature = self.hasher.signature(shingle_hashes(text))
+        buckets = [] if signature is None else \
+            [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+        paper = self.paper(arxiv_id)
+        with self.lock:
+            row = paper and self.connection.execute(
+                "SELECT document.representative, representative.arxiv_id FROM document JOIN document representative "
+                "ON representative.key = document.representative WHERE document.paper = ? LIMIT 1",
+                (paper,)).fetchone()
+            representative = row[0] if row else None
+            if row and self.paper(row[1]) == paper and version(arxiv_id) > version(row[1]):
+                # a revision of the representative's paper takes its place
+                self.connection.execute("UPDATE document SET representative = ? WHERE representative = ?",
+                                        (key, representative))
+                logger.info(f"{key} replaces {representative}, an earlier version, as its group's representative")
+                representative = key
+            if representative is None and buckets:
+                candidates = set()
+                for band, bucket in buckets:
+                    candidates.update(candidate for (candidate,) in self.connection.execute(
+                        "SELECT key FROM bucket WHERE band = ? AND bucket = ?", (band, bucket)))
+                rows = self.connection.execute(
+                    f"SELECT representative, signature FROM document WHERE key IN ({','.join('?' * len(candidates))})",
+                    sorted(candidates)).fetchall() if candidates else []
+                best = 0.0
+                for candidate_representative, candidate_signature in rows:
+                    estimate = similarity(signature, np.frombuffer(candidate_signature, dtype=np.uint64))
+                    if estimate >= self.threshold and estimate > best:
+                        best, representative = estimate, candidate_representative
+            representative = representative or key
+            self.connection.execute(
+                "INSERT INTO document (key, arxiv_id, paper, representative, signature) VALUES (?, ?, ?, ?, ?)",
+                (key, arxiv_id, paper, representative, None if signature is None else signature.tobytes()))
+            self.connection.executemany("INSERT INTO bucket (band, bucket, key) VALUES (?, ?, ?)",
+                                        [(band, bucket, key) for band, bucket in buckets])
+            self.connection.commit()
+        if representative != key:
+            logger.info(f"{key} is a near duplicate of {representative}")
+        return representative
+
+    def groups(self) -> Dict[str, List[str]]:
+        """
+        :return: the members of each group with more than one, by representative
+        """
+        groups = defaultdict(list)
+        with self.lock:
+            for key, representative in self.connection.execute(
+                    "SELECT key, representative FROM document ORDER BY representative, key"):
+                groups[representative].append(key)
+        return {representative: keys for representative, keys in groups.items() if len(keys) > 1}
+
+    def close(self):
+        self.connection.close()
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Group the near duplicate documents of a converted corpus")
+    parser.add_argument('text_folder', help="text files, as run_pdftotext writes them")
+    parser.add_argument('--index', default=NEAR_DUPLICATES_PATH, help="signatures and groups, kept across runs")
+    parser.add_argument('--threshold', type=float, default=THRESHOLD, help="estimated Jaccard similarity to group at")
+    arguments = parser.parse_args(argv)
+    duplicates = NearDuplicates(arguments.index, threshold=arguments.threshold)
+    for entry in walk_corpus(arguments.text_folder, ('*.txt',)):
+        with open(entry.path, encoding='UTF-8', errors='replace') as text_file:
+            duplicates.add(os.path.abspath(entry.path), text_file.read(), arxiv_id_of(entry.path))
+    print(json.dumps(duplicates.groups(), indent=2))
+    duplicates.close()
+
+
+if __name__ == '__main__':
+    main()
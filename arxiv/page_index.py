@@ -0,0 +1,85 @@
+import json
+import os
+from typing import BinaryIO, Iterable, List, Optional
+
+"""
+A converted text file has its pages separated by a blank line, as pdftotext's pages were always joined. Beside it, a
+page index sidecar keeps the byte offset each page starts at, so a tool after the section on page 3 seeks straight to
+it rather than reading the pages before it.
+"""
+
+PAGE_SEPARATOR = '\n\n'
+INDEX_SUFFIX = '.pages.json'
+ENCODING = 'UTF-8'
+
+
+def page_range(page_count: int, first_page: int = 1, last_page: int = None) -> range:
+    """
+    :param first_page: first page to convert, counting from 1 as pdftotext -f does
+    :param last_page: last page to convert, as pdftotext -l does; every page to the end by default
+    :return: the 0-based indices of the pages to convert
+    """
+    last_page = page_count if last_page is None else min(last_page, page_count)
+    return range(max(first_page, 1) - 1, last_page)
+
+
+def write_pages(text_file: BinaryIO, pages: Iterable[str]) -> List[int]:
+    """
+    Write each page as soon as it's rendered, so only one page's text is held at a time
+    :return: byte offset of each page
+    """
+    offsets = []
+    separator = PAGE_SEPARATOR.encode(ENCODING)
+    for page in pages:
+        if offsets:
+            text_file.write(separator)
+        offsets.append(text_file.tell())
+        text_file.write(page.encode(ENCODING))
+    return offsets
+
+
+def index_path(text_path: str) -> str:
+    return f"{text_path}{INDEX_SUFFIX}"
+
+
+def save_page_index(text_path: str, offsets: List[int], first_page: int, page_count: int):
+    """
+    :param first_page: PDF page number of the first page in the text file
+    :param page_count: pages in the PDF, whether or not they were all converted
+    """
+    index = dict(page_count=page_count, first_page=first_page, offsets=offsets, length=os.path.getsize(text_path))
+    part = f"{index_path(text_path)}.part"
+    with open(part, 'w') as index_file:
+        json.dump(index, index_file)
+    os.replace(part, index_path(text_path))
+
+
+def load_page_index(text_path: str) -> Optional[dict]:
+    """
+    :return: the page index of a text file, or None if it was converted without one
+    """
+    try:
+        with open(index_path(text_path)) as index_file:
+            return json.load(index_file)
+    except FileNotFoundError:
+        return None
+
+
+def read_page(text_path: str, page_number: int, index: dict = None) -> str:
+    """
+    :param page_number: PDF page number, counting from 1
+    :return: the text of one page, read from its offset
+    :raises IndexError: if the page wasn't converted
+    """
+    index = index or load_page_index(text_path)
+    if index is None:
+        raise FileNotFoundError(index_path(text_path))
+    offsets = index['offsets']
+    position = page_number - index['first_page']
+    if not 0 <= position < len(offsets):
+        raise IndexError(f"page {page_number} of {text_path} wasn't converted")
+    end = offsets[position + 1] - len(PAGE_SEPARATOR.encode(ENCODING)) if position + 1 < len(offsets) \
+        else index['length']
+    with open(text_path, 'rb') as text_file:
+        text_file.seek(offsets[position])
+        return text_file.read(end - offsets[position]).decode(ENCODING)
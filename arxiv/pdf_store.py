@@ -0,0 +1,160 @@
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Iterator, Optional, Tuple
+
+from conversion_manifest import file_sha256
+from sickle_impl import getLogger
+
+logger = getLogger(__name__)
+
+STORE_ROOT: str = "pdf_store"  # conf
+# new style ids (0704.0001 on) or old style archive/number ids (cs/0112017), then an optional version
+ARXIV_ID = re.compile(r'/pdf/(?P<id>\d{4}\.\d{4,5}|[a-z\-]+(?:\.[A-Z]{2})?/\d{7})(?P<version>v\d+)?(?:\.pdf)?/?$')
+
+
+def arxiv_key(pdf_url: str) -> Optional[Tuple[str, str]]:
+    """
+    :return: (arXiv id, version) of a pdf link, the version '' if the link has none; None if it isn't an arXiv pdf link
+    """
+    match = ARXIV_ID.search(pdf_url)
+    if match:
+        return match.group('id'), match.group('version') or ''
+
+
+class PdfStore:
+    """
+    Every PDF we have, once, however many topics it was found under. The files live under blobs/, named for their
+    SHA-256, and an SQLite index maps each arXiv id and version to its blob. A topic's folder is a view of the store:
+    hard links to the blobs, so the corpus tools see ordinary files, and an entry per link in the index. Where a hard
+    link can't be made (another file system), the topic's folder gets a copy of the blob instead, so its PDFs are always
+    under it and the text converted from them mirrors the topic's folder rather than the store.
+    """
+
+    def __init__(self, root: str = STORE_ROOT):
+        self.root = root
+        os.makedirs(os.path.join(root, 'blobs'), exist_ok=True)
+        # every downloader thread looks up and adds PDFs
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(os.path.join(root, "store.sqlite3"), check_same_thread=False)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS pdf (
+                arxiv_id TEXT NOT NULL,
+                version TEXT NOT NULL,
+                sha256 TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                url TEXT,
+                stored TEXT NOT NULL,
+                PRIMARY KEY (arxiv_id, version));
+            CREATE INDEX IF NOT EXISTS pdf_sha256 ON pdf (sha256);
+            CREATE TABLE IF NOT EXISTS view (
+                path TEXT PRIMARY KEY,
+                arxiv_id TEXT NOT NULL,
+                version TEXT NOT NULL,
+                linked INTEGER NOT NULL);
+        """)
+        self.connection.commit()
+
+    def blob_path(self, sha256: str) -> str:
+        # two levels of fan out keep the folders small
+        return os.path.join(self.root, 'blobs', sha256[:2], sha256[2:4], f"{sha256}.pdf")
+
+    def get(self, arxiv_id: str, version: str) -> Optional[str]:
+        """
+        :return: the blob of this version of the article, if we have it
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT sha256 FROM pdf WHERE arxiv_id = ? AND version = ?",
+                                          (arxiv_id, version)).fetchone()
+        if row and os.path.exists(self.blob_path(row[0])):
+            return self.blob_path(row[0])
+
+    def add(self, arxiv_id: str, version: str, pdf_path: str, url: str = None) -> str:
+        """
+        Take a downloaded PDF into the store, leaving pdf_path a link to its blob, or a copy of it. A PDF whose bytes
+        we already have, under any id, only gets an index entry.
+        :return: pdf_path
+        """
+        sha256 = file_sha256(pdf_path)
+        blob_path = self.blob_path(sha256)
+        with self.lock:
+            if os.path.exists(blob_path):
+                if not os.path.samefile(pdf_path, blob_path):
+                    logger.debug(f"{pdf_path} duplicates {blob_path}")
+                    os.unlink(pdf_path)
+            else:
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                try:
+                    os.link(pdf_path, blob_path)
+                except OSError:
+                    shutil.move(pdf_path, blob_path)
+            self.connection.execute(
+                "INSERT OR REPLACE INTO pdf (arxiv_id, version, sha256, size, url, stored) VALUES (?, ?, ?, ?, ?, ?)",
+                (arxiv_id, version, sha256, os.path.getsize(blob_path), url,
+                 time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime())))
+            self.connection.commit()
+            return self.link(arxiv_id, version, pdf_path, blob_path)
+
+    def link(self, arxiv_id: str, version: str, pdf_path: str, blob_path: str = None) -> str:
+        """
+        Add a PDF we have to a topic's view, as a hard link to its blob or, where that can't be made, a copy
+        :return: pdf_path
+        """
+        blob_path = blob_path or self.get(arxiv_id, version)
+        linked = True
+        if not os.path.exists(pdf_path):
+            try:
+                os.link(blob_path, pdf_path)
+            except OSError as exc:
+                logger.debug(f"copying {blob_path} to {pdf_path}, as {exc!r}")
+                shutil.copyfile(blob_path, pdf_path)
+                linked = False
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO view (path, arxiv_id, version, linked) VALUES (?, ?, ?, ?)",
+                                    (os.path.abspath(pdf_path), arxiv_id, version, linked))
+            self.connection.commit()
+        return pdf_path
+
+    def view(self, folder: str) -> Iterator[Tuple[str, str, str]]:
+        """
+        :return: (arXiv id, version, path) of each PDF in a topic's folder, a link to its blob or a copy of it
+        """
+        folder = os.path.join(os.path.abspath(folder), '')
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT view.path, view.arxiv_id, view.version FROM view JOIN pdf "
+                "USING (arxiv_id, version) WHERE substr(view.path, 1, ?) = ? ORDER BY view.path",
+                (len(folder), folder)).fetchall()
+        for path, arxiv_id, version in rows:
+            yield arxiv_id, version, path
+
+    def counts(self) -> dict:
+        """
+        :return: how many articles and distinct PDFs the store holds, and their bytes
+        """
+        with self.lock:
+            articles, pdfs, size = self.connection.execute(
+                "SELECT count(*), count(DISTINCT sha256), "
+                "(SELECT coalesce(sum(size), 0) FROM (SELECT DISTINCT sha256, size FROM pdf)) FROM pdf").fetchone()
+        return dict(articles=articles, pdfs=pdfs, bytes=size)
+
+    def close(self):
+        self.connection.close()
+
+
+_store: Optional[PdfStore] = None
+
+
+def get_store() -> Optional[PdfStore]:
+    """
+    :return: the process-wide store, if set_store has set one
+    """
+    return _store
+
+
+def set_store(store: Optional[PdfStore]):
+    global _store
+    _store = store
@@ -0,0 +1,257 @@
+import argparse
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List
+from urllib import parse
+
+from catalog import Catalog
+from conversion_manifest import ConversionManifest
+from corpus_shards import arxiv_id_of
+from corpus_walker import mirror_path
+from extract_background import Extractor, RunReport, SECTIONS, load_match_extract
+from getter import ID_LIST_SIZE, arxiv_categories, download_pdf, yield_planned_pdf_links, yield_sharded_pdf_links
+from harvest_state import HarvestState
+from http_client import HttpClient, ValidatorStore, set_client
+from metrics import add_metrics_arguments, start_metrics
+from pdf_store import PdfStore, STORE_ROOT, set_store
+from query_cache import QueryCache
+from query_shards import ShardLog
+from response_cache import RESPONSE_TTL, ResponseCache
+from run_pdftotext import Converter
+from sickle_impl import Sickle_Impl, getLogger
+
+logger = getLogger(__name__)
+
+QUEUE_SIZE = 100  # conf, items waiting between two stages before the upstream stage has to wait
+DONE = object()  # sent down a queue after the last item
+
+
+class Stage:
+    """
+    A pool of threads taking items from an inbox, applying a function and putting whatever it returns (other than
+    None) in the outbox. Bounded queues between stages mean a fast stage waits for a slow one rather than flooding it.
+    A failure is logged and costs only the item it failed on. When the inbox is done and every thread has finished,
+    the stage sends DONE on to the outbox.
+    """
+
+    def __init__(self, name: str, function: Callable, workers: int, inbox: queue.Queue, outbox: queue.Queue = None):
+        self.name = name
+        self.function = function
+        self.inbox = inbox
+        self.outbox = outbox
+        self.processed = 0
+        self.failed = 0
+        self.running = workers
+        self.lock = threading.Lock()
+        self.threads = [threading.Thread(target=self.work, name=f"{name}_{index}", daemon=True)
+                        for index in range(workers)]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def work(self):
+        while True:
+            item = self.inbox.get()
+            if item is DONE:
+                self.inbox.put(DONE)  # for this stage's other threads
+                break
+            try:
+                result = self.function(item)
+                with self.lock:
+                    self.processed += 1
+                if result is not None and self.outbox is not None:
+                    self.outbox.put(result)
+            except Exception as exc:
+                logger.error(f"{self.name} failed on {item}: {exc!r}")
+                with self.lock:
+                    self.failed += 1
+        with self.lock:
+            self.running -= 1
+            last = self.running == 0
+        if last:
+            logger.info(f"{self.name} stage finished: {self.processed} processed, {self.failed} failed")
+            if self.outbox is not None:
+                self.outbox.put(DONE)
+
+    def join(self):
+        for thread in self.threads:
+            thread.join()
+
+
+def process_pool(workers: int) -> ProcessPoolExecutor:
+    # fork a clean server rather than this multithreaded process where we can
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return ProcessPoolExecutor(workers, multiprocessing.get_context(method))
+
+
+class Pipeline:
+    """
+    The whole corpus build, harvest -> metadata query -> download -> convert -> extract, with every stage running at
+    once. A PDF is converted, and its text extracted, as soon as its download lands. Each stage has its own worker
+    count: downloads run on threads (sharing the rate limiter), conversion and extraction on process pools.
+    """
+
+    def __init__(self, topic: str, max_records: int, pdf_folder: str, text_folder: str, extract_folder: str,
+                 metadata_source: str = 'api', downloaders: int = 20, converters: int = os.cpu_count(),
+                 extractors: int = 2, queue_size: int = QUEUE_SIZE, sections: dict = SECTIONS, last_page: int = None,
+                 deduplicate: bool = False, duplicates_path: str = None):
+        """
+        :param deduplicate: convert the latest version of each paper to arrive, and extract one document of each group
+        of near duplicates: the first of them to arrive, or a later version of its paper
+        :param duplicates_path: the near duplicates' SQLite file, which the topics share so that papers cross-listed in
+        several are grouped; near_duplicates.sqlite3 in the current folder by default
+        """
+        self.topic = topic
+        self.max_records = max_records
+        self.pdf_folder = pdf_folder
+        self.metadata_source = metadata_source
+        self.downloaders = downloaders
+        self.converters = converters
+        self.extractors = extractors
+        self.queue_size = queue_size
+        os.makedirs(text_folder, exist_ok=True)
+        self.converter = Converter(text_folder, pdf_folder,
+                                   manifest=ConversionManifest(os.path.join(text_folder, "manifest.sqlite3")),
+                                   last_page=last_page)
+        self.extractor = Extractor(load_match_extract(), text_folder)
+        self.duplicates = None
+        if deduplicate:
+            from near_duplicates import NEAR_DUPLICATES_PATH, NearDuplicates  # only needed, with numpy, to deduplicate
+            self.duplicates = NearDuplicates(duplicates_path or NEAR_DUPLICATES_PATH)
+        self.sections = sections
+        self.extract_root = os.path.abspath(extract_folder)
+        self.report = RunReport()
+        self.report_lock = threading.Lock()
+
+    def harvest(self, links: queue.Queue):
+        """
+        harvest ids and put the qualified PDF links on the links queue; the SQLite stores are opened here, in the thread
+        that uses them
+        """
+        try:
+            if self.metadata_source == 'search':
+                for pdf_links in yield_sharded_pdf_links(self.topic, self.max_records, log=ShardLog()):
+                    for pdf_link in pdf_links or []:
+                        links.put(pdf_link)
+                return
+            state = HarvestState(f"{parse.quote_plus(self.topic)}_harvest_state.sqlite3")
+            catalog = Catalog()
+            cache = QueryCache()
+            categories = [f"{key}.{val}" for key in arxiv_categories for val in arxiv_categories[key]]
+            for id_batch in Sickle_Impl().get_batched_ids(50000, 'cs', state=state, incremental=True, catalog=catalog):
+                logger.info(f"starting batch from {id_batch[0]} to {id_batch[-1]}")
+                if self.metadata_source == 'catalog':
+                    for arxiv_id, pdf_link in catalog.qualified(id_batch, categories, self.topic):
+                        links.put(pdf_link)
+                else:
+                    for pdf_links in yield_planned_pdf_links(id_batch, self.topic, cache,
+                                                             min(self.max_records, ID_LIST_SIZE)):
+                        for pdf_link in pdf_links or []:
+                            links.put(pdf_link)
+                # the batch's links are with the downloaders
+                state.acknowledge()
+            state.acknowledge()
+        except Exception as exc:
+            logger.error(f"harvest failed: {exc!r}")
+        finally:
+            links.put(DONE)
+
+    def converted(self, pdf_path: str, pool: ProcessPoolExecutor):
+        if self.duplicates and self.duplicates.later_version(arxiv_id_of(pdf_path)):
+            logger.info(f"skipping {pdf_path}, a later version of it has been converted")
+            return None
+        if not self.converter.manifest.needs_conversion(pdf_path):
+            return mirror_path(pdf_path, self.converter.inputfolder, self.converter.outputfolder, '.txt')
+        result = pool.submit(self.converter.convert_indexed_pdf, (0, pdf_path)).result()
+        return self.converter.converted(*result)[1]
+
+    def deduplicated(self, text_path: str):
+        """
+        :return: the text path of the representative of its group of near duplicates, None for the rest
+        """
+        key = os.path.abspath(text_path)
+        with open(text_path, encoding='UTF-8', errors='replace') as text_file:
+            representative = self.duplicates.add(key, text_file.read(), arxiv_id_of(text_path))
+        return text_path if representative == key else None
+
+    def extracted(self, text_path: str, pool: ProcessPoolExecutor):
+        extract_sizes = pool.submit(self.extractor.save_sections, self.sections, self.extract_root, text_path).result()
+        with self.report_lock:
+            self.report.add(extract_sizes)
+
+    def run(self) -> RunReport:
+        os.makedirs(self.pdf_folder, exist_ok=True)
+        links, pdfs, texts, representatives = (queue.Queue(self.queue_size) for _ in range(4))
+        with process_pool(self.converters) as conversion_pool, process_pool(self.extractors) as extraction_pool:
+            # a stage's threads each wait on one process task at a time, so there are as many as the pool has workers
+            stages = [Stage('download', lambda link: download_pdf(self.pdf_folder, link), self.downloaders, links,
+                            pdfs).start(),
+                      Stage('convert', lambda pdf_path: self.converted(pdf_path, conversion_pool), self.converters,
+                            pdfs, texts).start()]
+            if self.duplicates:
+                # the signatures are vectorized, so one thread keeps up with the converters
+                stages.append(Stage('deduplicate', self.deduplicated, 1, texts, representatives).start())
+                texts = representatives
+            stages.append(Stage('extract', lambda text_path: self.extracted(text_path, extraction_pool),
+                                self.extractors, texts).start())
+            self.harvest(links)
+            for stage in stages:
+                stage.join()
+        print(self.report)
+        return self.report
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(
+        description="Build a corpus for a topic: harvest, download, convert and extract, all at once")
+    parser.add_argument('topic', help="word the articles must contain, as in the API's all: search")
+    parser.add_argument('max_records', type=int, help="entries per page of metadata query results")
+    parser.add_argument('metadata_source', nargs='?', choices=('api', 'catalog', 'search'), default='api',
+                        help="select the harvested records with the API or the local catalog, or search the API")
+    parser.add_argument('--pdf-folder', help="by default, the topic, quoted for a file name")
+    parser.add_argument('--text-folder', help="by default, pdftotext/<topic>")
+    parser.add_argument('--extract-folder', help="by default, extracts/<topic>")
+    parser.add_argument('--downloaders', type=int, default=20, help="download threads")
+    parser.add_argument('--converters', type=int, default=os.cpu_count(), help="pdftotext processes")
+    parser.add_argument('--extractors', type=int, default=2, help="section extraction processes")
+    parser.add_argument('--queue-size', type=int, default=QUEUE_SIZE, help="items waiting between two stages")
+    parser.add_argument('--last-page', type=int,
+                        help="convert only this many pages of each PDF, enough for the sections being extracted")
+    parser.add_argument('--deduplicate', action='store_true',
+                        help="convert the latest version of each paper, extract one of each group of near duplicates")
+    parser.add_argument('--duplicates',
+                        help="near duplicates file shared by every topic; by default, near_duplicates.sqlite3")
+    parser.add_argument('--store', default=STORE_ROOT,
+                        help="content addressed PDF store shared by every topic; the PDF folder links into it")
+    parser.add_argument('--no-store', action='store_true', help="keep the PDFs in the PDF folder only")
+    parser.add_argument('--cache', help="answer repeated metadata queries and OAI pages from this response cache")
+    parser.add_argument('--cache-ttl', type=float, default=RESPONSE_TTL, help="seconds a cached response is fresh")
+    parser.add_argument('--offline', action='store_true',
+                        help="replay the response cache, however old, and request nothing that isn't in it")
+    add_metrics_arguments(parser)
+    arguments = parser.parse_args(argv)
+    snapshots = start_metrics(arguments.metrics_port, arguments.metrics_snapshot, arguments.metrics_interval)
+    try:
+        if not arguments.no_store:
+            set_store(PdfStore(arguments.store))
+        if arguments.cache or arguments.offline:
+            set_client(HttpClient(validators=ValidatorStore(), cache=ResponseCache(
+                arguments.cache or "response_cache.sqlite3", arguments.cache_ttl, offline=arguments.offline)))
+        Pipeline(arguments.topic, arguments.max_records, arguments.pdf_folder or parse.quote_plus(arguments.topic),
+                 arguments.text_folder or os.path.join('pdftotext', arguments.topic),
+                 arguments.extract_folder or os.path.join('extracts', arguments.topic), arguments.metadata_source,
+                 arguments.downloaders, arguments.converters, arguments.extractors, arguments.queue_size,
+                 last_page=arguments.last_page, deduplicate=arguments.deduplicate,
+                 duplicates_path=arguments.duplicates).run()
+    finally:
+        if snapshots:
+            snapshots.stop()
+
+
+if __name__ == '__main__':
+    main()
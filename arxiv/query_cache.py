@@ -0,0 +1,67 @@
+import sqlite3
+import time
+from typing import Dict, Iterable, Optional
+
+from sickle_impl import getLogger
+
+logger = getLogger(__name__)
+
+
+NOT_QUALIFIED_TTL: float = 7 * 24 * 3600  # conf, seconds before an id that didn't qualify is queried again
+
+
+class QueryCache:
+    """
+    The ids a topic's metadata queries have already covered, with the pdf link of each one that qualified (NULL for
+    those that didn't, or that the topic search didn't return), so a re-run or an overlapping batch only asks the API
+    about ids it hasn't seen. An article can qualify later, when it gets a doi or a journal reference, so an id that
+    didn't qualify is only settled for not_qualified_ttl seconds, or until its record is harvested again and forgotten.
+    """
+
+    def __init__(self, path: str = "query_cache.sqlite3", not_qualified_ttl: float = NOT_QUALIFIED_TTL):  # conf
+        self.path = path
+        self.not_qualified_ttl = not_qualified_ttl
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS queried (
+                topic TEXT NOT NULL,
+                arxiv_id TEXT NOT NULL,
+                pdf_link TEXT,
+                queried TEXT NOT NULL,
+                PRIMARY KEY (topic, arxiv_id));
+            CREATE INDEX IF NOT EXISTS queried_arxiv_id ON queried (arxiv_id);
+        """)
+        self.connection.commit()
+
+    def get(self, topic: str, ids: Iterable[str]) -> Dict[str, Optional[str]]:
+        """
+        :return: pdf link, or None if it didn't qualify within the TTL, for each of the ids that have been queried on
+        the topic
+        """
+        self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS batch_id (arxiv_id TEXT PRIMARY KEY)")
+        self.connection.execute("DELETE FROM batch_id")
+        self.connection.executemany("INSERT OR IGNORE INTO batch_id VALUES (?)", ((i,) for i in ids))
+        expired = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(time.time() - self.not_qualified_ttl))
+        return dict(self.connection.execute(
+            "SELECT q.arxiv_id, q.pdf_link FROM queried q JOIN batch_id b ON b.arxiv_id = q.arxiv_id "
+            "WHERE q.topic = ? AND (q.pdf_link IS NOT NULL OR q.queried > ?)", (topic, expired)).fetchall())
+
+    def put(self, topic: str, results: Dict[str, Optional[str]]):
+        """
+        :param results: pdf link, or None if it didn't qualify, for each id a query covered
+        """
+        queried = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime())
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO queried (topic, arxiv_id, pdf_link, queried) VALUES (?, ?, ?, ?)",
+            [(topic, arxiv_id, link, queried) for arxiv_id, link in results.items()])
+        self.connection.commit()
+
+    def forget(self, ids: Iterable[str]):
+        """
+        Drop what every topic's queries said of these ids, eg because their records changed since
+        """
+        self.connection.executemany("DELETE FROM queried WHERE arxiv_id = ?", ((arxiv_id,) for arxiv_id in ids))
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,107 @@
+import sqlite3
+from collections import namedtuple
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+from sickle_impl import getLogger
+
+logger = getLogger(__name__)
+
+# the API manual: "In cases where the API needs to return more than 30000 results, it is best to break up the query"
+RESULT_CEILING: int = 30000  # conf
+SUBMITTED_FORMAT = '%Y%m%d%H%M'  # as the API's submittedDate:[from TO to] range takes it
+FIRST_SUBMISSION = datetime(1991, 8, 1)
+MINUTE = timedelta(minutes=1)
+
+# a submittedDate range, both ends included, with the results it had when it was probed and the offset of the first
+# result not yet fetched
+Shard = namedtuple('Shard', ['start', 'end', 'total', 'next_start'])
+
+
+def submitted_range(start: datetime, end: datetime) -> Tuple[str, str]:
+    return start.strftime(SUBMITTED_FORMAT), end.strftime(SUBMITTED_FORMAT)
+
+
+def split_date_range(count: Callable[[Tuple[str, str]], int], start: datetime, end: datetime,
+                     ceiling: int = RESULT_CEILING) -> Iterator[Tuple[str, str, int]]:
+    """
+    Halve a submission date range until each part has no more results than the ceiling
+    :param count: probe for the number of results in a submitted_range
+    :return: (start, end, results) of each part, in submission order
+    """
+    submitted = submitted_range(start, end)
+    total = count(submitted)
+    if total <= ceiling or end - start < MINUTE:
+        if total > ceiling:
+            logger.warning(f"{total} results were submitted in the minute {submitted[0]}; only {ceiling} can be fetched")
+        yield submitted + (total,)
+        return
+    middle = start + (end - start) // 2
+    middle -= timedelta(seconds=middle.second, microseconds=middle.microsecond)
+    logger.debug(f"splitting {submitted} with {total} results at {middle}")
+    yield from split_date_range(count, start, middle, ceiling)
+    yield from split_date_range(count, middle + MINUTE, end, ceiling)
+
+
+class ShardLog:
+    """
+    The shards a topic's search was split into and how far each has been fetched, so an interrupted run picks up at
+    the page it stopped at, without probing or fetching anything again
+    """
+
+    def __init__(self, path: str = "query_shards.sqlite3"):  # conf
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS shard (
+                topic TEXT NOT NULL,
+                since TEXT NOT NULL,
+                until TEXT NOT NULL,
+                start_date TEXT NOT NULL,
+                end_date TEXT NOT NULL,
+                total INTEGER NOT NULL,
+                next_start INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (topic, since, until, start_date));
+        """)
+        self.connection.commit()
+
+    def shards(self, topic: str, since: str, until: str) -> Optional[List[Shard]]:
+        """
+        :return: the planned shards of a search, in submission order, or None if it hasn't been planned
+        """
+        rows = self.connection.execute(
+            "SELECT start_date, end_date, total, next_start FROM shard "
+            "WHERE topic = ? AND since = ? AND until = ? ORDER BY start_date", (topic, since, until)).fetchall()
+        return [Shard(*row) for row in rows] or None
+
+    def unfinished(self, topic: str, since: str) -> Optional[str]:
+        """
+        :return: the end of the latest search from since that hasn't been fetched to the end, if there is one
+        """
+        row = self.connection.execute(
+            "SELECT max(until) FROM shard WHERE topic = ? AND since = ? AND next_start < total",
+            (topic, since)).fetchone()
+        return row[0]
+
+    def covered(self, topic: str, since: str) -> Optional[str]:
+        """
+        :return: the end of the latest search from since
+        """
+        return self.connection.execute("SELECT max(until) FROM shard WHERE topic = ? AND since = ?",
+                                       (topic, since)).fetchone()[0]
+
+    def plan(self, topic: str, since: str, until: str, shards: Iterable[Tuple[str, str, int]]) -> List[Shard]:
+        shards = [Shard(start, end, total, 0) for start, end, total in shards]
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO shard (topic, since, until, start_date, end_date, total, next_start) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)", [(topic, since, until) + shard for shard in shards])
+        self.connection.commit()
+        return shards
+
+    def advance(self, topic: str, since: str, until: str, shard: Shard, next_start: int):
+        self.connection.execute(
+            "UPDATE shard SET next_start = ? WHERE topic = ? AND since = ? AND until = ? AND start_date = ?",
+            (next_start, topic, since, until, shard.start))
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,124 @@
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from metrics import registry
+
+"""
+https://arxiv.org/help/api/tou
+make no more than one request every three seconds, and limit requests to a single connection at a time.
+Every thread making requests to arXiv goes through the one arxiv_limiter below, so the pace holds for the process
+rather than per thread, and a refresh request from arXiv pauses everybody instead of just the thread that got it.
+"""
+
+REQUESTS_PER_SECOND: float = 1 / 3  # conf
+MAX_CONNECTIONS: int = 1  # conf
+BURST: int = 1  # conf
+CONNECTION_POLL: float = 0.05  # conf, seconds between a coroutine's tries for a connection held by a thread
+
+rate_limit_wait = registry.counter('rate_limit_wait_seconds_total',
+                                   "seconds requests waited on the rate limiter, including pauses arXiv asked for")
+
+
+class RateLimiter:
+    """
+    Token bucket, kept as the theoretical arrival time of the next request (the generic cell rate algorithm), so
+    requests are spaced evenly at the configured rate, with at most `burst` of them allowed back to back, and no more
+    than `max_connections` are in flight at once
+    """
+
+    def __init__(self, requests_per_second: float = REQUESTS_PER_SECOND, max_connections: int = MAX_CONNECTIONS,
+                 burst: int = BURST):
+        self.lock = threading.Lock()
+        self.next_arrival = time.monotonic()
+        self.paused_until = 0.0
+        self.configure(requests_per_second, max_connections, burst)
+
+    def configure(self, requests_per_second: float = REQUESTS_PER_SECOND, max_connections: int = MAX_CONNECTIONS,
+                  burst: int = BURST):
+        with self.lock:
+            self.interval = 1 / requests_per_second
+            self.burst = burst
+            self.max_connections = max_connections
+            self.connections = threading.BoundedSemaphore(max_connections)
+
+    def reserve(self) -> float:
+        """
+        Claim the next request slot without waiting for it
+        :return: seconds the caller has to wait before making its request
+        """
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_arrival - (self.burst - 1) * self.interval, self.paused_until)
+            self.next_arrival = max(self.next_arrival, start) + self.interval
+            return start - now
+
+    def paused(self) -> float:
+        """
+        :return: seconds left on a pause requested through defer
+        """
+        with self.lock:
+            return max(0.0, self.paused_until - time.monotonic())
+
+    def acquire(self):
+        """
+        Block until this thread may make a request
+        """
+        while True:
+            delay = self.reserve()
+            if delay > 0:
+                rate_limit_wait.inc(delay)
+                time.sleep(delay)
+            # a pause may have been requested while we slept on a slot reserved before it
+            if not self.paused():
+                return
+
+    async def acquire_async(self):
+        """
+        acquire for coroutines, waiting with asyncio.sleep rather than blocking the event loop
+        """
+        while True:
+            delay = self.reserve()
+            if delay > 0:
+                rate_limit_wait.inc(delay)
+                await asyncio.sleep(delay)
+            if not self.paused():
+                return
+
+    def defer(self, seconds: float):
+        """
+        Hold every request, in every thread, for the given number of seconds, eg when arXiv asks us to retry later
+        """
+        if seconds and seconds > 0:
+            with self.lock:
+                self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    @contextmanager
+    def request(self):
+        """
+        Take one of the connections and a request slot for the duration of the with block
+        """
+        connections = self.connections
+        with connections:
+            self.acquire()
+            yield
+
+    @asynccontextmanager
+    async def request_async(self):
+        """
+        request for coroutines: they take the same connections as the threads, so a threaded metadata query and an
+        asyncio download are never in flight at once over a single connection; a connection is polled for rather than
+        blocked on, which would stall the event loop
+        """
+        connections = self.connections
+        while not connections.acquire(blocking=False):
+            await asyncio.sleep(CONNECTION_POLL)
+        try:
+            await self.acquire_async()
+            yield
+        finally:
+            connections.release()
+
+
+arxiv_limiter = RateLimiter()
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Optional
+from urllib import parse
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+RESPONSE_TTL: float = 24 * 3600  # conf, seconds a cached response is fresh
+MAX_CACHE_BYTES: int = 1024 * 1024 * 1024  # conf, least recently used responses are evicted past this
+
+
+class OfflineCacheMiss(requests.exceptions.RequestException):
+    """
+    Raised, in offline replay, for a request the cache has no response to. It isn't a ConnectionError, as retrying
+    won't make the response appear, so the retry and backoff paths let it through and a replay fails in seconds
+    """
+
+
+def request_key(method: str, url: str, params=None, data=None) -> str:
+    """
+    The same request, however its parameters were ordered or split between the url, params and body, gets the same key
+    :return: SHA-256 of the method, the url without its query, and the sorted query and form parameters (which include
+    an OAI resumptionToken)
+    """
+    parts = parse.urlsplit(url)
+    query = parse.parse_qsl(parts.query, keep_blank_values=True)
+    for extra in (params, data):
+        if isinstance(extra, (bytes, str)):
+            query.append(('', extra if isinstance(extra, str) else extra.decode('UTF-8', 'replace')))
+        elif extra:
+            pairs = extra.items() if hasattr(extra, 'items') else extra
+            query.extend((str(name), str(value)) for name, value in pairs)
+    normalized = [method.upper(), parts.scheme.lower(), parts.netloc.lower(), parts.path or '/', sorted(query)]
+    return hashlib.sha256(json.dumps(normalized).encode('UTF-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    On-disk cache of the successful responses to metadata queries and OAI pages, so re-running a harvest or a query
+    replays them in no time instead of waiting out the rate limit for each one again. Responses are fresh for a TTL and
+    the least recently used are evicted once the cache passes its size bound. In offline replay, cached responses never
+    go stale and nothing else is requested: a miss raises OfflineCacheMiss, so runs and tests are deterministic.
+    """
+
+    def __init__(self, path: str = "response_cache.sqlite3", ttl: float = RESPONSE_TTL,
+                 max_bytes: int = MAX_CACHE_BYTES, offline: bool = False):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        # every downloader and harvester thread shares the client, and so the cache
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS response (
+                key TEXT PRIMARY KEY,
+                method TEXT NOT NULL,
+                url TEXT NOT NULL,
+                status INTEGER NOT NULL,
+                headers TEXT NOT NULL,
+                content BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                stored REAL NOT NULL,
+                used REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS response_used ON response (used);
+        """)
+        self.connection.commit()
+        self.size = self.connection.execute("SELECT coalesce(sum(size), 0) FROM response").fetchone()[0]
+
+    def fresh(self, key: str) -> bool:
+        """
+        :return: whether get would answer the request from the cache
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT stored FROM response WHERE key = ?", (key,)).fetchone()
+        return row is not None and (self.offline or row[0] + self.ttl > time.time())
+
+    def delete(self, key: str):
+        """
+        Drop a response that turned out to be no good, eg a truncated feed, so the request is made again; offline
+        replay keeps it, as it keeps everything
+        """
+        if self.offline:
+            return
+        with self.lock:
+            row = self.connection.execute("SELECT size FROM response WHERE key = ?", (key,)).fetchone()
+            if row:
+                self.connection.execute("DELETE FROM response WHERE key = ?", (key,))
+                self.connection.commit()
+                self.size -= row[0]
+
+    def get(self, key: str) -> Optional[requests.Response]:
+        """
+        :return: the cached response, if it's fresh (or we're offline)
+        """
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT url, status, headers, content, stored FROM response WHERE key = ?",
+                                          (key,)).fetchone()
+            if row is None or not (self.offline or row[4] + self.ttl > now):
+                return None
+            self.connection.execute("UPDATE response SET used = ? WHERE key = ?", (now, key))
+            self.connection.commit()
+        url, status, headers, content, stored = row
+        response = requests.Response()
+        response.url = url
+        response.status_code = status
+        response.reason = 'OK'
+        response.headers = CaseInsensitiveDict(json.loads(headers))
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = content
+        return response
+
+    def put(self, key: str, method: str, url: str, response: requests.Response):
+        """
+        Keep a successful response, evicting the least recently used ones past the size bound
+        """
+        if response.status_code != 200 or self.offline:
+            return
+        content = response.content
+        # the content is kept decoded
+        headers = {name: value for name, value in response.headers.items()
+                   if name.lower() not in ('content-encoding', 'transfer-encoding', 'content-length')}
+        now = time.time()
+        with self.lock:
+            old = self.connection.execute("SELECT size FROM response WHERE key = ?", (key,)).fetchone()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO response (key, method, url, status, headers, content, size, stored, used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, method.upper(), url, response.status_code, json.dumps(headers), content,
+                 len(content), now, now))
+            self.size += len(content) - (old[0] if old else 0)
+            while self.size > self.max_bytes:
+                evicted = self.connection.execute(
+                    "SELECT key, size FROM response ORDER BY used LIMIT 100").fetchall()
+                if not evicted:
+                    break
+                for evicted_key, size in evicted:
+                    if self.size <= self.max_bytes:
+                        break
+                    self.connection.execute("DELETE FROM response WHERE key = ?", (evicted_key,))
+                    self.size -= size
+            self.connection.commit()
+
+    def close(self):
+        self.connection.close()
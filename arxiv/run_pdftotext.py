@@ -1,11 +1,28 @@
+import argparse
+import io
 import os
-import re
 import sys
+import time
 from collections.abc import Iterator
+from multiprocessing import Pool
 from os import PathLike, DirEntry
 
 import pdftotext
 
+from conversion_manifest import ConversionManifest
+from corpus_shards import CorpusWriter, arxiv_id_of
+from corpus_walker import walk_corpus, mirror_path
+from metrics import add_metrics_arguments, registry, start_metrics
+from page_index import page_range, save_page_index, write_pages
+
+CHUNKSIZE = 8  # conf, PDFs handed to a worker process at a time
+
+# recorded in the parent process; the registries of the worker processes are never read
+pdf_conversions = registry.counter('pdf_conversions_total', "PDFs converted to text by outcome: converted or failed",
+                                   ['outcome'])
+pdf_conversion_seconds = registry.histogram('pdf_conversion_seconds', "pdftotext conversions of one PDF")
+pdf_conversion_bytes = registry.counter('pdf_conversion_bytes_total', "bytes of PDFs converted to text")
+
 
 def offset_iterator(iter: Iterator, offset:int):
     index = 0
@@ -15,23 +32,45 @@ def offset_iterator(iter: Iterator, offset:int):
         index = index + 1
 
 class Converter:
-    def __init__(self, outputfolder:str, inputfolder:str, offset=0):
+    def __init__(self, outputfolder:str, inputfolder:str, offset=0, workers=1, chunksize=CHUNKSIZE,
+                 manifest:ConversionManifest=None, first_page:int=1, last_page:int=None, corpus:CorpusWriter=None):
+        """
+        :param workers: processes converting in parallel; pdftotext is CPU bound, so up to one per core
+        :param chunksize: PDFs sent to a worker process at a time
+        :param manifest: skip the PDFs it has already converted unchanged, and record the outcome of the rest
+        :param first_page: first page of each PDF to convert, counting from 1
+        :param last_page: last page of each PDF to convert, eg 4 when only the early sections are extracted; pages
+        past it are never rendered
+        :param corpus: write the text to these corpus shards rather than a text file per PDF
+        """
         import os
         self.outputfolder = outputfolder
         self.inputfolder = inputfolder
         self.offset = offset
-        #TODO handle subfolders... offset should apply to the fully resolved list, output files should also end up in subfolders
-        #TODO filter for pdf files
+        self.workers = workers
+        self.chunksize = chunksize
+        self.manifest = manifest
+        self.first_page = first_page
+        self.last_page = last_page
+        self.corpus = corpus
+        self.to_corpus = corpus is not None
 
     # convert a pdf to text, store it in the outputfolder, return its path
     def convert_pdf_to_text(self, pdf_path:DirEntry):
-        text_path = os.path.join(self.outputfolder, re.sub('\\.pdf$', '.txt', pdf_path.name))
+        # subfolders of the input folder are mirrored in the output folder
+        text_path = mirror_path(pdf_path, self.inputfolder, self.outputfolder, '.txt')
         # extract the text
         with open(pdf_path, 'br', 4096, closefd=True) as pdf_file:
-            with open(text_path, 'w+', closefd=True) as text_file:
+            with open(text_path, 'wb', closefd=True) as text_file:
                 try:
-                    text_file.write('\n\n'.join(pdftotext.PDF(pdf_file)))
+                    pdf = pdftotext.PDF(pdf_file)
+                    # pdftotext renders a page when it's indexed, so each is written and dropped before the next
+                    pages = page_range(len(pdf), self.first_page, self.last_page)
+                    offsets = write_pages(text_file, (pdf[page] for page in pages))
+                    text_file.flush()
+                    save_page_index(text_path, offsets, pages.start + 1, len(pdf))
                     print(f"created {text_path}")
+                    return text_path
                 except pdftotext.Error as pe:
                     print(f"""getter was unable to parse {pdf_file} as PDF. It is probably the login page, which means either
     (1) the VPN is not connected or you are not on the intranet or
@@ -41,17 +80,118 @@ class Converter:
                     print(f"failed to create {text_path}")
                     print(be)
 
+    def convert_pdf_to_record(self, pdf_path:str) -> dict:
+        """
+        convert a pdf to text for the corpus shards
+        :return: the record of the PDF's text, with the byte offset of each page in it
+        """
+        with open(pdf_path, 'br', 4096, closefd=True) as pdf_file:
+            pdf = pdftotext.PDF(pdf_file)
+            pages = page_range(len(pdf), self.first_page, self.last_page)
+            text = io.BytesIO()
+            offsets = write_pages(text, (pdf[page] for page in pages))
+        return dict(arxiv_id=arxiv_id_of(pdf_path), source_path=os.path.relpath(pdf_path, self.inputfolder),
+                    page_count=len(pdf), first_page=pages.start + 1, page_offsets=offsets,
+                    text=text.getvalue().decode('UTF-8'))
+
+    def convert(self, pdf_path:str):
+        """
+        :return: the text file's path, or the record for the corpus shards
+        """
+        return self.convert_pdf_to_record(pdf_path) if self.to_corpus else self.convert_pdf_to_text(pdf_path)
+
+    def __getstate__(self):
+        # worker processes only convert; the manifest and the corpus writer stay with the parent
+        state = dict(self.__dict__)
+        state['manifest'] = None
+        state['corpus'] = None
+        return state
+
+    def pdf_paths(self):
+        """
+        the PDFs under the input folder, in its subfolders too, in a stable order the offset counts into
+        """
+        for inputfile in offset_iterator(walk_corpus(self.inputfolder, ('*.pdf',)), self.offset):
+            if self.manifest is None or self.manifest.needs_conversion(inputfile.path, inputfile.stat()):
+                yield inputfile.path
+
+    def convert_indexed_pdf(self, indexed_path:tuple):
+        """
+        convert a PDF, in a worker process or not: a PDF that fails is reported, not raised, so the run goes on
+        :return: (index, pdf path, text path or record, or None if the conversion failed, seconds the conversion took)
+        """
+        index, pdf_path = indexed_path
+        start = time.perf_counter()
+        try:
+            text_path = self.convert(pdf_path)
+        except Exception as exc:
+            print(f"failed to convert {pdf_path}: {exc!r}")
+            text_path = None
+        return index, pdf_path, text_path, time.perf_counter() - start
+
+    def converted(self, index:int, pdf_path:str, text_path, seconds:float=None):
+        if isinstance(text_path, dict):
+            # the manifest points at the shard only once it's closed, so a crash leaves the PDF to be converted again
+            text_path = self.corpus.add(text_path, (lambda shard_path: self.manifest.record(pdf_path, shard_path))
+                                        if self.manifest else None)
+        elif self.manifest:
+            self.manifest.record(pdf_path, text_path)
+        pdf_conversions.inc(outcome='converted' if text_path else 'failed')
+        if seconds is not None:
+            pdf_conversion_seconds.observe(seconds)
+        if text_path:
+            pdf_conversion_bytes.inc(os.path.getsize(pdf_path))
+        return index, text_path
+
     def convert_pdfs_to_text(self):
-        index:int = self.offset
-        for inputfile in offset_iterator(os.scandir(self.inputfolder), self.offset):
-            if inputfile.name.strip().endswith(".pdf"):
-                yield (index, self.convert_pdf_to_text(inputfile))
-                index=index+1
+        """
+        :return: (index, text path, or None if the conversion failed) for each PDF; with more than one worker, in the
+        order they finish
+        """
+        indexed_paths = enumerate(self.pdf_paths(), self.offset)
+        if self.workers > 1:
+            with Pool(self.workers) as pool:
+                for result in pool.imap_unordered(self.convert_indexed_pdf, indexed_paths, self.chunksize):
+                    yield self.converted(*result)
+        else:
+            for indexed_path in indexed_paths:
+                yield self.converted(*self.convert_indexed_pdf(indexed_path))
 
 
 def main():
-    convertor = Converter(sys.argv[2], sys.argv[1], int(sys.argv[3]))
-    list(convertor.convert_pdfs_to_text())
+    parser = argparse.ArgumentParser(description="Convert a folder of PDFs to text")
+    parser.add_argument('inputfolder')
+    parser.add_argument('outputfolder')
+    parser.add_argument('offset', nargs='?', type=int, default=0, help="PDFs to skip")
+    parser.add_argument('workers', nargs='?', type=int, default=1, help="conversion processes")
+    parser.add_argument('--manifest', default=None,
+                        help="conversion manifest; by default manifest.sqlite3 in the output folder")
+    parser.add_argument('--no-manifest', action='store_true', help="convert every PDF, whether converted before or not")
+    parser.add_argument('--retry-failed', action='store_true', help="try the PDFs that failed last time again")
+    parser.add_argument('--first-page', type=int, default=1, help="first page of each PDF to convert")
+    parser.add_argument('--last-page', type=int, help="last page of each PDF to convert; by default, the last one")
+    parser.add_argument('--corpus', action='store_true',
+                        help="write compressed corpus shards to the output folder instead of a text file per PDF")
+    add_metrics_arguments(parser)
+    arguments = parser.parse_args()
+    snapshots = start_metrics(arguments.metrics_port, arguments.metrics_snapshot, arguments.metrics_interval)
+    try:
+        manifest = None
+        if not arguments.no_manifest:
+            os.makedirs(arguments.outputfolder, exist_ok=True)
+            manifest = ConversionManifest(
+                arguments.manifest or os.path.join(arguments.outputfolder, "manifest.sqlite3"), arguments.retry_failed)
+        convertor = Converter(arguments.outputfolder, arguments.inputfolder, arguments.offset, arguments.workers,
+                              manifest=manifest, first_page=arguments.first_page, last_page=arguments.last_page,
+                              corpus=CorpusWriter(arguments.outputfolder) if arguments.corpus else None)
+        list(convertor.convert_pdfs_to_text())
+        if convertor.corpus:
+            convertor.corpus.close()
+        if manifest:
+            print(f"conversion manifest: {manifest.counts()}")
+    finally:
+        if snapshots:
+            snapshots.stop()
 
 if __name__ == '__main__': main()
 
@@ -0,0 +1,340 @@
+import argparse
+import math
+import os
+import re
+import sqlite3
+from collections import Counter, defaultdict
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from corpus_shards import CorpusReader, is_corpus, record_key
+from corpus_walker import walk_corpus
+from sickle_impl import getLogger
+
+logger = getLogger(__name__)
+
+"""
+A full text index of the converted corpus and its extracted sections, searched with BM25
+(https://en.wikipedia.org/wiki/Okapi_BM25). Each document is indexed once per field: 'text' for the whole document and
+the section name (eg 'background') for each extracted section. A term's postings are the ids of the documents it's in,
+ascending, each stored as the gap from the one before, followed by the term's frequency in it, both as varints. Every
+batch of added documents is a new segment of postings, appended without touching the earlier ones, so indexing new
+documents never rebuilds the index; merge folds a term's segments into one and drops the postings of replaced documents.
+"""
+
+BATCH_DOCUMENTS: int = 1000  # conf, documents indexed in memory before their postings are written as a segment
+K1: float = 1.2  # conf, BM25 term frequency saturation
+B: float = 0.75  # conf, BM25 document length normalization
+TOKEN = re.compile(r'[a-z0-9]{2,}')
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN.findall(text.lower())
+
+
+def encode_postings(postings: Iterable[Tuple[int, int]], last_id: int = 0) -> bytes:
+    """
+    :param postings: (document id, term frequency) in ascending id order
+    :param last_id: the id the first gap is from
+    """
+    encoded = bytearray()
+    for document_id, frequency in postings:
+        for value in (document_id - last_id, frequency):
+            while value >= 0x80:
+                encoded.append(value & 0x7f | 0x80)
+                value >>= 7
+            encoded.append(value)
+        last_id = document_id
+    return bytes(encoded)
+
+
+def decode_postings(encoded: bytes) -> Iterator[Tuple[int, int]]:
+    """
+    :return: (document id, term frequency) pairs of encode_postings
+    """
+    document_id, values, value, shift = 0, [], 0, 0
+    for byte in encoded:
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        values.append(value)
+        value, shift = 0, 0
+        if len(values) == 2:
+            document_id += values[0]
+            yield document_id, values[1]
+            values = []
+
+
+class SearchIndex:
+    """
+    An inverted index in SQLite. Documents are added under a key (an arXiv id or a path) with a stamp, eg the text
+    file's size and modification time; adding a key again with the same stamp is skipped, and with a new one replaces
+    the old document.
+    """
+
+    def __init__(self, path: str = "search_index.sqlite3", batch_documents: int = BATCH_DOCUMENTS):  # conf
+        self.batch_documents = batch_documents
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS document (
+                document_id INTEGER PRIMARY KEY,
+                key TEXT NOT NULL,
+                field TEXT NOT NULL,
+                stamp TEXT,
+                length INTEGER NOT NULL,
+                UNIQUE (key, field));
+            CREATE TABLE IF NOT EXISTS posting (
+                field TEXT NOT NULL,
+                term TEXT NOT NULL,
+                segment INTEGER NOT NULL,
+                postings BLOB NOT NULL,
+                PRIMARY KEY (field, term, segment));
+            CREATE TABLE IF NOT EXISTS shard (
+                prefix TEXT NOT NULL,
+                name TEXT NOT NULL,
+                stamp TEXT NOT NULL,
+                PRIMARY KEY (prefix, name));
+        """)
+        self.connection.commit()
+        self.next_id = (self.connection.execute("SELECT max(document_id) FROM document").fetchone()[0] or 0) + 1
+        # the documents added since the last segment was written: postings by field and term
+        self.pending: Dict[str, Dict[str, List[Tuple[int, int]]]] = defaultdict(lambda: defaultdict(list))
+        self.pending_documents = 0
+        self.lengths: Dict[str, Dict[int, int]] = {}
+
+    def stamp(self, key: str, field: str = 'text') -> Optional[str]:
+        row = self.connection.execute("SELECT stamp FROM document WHERE key = ? AND field = ?", (key, field)).fetchone()
+        return row[0] if row else None
+
+    def add(self, key: str, text: str, field: str = 'text', stamp: str = None) -> bool:
+        """
+        :return: whether the document was indexed; it isn't if it's already indexed with the same stamp
+        """
+        if stamp is not None and self.stamp(key, field) == stamp:
+            return False
+        terms = Counter(tokenize(text))
+        document_id = self.next_id
+        self.next_id += 1
+        # the replaced document's postings stay until merge, but without its row they're never scored
+        self.connection.execute("DELETE FROM document WHERE key = ? AND field = ?", (key, field))
+        self.connection.execute("INSERT INTO document (document_id, key, field, stamp, length) VALUES (?, ?, ?, ?, ?)",
+                                (document_id, key, field, stamp, sum(terms.values())))
+        postings = self.pending[field]
+        for term, frequency in terms.items():
+            postings[term].append((document_id, frequency))
+        self.lengths.pop(field, None)
+        self.pending_documents += 1
+        if self.pending_documents >= self.batch_documents:
+            self.commit()
+        return True
+
+    def remove(self, field: str, keys: Set[str]) -> int:
+        """
+        Drop the documents of a field whose key isn't in keys, eg those deleted from the corpus; like replaced
+        documents, their postings go at the next merge
+        :return: documents dropped
+        """
+        gone = [(key, field) for (key,) in self.connection.execute("SELECT key FROM document WHERE field = ?", (field,))
+                if key not in keys]
+        self.connection.executemany("DELETE FROM document WHERE key = ? AND field = ?", gone)
+        self.lengths.pop(field, None)
+        return len(gone)
+
+    def fields(self) -> List[str]:
+        return [row[0] for row in self.connection.execute("SELECT DISTINCT field FROM document").fetchall()]
+
+    def shard_stamps(self, prefix: str) -> Dict[str, str]:
+        """
+        :return: the stamp of every corpus shard fully indexed, by its file name
+        """
+        return dict(self.connection.execute("SELECT name, stamp FROM shard WHERE prefix = ?", (prefix,)).fetchall())
+
+    def shard_indexed(self, prefix: str, name: str, stamp: Optional[str]):
+        """
+        Commit the documents added so far with a shard's watermark: it's fully indexed with this stamp, or with None,
+        it's gone
+        """
+        self.connection.execute("DELETE FROM shard WHERE prefix = ? AND name = ?", (prefix, name))
+        if stamp is not None:
+            self.connection.execute("INSERT INTO shard (prefix, name, stamp) VALUES (?, ?, ?)", (prefix, name, stamp))
+        self.commit()
+
+    def commit(self):
+        """
+        Write the postings of the documents added since the last commit as a new segment
+        """
+        for field, postings in self.pending.items():
+            self.connection.executemany(
+                "INSERT INTO posting (field, term, segment, postings) VALUES (?, ?, "
+                "(SELECT coalesce(max(segment), -1) + 1 FROM posting WHERE field = ? AND term = ?), ?)",
+                ((field, term, field, term, encode_postings(pairs)) for term, pairs in postings.items()))
+        self.connection.commit()
+        self.pending.clear()
+        self.pending_documents = 0
+
+    def document_lengths(self, field: str) -> Dict[int, int]:
+        """
+        :return: the length in terms of every live document in a field, by document id
+        """
+        if field not in self.lengths:
+            self.lengths[field] = dict(self.connection.execute(
+                "SELECT document_id, length FROM document WHERE field = ?", (field,)).fetchall())
+        return self.lengths[field]
+
+    def postings(self, field: str, term: str) -> Iterator[Tuple[int, int]]:
+        for (encoded,) in self.connection.execute(
+                "SELECT postings FROM posting WHERE field = ? AND term = ? ORDER BY segment", (field, term)):
+            yield from decode_postings(encoded)
+
+    def search(self, query: str, field: str = 'text', limit: int = 10) -> List[Tuple[str, float]]:
+        """
+        :param field: 'text' for whole documents, or a section name
+        :return: (key, BM25 score) of the best matching documents, best first
+        """
+        lengths = self.document_lengths(field)
+        if not lengths:
+            return []
+        count = len(lengths)
+        average_length = sum(lengths.values()) / count or 1
+        scores = Counter()
+        for term in set(tokenize(query)):
+            postings = [(document_id, frequency) for document_id, frequency in self.postings(field, term)
+                        if document_id in lengths]
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for document_id, frequency in postings:
+                norm = K1 * (1 - B + B * lengths[document_id] / average_length)
+                scores[document_id] += idf * frequency * (K1 + 1) / (frequency + norm)
+        best = scores.most_common(limit)
+        keys = dict(self.connection.execute(
+            f"SELECT document_id, key FROM document WHERE document_id IN ({','.join('?' * len(best))})",
+            [document_id for document_id, score in best]).fetchall()) if best else {}
+        return [(keys[document_id], score) for document_id, score in best]
+
+    def merge(self):
+        """
+        Fold each term's segments into one, dropping the postings of replaced documents
+        """
+        self.commit()
+        for field in [row[0] for row in self.connection.execute("SELECT DISTINCT field FROM posting").fetchall()]:
+            lengths = self.document_lengths(field)
+            terms = [row[0] for row in self.connection.execute(
+                "SELECT DISTINCT term FROM posting WHERE field = ?", (field,)).fetchall()]
+            for term in terms:
+                live = [pair for pair in self.postings(field, term) if pair[0] in lengths]
+                self.connection.execute("DELETE FROM posting WHERE field = ? AND term = ?", (field, term))
+                if live:
+                    self.connection.execute("INSERT INTO posting (field, term, segment, postings) VALUES (?, ?, 0, ?)",
+                                            (field, term, encode_postings(live)))
+            self.connection.commit()
+        self.connection.execute("VACUUM")
+
+    def close(self):
+        self.commit()
+        self.connection.close()
+
+
+def file_stamp(stat: os.stat_result) -> str:
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def index_shards(index: SearchIndex, folder: str, prefix: str, add_record: Callable[[dict, str], None]) -> Set[str]:
+    """
+    Index the records of the shards that aren't fully indexed yet, each shard once: a record reconverted into a later
+    shard is indexed only from the latest shard that has it, as CorpusReader.get reads it
+    :param add_record: indexes a record with a stamp
+    :return: the keys of every record in the corpus
+    """
+    reader = CorpusReader(folder, prefix)
+    stamps = index.shard_stamps(prefix)
+    for shard_path in reader.shards:
+        name = os.path.basename(shard_path)
+        # a closed shard never changes, so one indexed with the same stamp has nothing new
+        stamp = f"{name}:{file_stamp(os.stat(shard_path))}"
+        if stamps.pop(name, None) == stamp:
+            continue
+        for record in reader.shard_records(shard_path):
+            if reader.latest_shard(record_key(record)) == shard_path:
+                add_record(record, stamp)
+        index.shard_indexed(prefix, name, stamp)
+    for name in stamps:
+        index.shard_indexed(prefix, name, None)
+    keys = reader.keys()
+    reader.close()
+    return keys
+
+
+def index_corpus(index: SearchIndex, content_folder: str, sections_folder: str = None) -> Counter:
+    """
+    Index what's new or changed in a converted corpus, as text files or corpus shards, and in its extracted sections,
+    as the section subfolders extract_and_save_all_sections writes or the shards of extract_all_sections_to_corpus,
+    and drop the documents deleted from them
+    :return: documents indexed, by field
+    """
+    indexed = Counter()
+
+    def add(key: str, text: str, field: str, stamp: str):
+        if index.add(key, text, field, stamp):
+            indexed[field] += 1
+
+    if is_corpus(content_folder):
+        keys = index_shards(index, content_folder, 'corpus',
+                            lambda record, stamp: add(record_key(record), record['text'], 'text', stamp))
+    else:
+        keys = set()
+        for entry in walk_corpus(content_folder, ('*.txt',)):
+            with open(entry.path, encoding='UTF-8', errors='replace') as text_file:
+                key = os.path.relpath(entry.path, content_folder)
+                keys.add(key)
+                add(key, text_file.read(), 'text', file_stamp(entry.stat()))
+    index.remove('text', keys)
+    if sections_folder and is_corpus(sections_folder, 'sections'):
+        def add_sections(record: dict, stamp: str):
+            for name, section in record['sections'].items():
+                add(record_key(record), section, name, stamp)
+
+        keys = index_shards(index, sections_folder, 'sections', add_sections)
+        for name in index.fields():
+            if name != 'text':
+                index.remove(name, keys)
+    elif sections_folder:
+        for name in sorted(os.listdir(sections_folder)):
+            section_folder = os.path.join(sections_folder, name)
+            if not os.path.isdir(section_folder):
+                continue
+            keys = set()
+            for entry in walk_corpus(section_folder, ('*.txt',)):
+                with open(entry.path, encoding='UTF-8', errors='replace') as section_file:
+                    key = os.path.relpath(entry.path, section_folder)
+                    keys.add(key)
+                    add(key, section_file.read(), name, file_stamp(entry.stat()))
+            index.remove(name, keys)
+    index.commit()
+    return indexed
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Index a converted corpus and search it with BM25")
+    parser.add_argument('--index', default="search_index.sqlite3", help="index file")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help="index the new and changed documents of a corpus")
+    build.add_argument('content_folder', help="text files or corpus shards, as run_pdftotext writes them")
+    build.add_argument('sections_folder', nargs='?', help="sections, as extract_background writes them")
+    build.add_argument('--merge', action='store_true', help="fold the postings into one segment per term afterwards")
+    search = commands.add_parser('search', help="print the best matching documents with their scores")
+    search.add_argument('query')
+    search.add_argument('--field', default='text', help="'text' for whole documents, or a section name")
+    search.add_argument('--limit', type=int, default=10)
+    arguments = parser.parse_args(argv)
+    index = SearchIndex(arguments.index)
+    if arguments.command == 'build':
+        print(f"indexed {dict(index_corpus(index, arguments.content_folder, arguments.sections_folder))}")
+        if arguments.merge:
+            index.merge()
+    else:
+        for key, score in index.search(arguments.query, arguments.field, arguments.limit):
+            print(f"{score:8.3f}  {key}")
+    index.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,17 @@
 import sickle
 from lxml import etree
 from sickle.iterator import OAIItemIterator
+from sickle.oaiexceptions import BadResumptionToken
+from sickle.response import OAIResponse, XMLParser
 from requests.exceptions import HTTPError, ConnectionError
 from requests import Response
 import logging
 import time
 
+from http_client import HttpClient, get_client
+from response_cache import OfflineCacheMiss
+from metrics import registry
+
 MAX_CONSECUTIVE_REQUEST_FAILURES:int = 5
 
 def getLogger(module:str, console_level=logging.INFO, file_level=logging.DEBUG):
@@ -28,28 +34,93 @@ def getLogger(module:str, console_level=logging.INFO, file_level=logging.DEBUG):
 
 logger = getLogger(__name__)
 
+oai_pages = registry.counter('oai_pages_total', "OAI-PMH pages fetched")
+oai_page_seconds = registry.histogram('oai_page_seconds', "OAI-PMH page requests, from the rate limiter to the last byte")
+oai_page_bytes = registry.counter('oai_page_bytes_total', "bytes of OAI-PMH pages")
+oai_records = registry.counter('oai_records_total', "OAI-PMH records harvested, including those already seen")
+oai_backoff_seconds = registry.counter('oai_backoff_seconds_total',
+                                       "seconds of retry backoff and of waits arXiv asked for while harvesting")
+
+
+class ParsedOAIResponse(OAIResponse):
+    """
+    OAIResponse parses the whole page again each time its xml is asked for, and the item iterator asks three times a
+    page (for an error, the records and the resumption token); this one parses it once
+    """
+
+    def __init__(self, http_response, params):
+        super().__init__(http_response, params)
+        self._xml = None
+
+    @property
+    def xml(self):
+        if self._xml is None:
+            self._xml = etree.XML(self.http_response.content, parser=XMLParser)
+        return self._xml
+
+
+class ThrottledSickle(sickle.Sickle):
+    """
+    Sickle whose OAI requests go through the shared HTTP client, taking their turn from its rate limiter
+    """
+
+    def __init__(self, endpoint, client: HttpClient, **kwargs):
+        super().__init__(endpoint, **kwargs)
+        self.client = client
+
+    def _request(self, kwargs):
+        if self.http_method == 'GET':
+            return self.client.get(self.endpoint, params=kwargs, **self.request_args)
+        return self.client.post(self.endpoint, data=kwargs, **self.request_args)
+
+    def harvest(self, **kwargs):
+        with oai_page_seconds.time():
+            response = super().harvest(**kwargs)
+        oai_pages.inc()
+        oai_page_bytes.inc(len(response.http_response.content))
+        return ParsedOAIResponse(response.http_response, response.params)
+
 
 class Sickle_Impl:
-    def __init__(self, oai_url="http://export.arxiv.org/oai2", metadata_format='arXivRaw'):
+    def __init__(self, oai_url="http://export.arxiv.org/oai2", metadata_format='arXivRaw', client: HttpClient = None):
         self.metadata_format = metadata_format
-        self.arxiv: OAIItemIterator = sickle.Sickle(oai_url, iterator=OAIItemIterator)
+        client = client or get_client()
+        self.limiter = client.limiter
+        self.arxiv: OAIItemIterator = ThrottledSickle(oai_url, client, iterator=OAIItemIterator)
         print(f"*** extracting metadata from {oai_url} in {metadata_format} format ***")
 
-    def get_ids(self, set: str = 'cs'):
+    def list_records(self, set: str, from_date: str = None, until: str = None, resumption_token: str = None):
+        if resumption_token:
+            return self.arxiv.ListRecords(resumptionToken=resumption_token)
+        window = {key: value for key, value in (('from', from_date), ('until', until)) if value}
+        return self.arxiv.ListRecords(metadataPrefix=self.metadata_format, set=set, **window)
+
+    def get_ids(self, set: str = 'cs', from_date: str = None, until: str = None, state=None, incremental=False,
+                catalog=None):
+        """
+        Harvest the arXiv ids in an OAI set
+        :param set: OAI set spec
+        :param from_date: only harvest records with a datestamp on or after this day (YYYY-MM-DD)
+        :param until: only harvest records with a datestamp on or before this day (YYYY-MM-DD)
+        :param state: optional HarvestState; an interrupted harvest of the same window resumes from its last
+        resumptionToken, and ids already harvested with the same datestamp are not yielded again. The caller calls
+        state.acknowledge() whenever it has finished with the ids yielded so far; only then do they count as harvested
+        :param incremental: with a state and no from_date, harvest only what changed since the last complete harvest
+        :param catalog: optional Catalog in which to keep every harvested record, not just its id
+        """
+        if state and incremental and from_date is None:
+            from_date = state.last_completed(set, self.metadata_format)
+            if from_date:
+                logger.info(f"incremental harvest of {set} from {from_date}")
+        resumption_token = state.begin(set, self.metadata_format, from_date, until) if state else None
+        recerator = self.open_records(set, from_date, until, resumption_token)
+        # the token that fetched the page being consumed is the checkpoint; the page's own token fetches the next one
+        page_token = resumption_token
+        seen_token = token_of(recerator)
         counter = 0
-        trial = 0
-        recerator:OAIItemIterator = None
-        while recerator == None:
-            # OMG, the call to __next__ blows up on a 503 refresh response. I can't use iteration
-            try:
-                recerator = self.arxiv.ListRecords(metadataPrefix=self.metadata_format, set=set)
-            except HTTPError as he:
-                refresh_period = detect_refresh_request(he.response.content.strip(), ns)
-                if trial >= MAX_CONSECUTIVE_REQUEST_FAILURES:
-                    raise he
-                logger.info(f"arXiv asked us to wait {refresh_period} seconds on {to_ordinal(trial)} attempt in get_ids")
-                trial = trial + 1
-                time.sleep(refresh_period)
+        # records to pass over after a restart without a state to tell which ids were yielded already
+        skip = 0
+        restarts = 0
         consecutive_failures = 0
         backoff = 60
         last_backoff = 0
@@ -60,7 +131,27 @@ class Sickle_Impl:
                 backoff = 10
                 last_backoff = 0
             except StopIteration as si:
+                if catalog:
+                    catalog.commit()
+                if state:
+                    state.complete(set, self.metadata_format)
                 break
+            except OfflineCacheMiss:
+                raise
+            except BadResumptionToken as brt:
+                # the token of the next page expired while we were consuming this one
+                restarts += 1
+                if restarts > MAX_CONSECUTIVE_REQUEST_FAILURES:
+                    raise brt
+                logger.warning(f"resumptionToken {seen_token} was rejected ({brt}) after {counter} records, restarting "
+                               f"the harvest from {from_date or 'the start'}")
+                if state:
+                    state.checkpoint(set, self.metadata_format, None)
+                else:
+                    skip = counter
+                recerator = self.open_records(set, from_date, until)
+                page_token, seen_token = None, token_of(recerator)
+                continue
             except HTTPError as he:
                 logger.error(he)
                 consecutive_failures+=1
@@ -77,7 +168,9 @@ class Sickle_Impl:
                     backoff = backoff + last_backoff
                     last_backoff = hold_backoff
                 logger.error(f"waiting {delay} seconds to resume harvesting ids from the OAI API due to HTTPError {he}")
-                time.sleep(delay)
+                # arXiv is unavailable to every thread, not just this one
+                oai_backoff_seconds.inc(delay)
+                self.limiter.defer(delay)
                 continue
             except ConnectionError as ce:
                 consecutive_failures+=1
@@ -85,22 +178,66 @@ class Sickle_Impl:
                 if consecutive_failures > MAX_CONSECUTIVE_REQUEST_FAILURES:
                     raise(ce)
                 logger.info(f"Taking {backoff} seconds")
+                oai_backoff_seconds.inc(backoff)
                 time.sleep(backoff)
                 hold_backoff = backoff
                 backoff = backoff + last_backoff
                 last_backoff = hold_backoff
                 continue
+            current_token = token_of(recerator)
+            if current_token != seen_token:
+                page_token, seen_token = seen_token, current_token
+                # the records of the pages before the checkpoint won't be fetched again
+                if catalog:
+                    catalog.commit()
+                if state:
+                    state.checkpoint(set, self.metadata_format, page_token)
+            if skip:
+                skip -= 1
+                continue
             counter += 1
+            oai_records.inc()
             # logger.trace(f"item {counter} is {item.header.identifier}")
+            if catalog:
+                catalog.add(item)
             ids = item.metadata['id']
             if len(ids) > 0:
+                if state:
+                    if state.seen(set, ids[0], item.header.datestamp):
+                        continue
+                    state.record(set, ids[0], item.header.datestamp)
                 yield ids[0]
             if len(ids) > 1:
                 logger.warning(f"item {counter} had multiple ids: {';'.join(ids)}")
 
-    def get_batched_ids(self, batch_size=50000, set='cs'):
+    def open_records(self, set: str, from_date: str = None, until: str = None, resumption_token: str = None):
+        """
+        :return: the iterator of the records in the window, or from its resumptionToken; a rejected token starts the
+        window over
+        """
+        trial = 0
+        recerator:OAIItemIterator = None
+        while recerator == None:
+            # OMG, the call to __next__ blows up on a 503 refresh response. I can't use iteration
+            try:
+                recerator = self.list_records(set, from_date, until, resumption_token)
+            except BadResumptionToken as brt:
+                # tokens expire; start the window over and let the state skip what we already have
+                logger.warning(f"resumptionToken {resumption_token} was rejected ({brt}), restarting the harvest")
+                resumption_token = None
+            except HTTPError as he:
+                refresh_period = detect_refresh_request(he.response.content.strip(), ns)
+                if trial >= MAX_CONSECUTIVE_REQUEST_FAILURES:
+                    raise he
+                logger.info(f"arXiv asked us to wait {refresh_period} seconds on {to_ordinal(trial)} attempt in get_ids")
+                trial = trial + 1
+                oai_backoff_seconds.inc(refresh_period or 0)
+                self.limiter.defer(refresh_period)
+        return recerator
+
+    def get_batched_ids(self, batch_size=50000, set='cs', **harvest_args):
         current_batch = list()
-        for id in self.get_ids(set):
+        for id in self.get_ids(set, **harvest_args):
             current_batch.append(id)
             current_batch_size = len(current_batch)
             if 0 == current_batch_size % 200:
@@ -108,6 +245,12 @@ class Sickle_Impl:
             if current_batch_size >= batch_size:
                 yield current_batch
                 current_batch = list()
+        if current_batch:
+            yield current_batch
+
+
+def token_of(recerator: OAIItemIterator):
+    return recerator.resumption_token.token if recerator.resumption_token else None
 
 
 def to_ordinal(cardinal: int):
@@ -136,6 +279,9 @@ def detect_refresh_request(pdf_bytes: bytes, ns: dict = ns):
     Sometimes, arXiv asks you to wait ten seconds and try again
     :return:
     """
+    if pdf_bytes[:16].lstrip().lstrip(b'\xef\xbb\xbf').startswith(b'%PDF'):
+        # a PDF is no refresh request, and it's no use HTML parsing one to find that out
+        return False
     try:
         html:etree._Element = etree.fromstring(pdf_bytes, etree.HTMLParser())
         meta_elements = html.xpath('/html/head/meta[@http-equiv="refresh"]')
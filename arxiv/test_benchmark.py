@@ -0,0 +1,58 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+import requests
+
+import getter
+from arxiv_stub import StubArxiv
+from benchmark import compare, main, percentile
+from getter import no_pdf
+from sickle_impl import detect_refresh_request
+
+
+class Test(TestCase):
+    def test_percentile(self):
+        values = [i / 100 for i in range(100, 0, -1)]
+        assert percentile(values, 0.5) == 0.5
+        assert percentile(values, 0.99) == 0.99
+        assert percentile([3.0], 0.99) == 3.0
+        assert percentile([], 0.5) is None
+
+    def test_stub(self):
+        stub = StubArxiv(records=5, page_size=2, error_rate=1, retry_after=2).start()
+        try:
+            response = requests.get(f"{stub.url}/pdf/1501.00001v1")
+            assert response.status_code == 503 and response.headers['Retry-After'] == '2'
+            assert detect_refresh_request(response.content) == 2
+            stub.error_rate, stub.no_pdf_rate = 0, 1
+            assert no_pdf(requests.get(f"{stub.url}/pdf/1501.00001v1").content)
+            page = requests.get(f"{stub.url}/oai2", params=dict(verb='ListRecords', resumptionToken='2')).content
+            assert b'<id>1501.00004</id>' in page and b'completeListSize="5"></resumptionToken>' in page
+        finally:
+            stub.stop()
+
+    def test_benchmark(self):
+        with tempfile.TemporaryDirectory() as folder:
+            output = os.path.join(folder, 'benchmarks.jsonl')
+            arguments = ['--output', output, '--records', '30', '--page-size', '10', '--downloads', '20',
+                         '--extractions', '5', '--conversions', '2', '--stages', 'get_ids', 'download_pdfs',
+                         'converter', 'extractor']
+            base_url = getter.base_url
+            main(arguments)
+            result = main(arguments + ['--compare'])
+            assert getter.base_url == base_url
+            with open(output) as results_file:
+                assert [json.loads(line)['stages'] for line in results_file][-1] == result['stages']
+            stages = result['stages']
+            assert stages['get_ids']['items'] == 30
+            # the recorded feed's entries qualify about one time in four
+            assert 0 < stages['download_pdfs']['items'] < 20 and stages['download_pdfs']['bytes']
+            assert stages['extractor']['items'] == 5 and stages['extractor']['p99_ms'] >= stages['extractor']['p50_ms']
+            assert stages['converter'].get('items') == 2 or 'skipped' in stages['converter']
+            assert compare(result, result) == [f"{name}: items_per_second {stage['items_per_second']} -> "
+                                               f"{stage['items_per_second']} (+0.0%), p50_ms {stage['p50_ms']} -> "
+                                               f"{stage['p50_ms']} (+0.0%), p99_ms {stage['p99_ms']} -> "
+                                               f"{stage['p99_ms']} (+0.0%)"
+                                               for name, stage in stages.items() if 'items' in stage]
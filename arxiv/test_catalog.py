@@ -0,0 +1,32 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from lxml import etree
+from sickle.models import Record
+
+from catalog import Catalog
+
+record_xml = """<record xmlns="http://www.openarchives.org/OAI/2.0/">
+<header><identifier>oai:arXiv.org:1501.05260</identifier><datestamp>2018-11-29</datestamp><setSpec>cs</setSpec></header>
+<metadata><arXivRaw xmlns="http://arxiv.org/OAI/arXivRaw/">
+<id>1501.05260</id><submitter>Yong Wang</submitter>
+<version version="v1"><date>Sat, 17 Jan 2015 04:55:39 GMT</date><size>125kb</size></version>
+<version version="v3"><date>Wed, 28 Nov 2018 16:05:33 GMT</date><size>160kb</size></version>
+<title>An Algebra of Reversible Quantum Computing</title><authors>Yong Wang</authors>
+<categories>cs.LO quant-ph</categories><journal-ref>Quantum Inf Comput 2018</journal-ref>
+<doi>10.1000/xyz</doi><abstract>We extend the algebra of reversible computation.</abstract>
+</arXivRaw></metadata></record>"""
+
+
+class Test(TestCase):
+    def test_qualified(self):
+        with tempfile.TemporaryDirectory() as folder:
+            catalog = Catalog(os.path.join(folder, 'catalog.sqlite3'))
+            catalog.add(Record(etree.fromstring(record_xml)))
+            assert catalog.get('1501.05260')['versions'][-1]['version'] == 'v3'
+            assert list(catalog.qualified(['1501.05260'], ['cs.LO'], 'reversible')) == [
+                ('1501.05260', 'http://export.arxiv.org/pdf/1501.05260v3')]
+            assert list(catalog.qualified(['1501.05260'], ['cs.AI'])) == []
+            assert list(catalog.qualified(['1501.05261'])) == []
+            catalog.close()
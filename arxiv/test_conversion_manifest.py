@@ -0,0 +1,31 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from conversion_manifest import ConversionManifest
+
+
+class Test(TestCase):
+    def test_needs_conversion(self):
+        with tempfile.TemporaryDirectory() as folder:
+            pdf_path, text_path = os.path.join(folder, 'a.pdf'), os.path.join(folder, 'a.txt')
+            with open(pdf_path, 'wb') as pdf:
+                pdf.write(b'%PDF-1.4 one')
+            manifest = ConversionManifest(os.path.join(folder, 'manifest.sqlite3'))
+            assert manifest.needs_conversion(pdf_path)
+            with open(text_path, 'w') as text:
+                text.write('one')
+            manifest.record(pdf_path, text_path)
+            assert not manifest.needs_conversion(pdf_path)
+            # touched but unchanged
+            os.utime(pdf_path, ns=(0, 0))
+            assert not manifest.needs_conversion(pdf_path)
+            with open(pdf_path, 'wb') as pdf:
+                pdf.write(b'%PDF-1.4 two')
+            assert manifest.needs_conversion(pdf_path)
+            manifest.record(pdf_path, None)
+            assert not manifest.needs_conversion(pdf_path)
+            manifest.retry_failed = True
+            assert manifest.needs_conversion(pdf_path)
+            assert manifest.counts() == {'failed': 1}
+            manifest.close()
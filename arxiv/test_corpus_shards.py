@@ -0,0 +1,69 @@
+import os
+import tempfile
+from unittest import TestCase
+
+import corpus_shards
+from corpus_shards import CorpusReader, CorpusWriter, GZIP_SUFFIX, ZSTD_SUFFIX, arxiv_id_of, shard_paths
+from extract_background import Extractor, SECTIONS, load_match_extract
+
+
+class Test(TestCase):
+    def test_arxiv_id_of(self):
+        assert arxiv_id_of('computing/export_arxiv_org_pdf_1501_05260v3.pdf') == '1501.05260v3'
+        assert arxiv_id_of('export_arxiv_org_pdf_math_GT_0309136v1.txt') == 'math.GT/0309136v1'
+        assert arxiv_id_of('export_arxiv_org_pdf_cs_0101001') == 'cs/0101001'
+        assert arxiv_id_of('notes.txt') is None
+
+    def test_write_and_read(self):
+        records = [dict(arxiv_id=f"1501.{number:05d}v1", source_path=f"export_arxiv_org_pdf_1501_{number:05d}v1.pdf",
+                        text=f"I. INTRODUCTION\nnumber {number}\nII. BACKGROUND\nbackground {number}")
+                   for number in range(25)]
+        with tempfile.TemporaryDirectory() as folder:
+            # a block every few records and a shard every few blocks
+            writer = CorpusWriter(folder, block_bytes=200, shard_bytes=1000)
+            for record in records[:20]:
+                writer.add(record)
+            writer.close()
+            # a later run starts a shard of its own
+            writer = CorpusWriter(folder, block_bytes=200, shard_bytes=1000)
+            for record in records[20:]:
+                writer.add(record)
+            writer.close()
+            assert len(shard_paths(folder)) > 2
+            assert not [name for name in os.listdir(folder) if name.endswith('.part')]
+            reader = CorpusReader(folder)
+            assert list(reader.records()) == records
+            assert reader.get('1501.00013v1') == records[13]
+            assert reader.get('1501.00024v1') == records[24]
+            assert reader.get('1501.99999v1') is None
+            reader.close()
+
+            sections_folder = os.path.join(folder, 'sections')
+            report = Extractor(load_match_extract(), folder).extract_all_sections_to_corpus(SECTIONS, sections_folder)
+            assert report.scanned == 25 and report.sections['background'] == 25
+            sections = CorpusReader(sections_folder, prefix='sections')
+            assert sections.get('1501.00007v1')['sections'] == {'background': 'background 7'}
+            sections.close()
+
+    def write_and_read_blocks(self, suffix: str):
+        records = [dict(arxiv_id=f"1501.{number:05d}v1", source_path=f"{number}.pdf", text=f"text {number}\n" * 20)
+                   for number in range(10)]
+        with tempfile.TemporaryDirectory() as folder:
+            writer = CorpusWriter(folder, block_bytes=500)
+            writer.suffix = suffix
+            for record in records:
+                writer.add(record)
+            writer.close()
+            assert shard_paths(folder)[0].endswith(suffix)
+            reader = CorpusReader(folder)
+            assert list(reader.records()) == records
+            assert reader.get('1501.00006v1') == records[6]
+            reader.close()
+
+    def test_zstd(self):
+        if corpus_shards.zstandard is None:
+            self.skipTest("zstandard isn't installed")
+        self.write_and_read_blocks(ZSTD_SUFFIX)
+
+    def test_gzip(self):
+        self.write_and_read_blocks(GZIP_SUFFIX)
@@ -0,0 +1,20 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from corpus_walker import walk_corpus, mirror_path
+
+
+class Test(TestCase):
+    def test_walk_corpus(self):
+        with tempfile.TemporaryDirectory() as folder:
+            for path in ('b.pdf', 'a/z.pdf', 'a/y.txt', 'a/b/x.pdf', '.c.pdf.part', 'c.pdf'):
+                os.makedirs(os.path.join(folder, os.path.dirname(path)), exist_ok=True)
+                open(os.path.join(folder, path), 'w').close()
+            names = [os.path.relpath(entry.path, folder) for entry in walk_corpus(folder, ('*.pdf',))]
+            assert names == ['a/b/x.pdf', 'a/z.pdf', 'b.pdf', 'c.pdf']
+            assert [entry.name for entry in walk_corpus(folder, ('*.pdf',), recursive=False)] == ['b.pdf', 'c.pdf']
+            assert [entry.name for entry in walk_corpus(folder, ('*.pdf',), shard=1, shards=2)] == ['z.pdf', 'c.pdf']
+            output_path = mirror_path(os.path.join(folder, 'a/b/x.pdf'), folder, os.path.join(folder, 'text'), '.txt')
+            assert output_path == os.path.join(folder, 'text', 'a', 'b', 'x.txt')
+            assert os.path.isdir(os.path.dirname(output_path))
@@ -1,6 +1,9 @@
+import os
+import tempfile
 from unittest import TestCase
 
-from extract_background import increment_roman_numeral
+from extract_background import Extractor, increment_roman_numeral, load_match_extract, Outline, SECTIONS, \
+    SizeStatistics
 
 
 class Test(TestCase):
@@ -12,3 +15,53 @@ class Test(TestCase):
         assert increment_roman_numeral("CDXCIX") == "D"
         assert increment_roman_numeral("MCMLXXI") == "MCMLXXII"
         assert increment_roman_numeral("MMCMXCIX") == "MMM"
+        # numbers ending in VIII
+        assert increment_roman_numeral("VIII") == "IX"
+        assert increment_roman_numeral("XVIII") == "XIX"
+        assert increment_roman_numeral("LXXXVIII") == "LXXXIX"
+        assert increment_roman_numeral("MDCCCLXXXVIII") == "MDCCCLXXXIX"
+
+    def test_outline(self):
+        text = "\n".join(["An Algebra of Reversible Quantum Computing", "",
+                          "I. INTRODUCTION", "We extend the algebra.", "1. a numbered list item", "",
+                          "II. BACKGROUND", "Reversible computation.", "2.1 Process Algebra", "Rules.",
+                          "III. RELATED WORK", "Others.", "IV Methods", "Ours.", "V. CONCLUSION", "Done."])
+        outline = Outline(text)
+        assert [header.number for header in outline.headers] == ['I', 'II', 'III', 'IV', 'V']
+        assert outline.section(SECTIONS['background']) == "Reversible computation.\n2.1 Process Algebra\nRules."
+        assert outline.section(SECTIONS['related_work']) == "Others."
+        assert outline.section(SECTIONS['methods']) == "Ours."
+        assert outline.section('ACKNOWLEDGMENTS') is None
+
+    def test_outline_numbered_list(self):
+        text = "\n".join(["1 Introduction", "Our contributions:", "1. We propose an algebra", "2. We prove it sound",
+                          "3. We implement it", "2 Background", "Process algebra.", "3 Related Work", "Others.",
+                          "4 Conclusion", "Done."])
+        outline = Outline(text)
+        assert [header.title for header in outline.headers] == ['Introduction', 'Background', 'Related Work',
+                                                                'Conclusion']
+        assert outline.section(SECTIONS['background']) == "Process algebra."
+        assert Outline(text.encode('utf-8')).section(SECTIONS['related_work']) == "Others."
+
+    def test_extract_mmap(self):
+        text = "\n".join(["I. INTRODUCTION", "We extend the algebra.", "II. BACKGROUND", "Reversible computation.",
+                          "III. RELATED WORK", "Others."])
+        assert Outline(text.encode('utf-8')).section(SECTIONS['related_work']) == "Others."
+        with tempfile.TemporaryDirectory() as folder:
+            path, empty = os.path.join(folder, 'paper.txt'), os.path.join(folder, 'empty.txt')
+            with open(path, 'w') as text_file:
+                text_file.write(text)
+            open(empty, 'w').close()
+            for use_mmap in (True, False):
+                extractor = Extractor(load_match_extract(), folder, use_mmap=use_mmap)
+                assert extractor.extract(path) == "Reversible computation."
+                assert extractor.extract(empty) is None
+                assert extractor.extract_sections(path, SECTIONS) == dict(background="Reversible computation.",
+                                                                          related_work="Others.")
+            assert extractor.extract(dict(text=text)) == "Reversible computation."
+
+    def test_size_statistics(self):
+        statistics = SizeStatistics()
+        for size in (2, 4, 4, 4, 5, 5, 7, 9):
+            statistics.add(size)
+        assert statistics.as_dict() == dict(count=8, least=2, mean=5.0, greatest=9, stddev=2.0)
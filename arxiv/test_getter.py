@@ -0,0 +1,95 @@
+import os
+import tempfile
+from unittest import TestCase
+
+import getter
+from arxiv_stub import StubArxiv
+from getter import parse_feed, link_from_entry, qualify_entry, query_feed
+from http_client import HttpClient, set_client
+from rate_limiter import RateLimiter
+from response_cache import ResponseCache
+from sickle_impl import Sickle_Impl, detect_refresh_request, ns
+from work_queue import WorkQueue
+
+FEED = b"""<?xml version="1.0" encoding="UTF-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom" xmlns:opensearch="http://a9.com/-/spec/opensearch/1.1/"
+      xmlns:arxiv="http://arxiv.org/schemas/atom">
+  <opensearch:totalResults>3</opensearch:totalResults>
+  <opensearch:startIndex>0</opensearch:startIndex>
+  <opensearch:itemsPerPage>2</opensearch:itemsPerPage>
+  <entry><id>http://arxiv.org/abs/2101.00001v1</id><arxiv:doi>10.1/a</arxiv:doi><arxiv:journal_ref>J</arxiv:journal_ref>
+    <link type="application/pdf" href="http://arxiv.org/pdf/2101.00001v1"/></entry>
+  <entry><id>http://arxiv.org/abs/2101.00002v1</id>
+    <link type="application/pdf" href="http://arxiv.org/pdf/2101.00002v1"/></entry>
+</feed>"""
+
+
+class Test(TestCase):
+    def test_parse_feed(self):
+        page = parse_feed(FEED, lambda entry: link_from_entry(entry) if qualify_entry(entry, ns) else None)
+        assert page.values == ['http://export.arxiv.org/pdf/2101.00001v1']
+        assert page[1:] == (2, 3, 0, 2)
+        with self.assertRaises(ValueError):
+            parse_feed(b'<feed xmlns="http://www.w3.org/2005/Atom"/>')
+
+    def test_detect_refresh_request(self):
+        assert detect_refresh_request(b'%PDF-1.4 <html><head><meta http-equiv="refresh" content="5"></head></html>') \
+               is False
+        assert detect_refresh_request(b'<html><head><meta http-equiv="refresh" content="5"></head></html>') == 5
+
+    def test_query_feed_retry_skips_cache(self):
+        stub = StubArxiv(records=5).start()
+        # the first answer is a truncated feed, which the client caches as it would any 200
+        answers, feed, hits = [b'<feed xmlns="http://www.w3.org/2005/Atom">'], stub.query_feed, []
+
+        def answer(*args):
+            hits.append(args)
+            return answers.pop() if answers else feed(*args)
+        stub.query_feed = answer
+        base_url = getter.base_url
+        with tempfile.TemporaryDirectory() as folder:
+            limiter = RateLimiter(requests_per_second=100)
+            client = HttpClient(limiter, cache=ResponseCache(os.path.join(folder, 'responses.sqlite3')))
+            set_client(client)
+            getter.base_url = f"{stub.url}/api/query?"
+            try:
+                page = query_feed(['1501.00001'], 'computing', 0, 1, init_delay_s=0.02)
+                assert page.records_returned == 1 and len(hits) == 2
+                # the complete feed is replayed from the cache, without holding up the rate limiter
+                assert query_feed(['1501.00001'], 'computing', 0, 1).records_returned == 1
+                assert len(hits) == 2 and limiter.paused() == 0
+            finally:
+                getter.base_url = base_url
+                client.close()
+                set_client(None)
+                stub.stop()
+
+    def test_queue_stages(self):
+        stub = StubArxiv(records=3, page_size=2).start()
+        trials, poll_interval = getter.DOWNLOAD_TRIALS, getter.POLL_INTERVAL
+        getter.DOWNLOAD_TRIALS, getter.POLL_INTERVAL = 2, 0.1
+        client = HttpClient(RateLimiter(requests_per_second=100))
+        set_client(client)
+        with tempfile.TemporaryDirectory() as folder:
+            queue = WorkQueue(os.path.join(folder, 'work_queue.sqlite3'))
+            try:
+                worker = getter.getter('computing', 10, queue, idle_timeout=0.5,
+                                       harvester=Sickle_Impl(f"{stub.url}/oai2"))
+                worker.enqueue(batch_size=2)
+                assert queue.counts(getter.IDS_QUEUE) == {'ready': 3}
+                queue.put(getter.PDFS_QUEUE, [dict(target_dir=folder, url=f"{stub.url}/pdf/1501.00001v1"),
+                                              dict(target_dir=folder, url=f"{stub.url}/missing/1501.00002v1")])
+                worker.dequeue()
+                # the download that ran out of trials waits out its retry delay rather than being marked done
+                assert queue.counts(getter.PDFS_QUEUE) == {'done': 1, 'invisible': 1}
+                stub.no_pdf_rate = 1
+                queue.put(getter.PDFS_QUEUE, [dict(target_dir=folder, url=f"{stub.url}/pdf/1501.00003v1")])
+                worker.dequeue()
+                # arXiv having no PDF won't change on a retry
+                assert queue.counts(getter.PDFS_QUEUE) == {'done': 2, 'invisible': 1}
+            finally:
+                getter.DOWNLOAD_TRIALS, getter.POLL_INTERVAL = trials, poll_interval
+                queue.close()
+                client.close()
+                set_client(None)
+                stub.stop()
@@ -0,0 +1,166 @@
+import os
+import tempfile
+from types import SimpleNamespace
+from unittest import TestCase
+
+from sickle.oaiexceptions import BadResumptionToken
+
+from harvest_state import HarvestState
+from http_client import HttpClient
+from sickle_impl import Sickle_Impl
+
+
+class FakeRecords:
+    """ two pages of records; the first page's resumptionToken fetches the second """
+
+    pages = {None: (['0001', '0002'], 'page2'), 'page2': (['0003', '0004'], None)}
+
+    def __init__(self, token=None, fail_after=None, expired=()):
+        """
+        :param expired: tokens rejected as expired the next time they're used, each once
+        """
+        self.token = token
+        self.fail_after = fail_after
+        self.expired = expired
+        self.returned = 0
+        self._load(token)
+
+    def _load(self, token):
+        ids, next_token = self.pages[token]
+        self.items = iter(ids)
+        self.resumption_token = SimpleNamespace(token=next_token) if next_token else None
+
+    def next(self):
+        if self.fail_after is not None and self.returned >= self.fail_after:
+            raise KeyboardInterrupt()
+        for arxiv_id in self.items:
+            self.returned += 1
+            return SimpleNamespace(metadata={'id': [arxiv_id]}, header=SimpleNamespace(datestamp='2020-04-04'))
+        if self.resumption_token:
+            if self.resumption_token.token in self.expired:
+                self.expired.remove(self.resumption_token.token)
+                raise BadResumptionToken("The value of the resumptionToken argument is invalid or expired.")
+            self._load(self.resumption_token.token)
+            return self.next()
+        raise StopIteration
+
+
+class FakeCatalog:
+    def __init__(self):
+        self.added = []
+        self.committed = []
+
+    def add(self, item):
+        self.added.append(item.metadata['id'][0])
+
+    def commit(self):
+        self.committed = list(self.added)
+
+
+class Test(TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, 'state.sqlite3')
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def harvester(self, calls: list, fail_after=None, expired=()):
+        impl = Sickle_Impl(client=HttpClient())
+
+        def list_records(**kwargs):
+            calls.append(kwargs)
+            return FakeRecords(kwargs.get('resumptionToken'), fail_after, expired)
+
+        impl.arxiv = SimpleNamespace(ListRecords=list_records)
+        return impl
+
+    def test_resume_from_checkpoint(self):
+        calls = []
+        state = HarvestState(self.path)
+        harvested = []
+        with self.assertRaises(KeyboardInterrupt):
+            for arxiv_id in self.harvester(calls, fail_after=3).get_ids('cs', state=state):
+                harvested.append(arxiv_id)
+                state.acknowledge()
+        state.close()
+        assert harvested == ['0001', '0002', '0003']
+
+        state = HarvestState(self.path)
+        resumed = list(self.harvester(calls).get_ids('cs', state=state))
+        state.acknowledge()
+        # the second page is fetched again with its token, and only the unseen id comes back
+        assert calls[-1] == {'resumptionToken': 'page2'}
+        assert resumed == ['0004']
+        assert state.last_completed('cs', 'arXivRaw') is not None
+
+    def test_catalog_committed_with_checkpoint(self):
+        calls = []
+        state = HarvestState(self.path)
+        catalog = FakeCatalog()
+        with self.assertRaises(KeyboardInterrupt):
+            for arxiv_id in self.harvester(calls, fail_after=3).get_ids('cs', state=state, catalog=catalog):
+                state.acknowledge()
+        state.close()
+        # the resumed harvest starts at the second page, so the first page's records have to be in the catalog
+        state = HarvestState(self.path)
+        assert state.begin('cs', 'arXivRaw') == 'page2'
+        assert catalog.committed == ['0001', '0002']
+        state.close()
+
+    def test_unacknowledged_ids_come_back(self):
+        calls = []
+        state = HarvestState(self.path)
+        batches = self.harvester(calls, fail_after=3).get_batched_ids(2, 'cs', state=state)
+        with self.assertRaises(KeyboardInterrupt):
+            for id_batch in batches:
+                # the process dies before the second batch, ['0003'], has been acknowledged
+                state.acknowledge()
+        state.close()
+
+        state = HarvestState(self.path)
+        # the checkpoint is still the first page, which is fetched again; its acknowledged ids are skipped, and the id
+        # that was yielded but never acknowledged comes back
+        assert list(self.harvester(calls).get_ids('cs', state=state)) == ['0003', '0004']
+        assert calls[-1] == {'metadataPrefix': 'arXivRaw', 'set': 'cs'}
+        assert state.last_completed('cs', 'arXivRaw') is None
+        state.acknowledge()
+        assert state.last_completed('cs', 'arXivRaw') is not None
+        state.close()
+
+    def test_token_expires_mid_harvest(self):
+        calls = []
+        state = HarvestState(self.path)
+        harvested = list(self.harvester(calls, expired=['page2']).get_ids('cs', '2020-04-01', state=state))
+        state.acknowledge()
+        # the window starts over from its from_date, and the state skips the ids of the first page
+        assert [call.get('from') for call in calls] == ['2020-04-01', '2020-04-01']
+        assert harvested == ['0001', '0002', '0003', '0004']
+        assert state.last_completed('cs', 'arXivRaw') is not None
+        state.close()
+        # without a state, the records already harvested are passed over
+        assert list(self.harvester(calls, expired=['page2']).get_ids('cs')) == ['0001', '0002', '0003', '0004']
+
+    def test_changed_records(self):
+        state = HarvestState(self.path)
+        state.begin('cs', 'arXivRaw')
+        assert not state.record('cs', '0001', '2020-04-04')
+        assert state.changed() == []
+        state.acknowledge()
+        assert not state.record('cs', '0002', '2020-04-04')
+        # harvested again with a new datestamp, eg once it got a doi
+        assert state.record('cs', '0001', '2020-05-01')
+        assert state.changed() == ['0001']
+        state.acknowledge()
+        assert state.changed() == []
+        assert state.seen('cs', '0001', '2020-05-01')
+        state.close()
+
+    def test_incremental_window(self):
+        calls = []
+        state = HarvestState(self.path)
+        assert list(self.harvester(calls).get_ids('cs', state=state)) == ['0001', '0002', '0003', '0004']
+        state.acknowledge()
+        assert list(self.harvester(calls).get_ids('cs', state=state, incremental=True)) == []
+        assert calls[-1]['from'] == state.last_completed('cs', 'arXivRaw')
+        state.close()
@@ -0,0 +1,119 @@
+import itertools
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import TestCase
+
+from arxiv_stub import StubArxiv
+from http_client import HttpClient, ValidatorStore
+from rate_limiter import RateLimiter
+from response_cache import OfflineCacheMiss, ResponseCache, request_key
+from sickle_impl import Sickle_Impl
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = b'%PDF-1.4 stub'
+        self.send_response(200)
+        self.send_header('ETag', '"v1"')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Test(TestCase):
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), StubHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/pdf/1501.05260v3"
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.folder.cleanup()
+
+    def test_conditional_get(self):
+        validators = ValidatorStore(os.path.join(self.folder.name, 'validators.sqlite3'))
+        client = HttpClient(RateLimiter(requests_per_second=100), validators)
+        assert client.get(self.url, remember=True).status_code == 200
+        assert client.get(self.url).status_code == 200
+        assert client.get(self.url, conditional=True).status_code == 304
+        client.close()
+
+    def test_async_engine(self):
+        try:
+            import httpx
+        except ImportError:
+            self.skipTest("httpx isn't installed")
+        from getter import AsyncDownloadEngine, pdf_downloads
+        validators = ValidatorStore(os.path.join(self.folder.name, 'validators.sqlite3'))
+        engine = AsyncDownloadEngine(client=HttpClient(RateLimiter(requests_per_second=100), validators))
+        try:
+            pdf_path = engine.submit(self.folder.name, self.url).result(10)
+            with open(pdf_path, 'rb') as pdf_file:
+                assert pdf_file.read() == b'%PDF-1.4 stub'
+            # a refresh is conditional, and the stub answers 304
+            unchanged = pdf_downloads.value(outcome='unchanged')
+            assert engine.submit(self.folder.name, self.url, refresh=True).result(10) == pdf_path
+            assert pdf_downloads.value(outcome='unchanged') == unchanged + 1
+        finally:
+            engine.close()
+        cache = ResponseCache(os.path.join(self.folder.name, 'responses.sqlite3'), offline=True)
+        engine = AsyncDownloadEngine(client=HttpClient(RateLimiter(requests_per_second=100), cache=cache))
+        try:
+            with self.assertRaises(OfflineCacheMiss):
+                engine.submit(self.folder.name, self.url + 'v2').result(10)
+        finally:
+            engine.close()
+
+    def test_response_cache(self):
+        cache = ResponseCache(os.path.join(self.folder.name, 'responses.sqlite3'), max_bytes=20)
+        client = HttpClient(RateLimiter(requests_per_second=100), cache=cache)
+        assert client.get(self.url, params={'verb': 'ListRecords', 'resumptionToken': '1'}).status_code == 200
+        assert client.get(self.url, params={'verb': 'ListRecords', 'resumptionToken': '2'}).status_code == 200
+        assert request_key('GET', self.url + '?resumptionToken=2&verb=ListRecords') == \
+               request_key('GET', self.url, {'verb': 'ListRecords', 'resumptionToken': '2'})
+        # with the stub server gone, only the cache can answer
+        client.close()
+        self.server.shutdown()
+        offline = HttpClient(RateLimiter(requests_per_second=100), cache=cache)
+        cache.offline = True
+        replayed = offline.get(self.url, params={'resumptionToken': '2', 'verb': 'ListRecords'})
+        assert replayed.content == b'%PDF-1.4 stub' and replayed.headers['ETag'] == '"v1"'
+        # two 13 byte responses don't fit in 20 bytes, so the least recently used was evicted
+        with self.assertRaises(OfflineCacheMiss):
+            offline.get(self.url, params={'verb': 'ListRecords', 'resumptionToken': '1'})
+        offline.close()
+
+    def test_offline_miss_in_harvest(self):
+        stub = StubArxiv(records=3, page_size=2).start()
+        cache = ResponseCache(os.path.join(self.folder.name, 'responses.sqlite3'))
+        client = HttpClient(RateLimiter(requests_per_second=100), cache=cache)
+        try:
+            # only the first page is requested, and cached
+            assert list(itertools.islice(Sickle_Impl(f"{stub.url}/oai2", client=client).get_ids('cs'), 2)) == \
+                ['1501.00000', '1501.00001']
+        finally:
+            stub.stop()
+        cache.offline = True
+        harvest = Sickle_Impl(f"{stub.url}/oai2", client=client).get_ids('cs')
+        assert [next(harvest), next(harvest)] == ['1501.00000', '1501.00001']
+        start = time.monotonic()
+        # the missing second page fails the replay rather than being retried after a backoff
+        with self.assertRaises(OfflineCacheMiss):
+            next(harvest)
+        assert time.monotonic() - start < 5
+        client.close()
@@ -0,0 +1,46 @@
+import json
+import os
+import tempfile
+import urllib.request
+from unittest import TestCase
+
+from metrics import Registry, SnapshotWriter, serve_metrics
+
+
+class Test(TestCase):
+    def test_exposition(self):
+        registry = Registry()
+        downloads = registry.counter('pdf_downloads_total', "downloads by outcome", ['outcome'])
+        downloads.inc(outcome='saved')
+        downloads.inc(2, outcome='saved')
+        downloads.inc(outcome='failed')
+        seconds = registry.histogram('pdf_download_seconds', "downloads", buckets=(1, 10))
+        seconds.observe(0.5)
+        seconds.observe(5)
+        seconds.observe(50)
+        with seconds.time():
+            pass
+        text = registry.exposition()
+        assert 'pdf_downloads_total{outcome="saved"} 3' in text
+        assert 'pdf_downloads_total{outcome="failed"} 1' in text
+        assert '# TYPE pdf_download_seconds histogram' in text
+        assert 'pdf_download_seconds_bucket{le="1"} 2' in text
+        assert 'pdf_download_seconds_bucket{le="10"} 3' in text
+        assert 'pdf_download_seconds_bucket{le="+Inf"} 4' in text
+        assert 'pdf_download_seconds_count 4' in text
+        server = serve_metrics(0, registry=registry)
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_port}/metrics") as response:
+            assert 'pdf_downloads_total{outcome="saved"} 3' in response.read().decode('UTF-8')
+        server.shutdown()
+        server.server_close()
+
+    def test_snapshot(self):
+        registry = Registry()
+        registry.counter('pdf_download_bytes_total', "bytes").inc(1024)
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'metrics.json')
+            SnapshotWriter(path, 3600, registry).stop()
+            with open(path) as snapshot:
+                metrics = json.load(snapshot)['metrics']
+            assert metrics['pdf_download_bytes_total'] == {'total': 1024}
+            assert not os.path.exists(f"{path}.part")
@@ -0,0 +1,69 @@
+import io
+import json
+import os
+import random
+import tempfile
+from contextlib import redirect_stdout
+from unittest import TestCase
+
+from near_duplicates import MinHasher, NearDuplicates, main, shingle_hashes, similarity
+
+
+class Test(TestCase):
+    def test_signature(self):
+        random.seed(7)
+        words = [f"word{random.randrange(5000)}" for _ in range(2000)]
+        edited = list(words)
+        edited[1000:1005] = ['revised'] * 5
+        hasher = MinHasher()
+        original = hasher.signature(shingle_hashes(' '.join(words)))
+        assert similarity(original, hasher.signature(shingle_hashes(' '.join(edited)))) > 0.9
+        unrelated = [f"word{random.randrange(5000)}" for _ in range(2000)]
+        assert similarity(original, hasher.signature(shingle_hashes(' '.join(unrelated)))) < 0.1
+        assert hasher.signature(shingle_hashes('')) is None
+
+    def test_groups(self):
+        random.seed(11)
+        paper = ' '.join(f"word{random.randrange(5000)}" for _ in range(3000))
+        cross_listed = paper.replace(paper[:40], 'Cross listed in cs.DC', 1)
+        other = ' '.join(f"word{random.randrange(5000)}" for _ in range(3000))
+        revised = ' '.join(f"word{random.randrange(5000)}" for _ in range(3000))
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'near_duplicates.sqlite3')
+            # one paper in two categories, and a paper with two versions
+            texts = {('cs_lg', '1501_05260v1'): paper, ('cs_dc', '1501_05260v1'): cross_listed,
+                     ('cs_lg', '1502_00001v1'): other, ('cs_lg', '1502_00001v2'): revised}
+            keys = {}
+            for (category, name), text in texts.items():
+                os.makedirs(os.path.join(folder, category), exist_ok=True)
+                keys[category, name] = os.path.join(folder, category, f"export_arxiv_org_pdf_{name}.txt")
+                with open(keys[category, name], 'w') as text_file:
+                    text_file.write(text)
+            duplicates = NearDuplicates(path)
+            assert duplicates.add(keys['cs_lg', '1501_05260v1'], paper, '1501.05260v1') == keys['cs_lg', '1501_05260v1']
+            assert duplicates.add(keys['cs_lg', '1502_00001v1'], other, '1502.00001v1') == keys['cs_lg', '1502_00001v1']
+            assert duplicates.add(keys['cs_dc', '1501_05260v1'], cross_listed, '1501.05260v1') == \
+                keys['cs_lg', '1501_05260v1']
+            # a later version replaces the earlier one as the representative, however much it changed
+            assert duplicates.later_version('1502.00001v1') is None
+            assert duplicates.add(keys['cs_lg', '1502_00001v2'], revised, '1502.00001v2') == \
+                keys['cs_lg', '1502_00001v2']
+            assert duplicates.later_version('1502.00001v1') == keys['cs_lg', '1502_00001v2']
+            assert duplicates.later_version('1502.00001v2') is None
+            # a near duplicate of another paper joins its group, which a later version of that paper doesn't take over
+            assert duplicates.add(os.path.join(folder, 'copy.txt'), paper) == keys['cs_lg', '1501_05260v1']
+            duplicates.close()
+            duplicates = NearDuplicates(path)
+            groups = {keys['cs_lg', '1501_05260v1']: sorted([keys['cs_lg', '1501_05260v1'],
+                                                             keys['cs_dc', '1501_05260v1'],
+                                                             os.path.join(folder, 'copy.txt')]),
+                      keys['cs_lg', '1502_00001v2']: [keys['cs_lg', '1502_00001v1'], keys['cs_lg', '1502_00001v2']]}
+            assert duplicates.groups() == groups
+            duplicates.close()
+            # the command line groups the copies in the category folders too
+            output = io.StringIO()
+            with redirect_stdout(output):
+                main([folder, '--index', os.path.join(folder, 'fresh.sqlite3')])
+            assert json.loads(output.getvalue()[output.getvalue().index('{'):]) == \
+                {keys['cs_dc', '1501_05260v1']: [keys['cs_dc', '1501_05260v1'], keys['cs_lg', '1501_05260v1']],
+                 keys['cs_lg', '1502_00001v2']: [keys['cs_lg', '1502_00001v1'], keys['cs_lg', '1502_00001v2']]}
@@ -0,0 +1,26 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from page_index import load_page_index, page_range, read_page, save_page_index, write_pages
+
+
+class Test(TestCase):
+    def test_page_index(self):
+        pages = ['I. INTRODUCTION\nfirst', 'II. BACKGROUND\nsécond', 'third']
+        with tempfile.TemporaryDirectory() as folder:
+            text_path = os.path.join(folder, 'a.txt')
+            with open(text_path, 'wb') as text_file:
+                offsets = write_pages(text_file, iter(pages))
+            save_page_index(text_path, offsets, 1, 3)
+            with open(text_path, encoding='UTF-8') as text_file:
+                assert text_file.read() == '\n\n'.join(pages)
+            assert [read_page(text_path, number) for number in (1, 2, 3)] == pages
+            assert load_page_index(text_path)['page_count'] == 3
+            with self.assertRaises(IndexError):
+                read_page(text_path, 4)
+
+    def test_page_range(self):
+        assert page_range(10) == range(0, 10)
+        assert page_range(10, last_page=4) == range(0, 4)
+        assert page_range(3, 2, 8) == range(1, 3)
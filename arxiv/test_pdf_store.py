@@ -0,0 +1,57 @@
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from pdf_store import PdfStore, arxiv_key
+
+
+class Test(TestCase):
+    def test_arxiv_key(self):
+        assert arxiv_key('http://export.arxiv.org/pdf/2101.00001v2') == ('2101.00001', 'v2')
+        assert arxiv_key('http://export.arxiv.org/pdf/cs/0112017') == ('cs/0112017', '')
+        assert arxiv_key('http://example.com/paper.pdf') is None
+
+    def test_topics_share_blobs(self):
+        with tempfile.TemporaryDirectory() as folder:
+            store = PdfStore(os.path.join(folder, 'store'))
+            computing, learning = os.path.join(folder, 'computing'), os.path.join(folder, 'learning')
+            os.makedirs(computing)
+            os.makedirs(learning)
+            pdf_path = os.path.join(computing, 'a.pdf')
+            with open(pdf_path, 'wb') as pdf:
+                pdf.write(b'%PDF-1.4 one')
+            assert store.get('2101.00001', 'v1') is None
+            assert store.add('2101.00001', 'v1', pdf_path) == pdf_path
+            blob_path = store.get('2101.00001', 'v1')
+            assert os.path.samefile(pdf_path, blob_path)
+            # found again under another topic, it's a link rather than a download
+            assert store.link('2101.00001', 'v1', os.path.join(learning, 'a.pdf')) == os.path.join(learning, 'a.pdf')
+            assert os.path.samefile(os.path.join(learning, 'a.pdf'), blob_path)
+            # the same bytes under another version are stored once
+            other_path = os.path.join(learning, 'b.pdf')
+            with open(other_path, 'wb') as pdf:
+                pdf.write(b'%PDF-1.4 one')
+            store.add('2101.00001', 'v2', other_path)
+            assert os.path.samefile(other_path, blob_path)
+            assert store.counts() == dict(articles=2, pdfs=1, bytes=12)
+            assert [key for *key, path in store.view(learning)] == [['2101.00001', 'v1'], ['2101.00001', 'v2']]
+            store.close()
+
+    def test_copy_where_links_fail(self):
+        with tempfile.TemporaryDirectory() as folder:
+            store = PdfStore(os.path.join(folder, 'store'))
+            computing = os.path.join(folder, 'computing')
+            os.makedirs(computing)
+            pdf_path = os.path.join(computing, 'a.pdf')
+            with open(pdf_path, 'wb') as pdf:
+                pdf.write(b'%PDF-1.4 one')
+            # as if the store were on another file system
+            with patch('os.link', side_effect=OSError(18, 'Invalid cross-device link')):
+                assert store.add('2101.00001', 'v1', pdf_path) == pdf_path
+            blob_path = store.get('2101.00001', 'v1')
+            assert not os.path.samefile(pdf_path, blob_path)
+            with open(pdf_path, 'rb') as pdf:
+                assert pdf.read() == b'%PDF-1.4 one'
+            assert list(store.view(computing)) == [('2101.00001', 'v1', pdf_path)]
+            store.close()
@@ -0,0 +1,33 @@
+import queue
+import threading
+import time
+from unittest import TestCase
+
+from pipeline import DONE, Stage
+
+
+class Test(TestCase):
+    def test_stages(self):
+        numbers, doubles, results = queue.Queue(2), queue.Queue(2), []
+        lock = threading.Lock()
+
+        def double(number):
+            if number == 3:
+                raise ValueError(number)
+            return number * 2
+
+        def collect(number):
+            time.sleep(0.01)  # the slow stage downstream holds the others back
+            with lock:
+                results.append(number)
+
+        stages = [Stage('double', double, 3, numbers, doubles).start(), Stage('collect', collect, 1, doubles).start()]
+        for number in range(10):
+            numbers.put(number)
+            # bounded queues: nothing runs more than a few items ahead of the slow stage
+            assert number - len(results) <= 2 + 2 + 3 + 1 + 1
+        numbers.put(DONE)
+        for stage in stages:
+            stage.join()
+        assert sorted(results) == [0, 2, 4, 8, 10, 12, 14, 16, 18]
+        assert (stages[0].processed, stages[0].failed, stages[1].processed) == (9, 1, 9)
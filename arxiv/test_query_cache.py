@@ -0,0 +1,62 @@
+import os
+import tempfile
+from unittest import TestCase
+
+import getter
+from arxiv_stub import StubArxiv
+from getter import plan_id_chunks, yield_planned_pdf_links
+from http_client import HttpClient, set_client
+from query_cache import QueryCache
+from rate_limiter import RateLimiter
+
+
+class Test(TestCase):
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as folder:
+            cache = QueryCache(os.path.join(folder, 'query_cache.sqlite3'))
+            cache.put('computing', {'0001': 'http://export.arxiv.org/pdf/0001v1', '0002': None})
+            assert cache.get('computing', ['0001', '0002', '0003']) == {'0001': 'http://export.arxiv.org/pdf/0001v1',
+                                                                      '0002': None}
+            assert cache.get('learning', ['0001']) == {}
+            cache.close()
+
+    def test_plan_id_chunks(self):
+        ids = ['0001', '0002', '0003', '0002', '0004', '0005', '0006']
+        plan = list(plan_id_chunks(ids, {'0002': None, '0005': None}, 2))
+        assert plan == [(['0001', '0002', '0003'], ['0001', '0003']), (['0004', '0005', '0006'], ['0004', '0006'])]
+        assert list(plan_id_chunks(ids[:2], {'0001': None, '0002': None}, 2)) == [(['0001', '0002'], [])]
+
+    def test_not_qualified_expire_and_forget(self):
+        with tempfile.TemporaryDirectory() as folder:
+            cache = QueryCache(os.path.join(folder, 'query_cache.sqlite3'), not_qualified_ttl=0)
+            cache.put('computing', {'0001': 'http://export.arxiv.org/pdf/0001v1', '0002': None})
+            # an id that didn't qualify may have since, a qualified one stays qualified
+            assert cache.get('computing', ['0001', '0002']) == {'0001': 'http://export.arxiv.org/pdf/0001v1'}
+            cache.not_qualified_ttl = 3600
+            assert cache.get('computing', ['0002']) == {'0002': None}
+            cache.forget(['0001', '0002'])
+            assert cache.get('computing', ['0001', '0002']) == {}
+            cache.close()
+
+    def test_short_feed(self):
+        stub = StubArxiv(records=10).start()
+        feed = stub.query_feed
+        # a feed of 2 of the 3 results it says the 4 ids have
+        stub.query_feed = lambda id_list, start, max_results: feed(id_list, start, 2).replace(
+            b'>2</opensearch:itemsPerPage>', b'>4</opensearch:itemsPerPage>').replace(
+            b'>4</opensearch:totalResults>', b'>3</opensearch:totalResults>')
+        base_url, getter.base_url = getter.base_url, f"{stub.url}/api/query?"
+        client = HttpClient(RateLimiter(requests_per_second=100))
+        set_client(client)
+        try:
+            with tempfile.TemporaryDirectory() as folder:
+                cache = QueryCache(os.path.join(folder, 'query_cache.sqlite3'))
+                ids = ['1501.00000', '1501.00001', '1501.00002', '1501.00003']
+                list(yield_planned_pdf_links(ids, 'computing', cache))
+                assert set(cache.get('computing', ids)) == {'1501.00000', '1501.00001'}
+                cache.close()
+        finally:
+            getter.base_url = base_url
+            client.close()
+            set_client(None)
+            stub.stop()
@@ -0,0 +1,38 @@
+import os
+import tempfile
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from query_shards import SUBMITTED_FORMAT, ShardLog, split_date_range
+
+
+class Test(TestCase):
+    def test_split_date_range(self):
+        submissions = [(datetime(2020, 1, 1) + timedelta(days=i)).strftime(SUBMITTED_FORMAT) for i in range(100)]
+        probes = []
+
+        def count(submitted):
+            probes.append(submitted)
+            return sum(1 for submission in submissions if submitted[0] <= submission <= submitted[1])
+
+        shards = list(split_date_range(count, datetime(2020, 1, 1), datetime(2020, 12, 31), 30))
+        assert all(total <= 30 for start, end, total in shards)
+        assert sum(total for start, end, total in shards) == 100
+        # contiguous, in submission order
+        assert all(datetime.strptime(shards[i][1], SUBMITTED_FORMAT) + timedelta(minutes=1)
+                   == datetime.strptime(shards[i + 1][0], SUBMITTED_FORMAT) for i in range(len(shards) - 1))
+        assert len(probes) == 2 * len(shards) - 1
+
+    def test_shard_log(self):
+        with tempfile.TemporaryDirectory() as folder:
+            log = ShardLog(os.path.join(folder, 'shards.sqlite3'))
+            assert log.shards('computing', '199108010000', '202001010000') is None
+            shards = log.plan('computing', '199108010000', '202001010000',
+                              [('199108010000', '200501010000', 10), ('200501010001', '202001010000', 0)])
+            log.advance('computing', '199108010000', '202001010000', shards[0], 4)
+            assert log.unfinished('computing', '199108010000') == '202001010000'
+            assert [shard.next_start for shard in log.shards('computing', '199108010000', '202001010000')] == [4, 0]
+            log.advance('computing', '199108010000', '202001010000', shards[0], 10)
+            assert log.unfinished('computing', '199108010000') is None
+            assert log.covered('computing', '199108010000') == '202001010000'
+            log.close()
@@ -0,0 +1,52 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+
+from rate_limiter import RateLimiter
+
+
+class Test(TestCase):
+    def test_spacing_across_threads(self):
+        limiter = RateLimiter(requests_per_second=50, max_connections=4)
+        starts = []
+
+        def request(_):
+            with limiter.request():
+                starts.append(time.monotonic())
+
+        with ThreadPoolExecutor(8) as executor:
+            list(executor.map(request, range(10)))
+        starts.sort()
+        gaps = [later - earlier for earlier, later in zip(starts, starts[1:])]
+        assert min(gaps) >= 0.015, gaps
+
+    def test_defer_holds_every_request(self):
+        limiter = RateLimiter(requests_per_second=100)
+        limiter.defer(0.2)
+        began = time.monotonic()
+        limiter.acquire()
+        assert time.monotonic() - began >= 0.19
+
+    def test_coroutines_share_connections(self):
+        limiter = RateLimiter(requests_per_second=1000, max_connections=1)
+        events, holding = [], threading.Event()
+
+        def threaded_request():
+            with limiter.request():
+                events.append('thread')
+                holding.set()
+                time.sleep(0.2)
+                events.append('thread done')
+
+        async def coroutine_request():
+            async with limiter.request_async():
+                events.append('coroutine')
+
+        thread = threading.Thread(target=threaded_request)
+        thread.start()
+        holding.wait()
+        asyncio.run(coroutine_request())
+        thread.join()
+        assert events == ['thread', 'thread done', 'coroutine']
@@ -0,0 +1,57 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from arxiv_stub import FIXTURES
+from conversion_manifest import ConversionManifest
+from corpus_shards import CorpusReader, CorpusWriter, shard_paths
+from run_pdftotext import Converter
+
+
+class Test(TestCase):
+    def test_convert_pdfs_to_text(self):
+        with tempfile.TemporaryDirectory() as folder:
+            pdf_folder = os.path.join(folder, 'pdfs')
+            os.makedirs(os.path.join(pdf_folder, 'computing'))
+            for name in ('a.pdf', os.path.join('computing', 'c.pdf')):
+                shutil.copyfile(os.path.join(FIXTURES, 'paper.pdf'), os.path.join(pdf_folder, name))
+            # a login page saved as a PDF
+            with open(os.path.join(pdf_folder, 'b.pdf'), 'wb') as bad_pdf:
+                bad_pdf.write(b'<html>login</html>')
+            for workers in (1, 2):
+                text_folder = os.path.join(folder, f'text{workers}')
+                manifest = ConversionManifest(os.path.join(folder, f'manifest{workers}.sqlite3'))
+                converter = Converter(text_folder, pdf_folder, workers=workers, manifest=manifest)
+                results = sorted(converter.convert_pdfs_to_text())
+                assert [index for index, text_path in results] == [0, 1, 2]
+                text_paths = [text_path for index, text_path in results]
+                assert text_paths.count(None) == 1
+                assert sorted(os.path.relpath(text_path, text_folder) for text_path in text_paths if text_path) == \
+                    ['a.txt', os.path.join('computing', 'c.txt')]
+                assert all(os.path.getsize(text_path) for text_path in text_paths if text_path)
+                assert manifest.counts() == {'converted': 2, 'failed': 1}
+                manifest.close()
+
+    def test_convert_pdfs_to_corpus(self):
+        with tempfile.TemporaryDirectory() as folder:
+            pdf_folder = os.path.join(folder, 'pdfs')
+            os.makedirs(pdf_folder)
+            for name in ('a.pdf', 'c.pdf'):
+                shutil.copyfile(os.path.join(FIXTURES, 'paper.pdf'), os.path.join(pdf_folder, name))
+            with open(os.path.join(pdf_folder, 'b.pdf'), 'wb') as bad_pdf:
+                bad_pdf.write(b'<html>login</html>')
+            text_folder = os.path.join(folder, 'corpus')
+            manifest = ConversionManifest(os.path.join(folder, 'manifest.sqlite3'))
+            converter = Converter(text_folder, pdf_folder, manifest=manifest, corpus=CorpusWriter(text_folder))
+            list(converter.convert_pdfs_to_text())
+            # until its shard is closed, a converted PDF isn't recorded, so a crash now would convert it again
+            assert manifest.counts() == {'failed': 1}
+            assert manifest.needs_conversion(os.path.join(pdf_folder, 'a.pdf'))
+            converter.corpus.close()
+            assert manifest.counts() == {'converted': 2, 'failed': 1}
+            assert not manifest.needs_conversion(os.path.join(pdf_folder, 'a.pdf'))
+            assert [record['source_path'] for record in CorpusReader(text_folder)] == ['a.pdf', 'c.pdf']
+            assert list(Converter(text_folder, pdf_folder, manifest=manifest).pdf_paths()) == []
+            assert len(shard_paths(text_folder)) == 1
+            manifest.close()
@@ -0,0 +1,82 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from corpus_shards import CorpusWriter, index_path, shard_paths
+
+from search_index import SearchIndex, decode_postings, encode_postings, index_corpus
+
+
+class Test(TestCase):
+    def test_postings(self):
+        postings = [(1, 3), (2, 1), (130, 200), (100000, 1)]
+        encoded = encode_postings(postings)
+        assert list(decode_postings(encoded)) == postings
+        assert len(encoded) < 2 * 4 * 4
+
+    def test_search(self):
+        with tempfile.TemporaryDirectory() as folder:
+            content, sections = os.path.join(folder, 'text'), os.path.join(folder, 'sections')
+            os.makedirs(content)
+            os.makedirs(os.path.join(sections, 'background'))
+            documents = {'a.txt': "Quantum computing with reversible circuits. Quantum gates.",
+                         'b.txt': "Classical computing on distributed clusters.",
+                         'c.txt': "A survey of databases."}
+            for name, text in documents.items():
+                with open(os.path.join(content, name), 'w') as text_file:
+                    text_file.write(text)
+            with open(os.path.join(sections, 'background', 'b.txt'), 'w') as section_file:
+                section_file.write("Clusters and their schedulers.")
+            path = os.path.join(folder, 'index.sqlite3')
+            index = SearchIndex(path, batch_documents=2)
+            assert index_corpus(index, content, sections) == {'text': 3, 'background': 1}
+            assert [key for key, score in index.search('quantum computing')] == ['a.txt', 'b.txt']
+            assert [key for key, score in index.search('schedulers', 'background')] == ['b.txt']
+            index.close()
+
+            # only the new and changed documents are indexed again
+            with open(os.path.join(content, 'c.txt'), 'w') as text_file:
+                text_file.write("A survey of quantum databases.")
+            os.utime(os.path.join(content, 'c.txt'), ns=(1, 1))
+            with open(os.path.join(content, 'd.txt'), 'w') as text_file:
+                text_file.write("Nothing relevant.")
+            index = SearchIndex(path)
+            assert index_corpus(index, content) == {'text': 2}
+            assert [key for key, score in index.search('databases')] == ['c.txt']
+            assert {key for key, score in index.search('quantum')} == {'a.txt', 'c.txt'}
+            before = index.search('quantum')
+            index.merge()
+            assert index.search('quantum') == before
+            index.close()
+
+    def test_shards(self):
+        with tempfile.TemporaryDirectory() as folder:
+            content = os.path.join(folder, 'corpus')
+            writer = CorpusWriter(content)
+            for arxiv_id, text in (('1501.00001v1', "Quantum circuits."), ('1501.00002v1', "Old text of a survey."),
+                                   ('1501.00003v1', "Distributed databases.")):
+                writer.add(dict(arxiv_id=arxiv_id, source_path=f"{arxiv_id}.pdf", text=text))
+            writer.close()
+            index = SearchIndex(os.path.join(folder, 'index.sqlite3'))
+            assert index_corpus(index, content) == {'text': 3}
+            assert index_corpus(index, content) == {}
+
+            # a later run reconverts a document into a shard of its own: only the new shard is read, and the
+            # document is indexed once, from it
+            writer = CorpusWriter(content)
+            for arxiv_id, text in (('1501.00002v1', "New text of a survey."), ('1501.00004v1', "Clusters.")):
+                writer.add(dict(arxiv_id=arxiv_id, source_path=f"{arxiv_id}.pdf", text=text))
+            writer.close()
+            assert index_corpus(index, content) == {'text': 2}
+            assert [key for key, score in index.search('survey new')] == ['1501.00002v1']
+            assert index.search('old') == []
+            assert index_corpus(index, content) == {}
+
+            # documents deleted from the corpus leave the index
+            first = shard_paths(content)[0]
+            os.remove(index_path(first))
+            os.remove(first)
+            assert index_corpus(index, content) == {}
+            assert index.search('quantum') == [] and index.search('databases') == []
+            assert [key for key, score in index.search('survey')] == ['1501.00002v1']
+            index.close()
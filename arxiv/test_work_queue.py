@@ -0,0 +1,41 @@
+import os
+import tempfile
+import time
+from unittest import TestCase
+
+from work_queue import WorkQueue
+
+
+class Test(TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, 'queue.sqlite3')
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_visibility_and_retries(self):
+        queue = WorkQueue(self.path, visibility_timeout=0.2, max_attempts=2)
+        assert queue.put('ids', ['0001', '0002', '0003']) == 3
+        assert queue.put('ids', ['0003']) == 0
+        first = queue.get('ids', 2)
+        assert [task.payload for task in first] == ['0001', '0002']
+        # a second worker only sees what the first didn't take
+        other = WorkQueue(self.path, visibility_timeout=0.2)
+        assert [task.payload for task in other.get('ids', 5)] == ['0003']
+        queue.ack(first[:1])
+        queue.fail(first[1:], 'query failed', retry_delay=0)
+        retried = queue.get('ids', 5)
+        assert [(task.payload, task.attempts) for task in retried] == [('0002', 2)]
+        queue.fail(retried, 'query failed again', retry_delay=0)
+        # the unacknowledged '0003' comes back once its visibility timeout runs out
+        time.sleep(0.25)
+        assert [task.payload for task in queue.get('ids', 5)] == ['0003']
+        assert queue.counts('ids') == {'done': 1, 'failed': 1, 'invisible': 1}
+        # a done task is queued again, one that ran out of attempts isn't
+        assert queue.put('ids', ['0001', '0002']) == 1
+        assert queue.counts('ids') == {'ready': 1, 'failed': 1, 'invisible': 1}
+        assert [(task.payload, task.attempts) for task in queue.get('ids', 5)] == [('0001', 1)]
+        assert queue.retry_failed('ids') == 1
+        other.close()
+        queue.close()
@@ -0,0 +1,134 @@
+import json
+import sqlite3
+import time
+import uuid
+from collections import namedtuple
+from contextlib import contextmanager
+from typing import Iterable, List
+
+from sickle_impl import getLogger
+
+logger = getLogger(__name__)
+
+VISIBILITY_TIMEOUT: float = 3600  # conf, seconds a dequeued task stays invisible before another worker may take it
+MAX_ATTEMPTS: int = 5  # conf
+
+# payload is whatever was put, attempts counts this one, lease identifies this dequeue of the task
+Task = namedtuple('Task', ['id', 'queue', 'payload', 'attempts', 'lease'])
+
+
+class WorkQueue:
+    """
+    Durable task queue in a SQLite file, shared by any number of worker processes on this host (or on hosts sharing a
+    file system whose locks SQLite can rely on).
+
+    get hands out a batch of tasks and hides them for a visibility timeout. A worker acks what it finished and fails
+    what it didn't, which makes those tasks visible again after a delay until they run out of attempts. Tasks a worker
+    took and never reported on, because it died, reappear when their timeout runs out. Putting a payload that is already
+    queued, or has run out of attempts, is a no-op, so a re-run of a stage doesn't duplicate work; putting one that is
+    done queues it again, eg an id whose record changed since it was processed.
+    """
+
+    def __init__(self, path: str = "work_queue.sqlite3", visibility_timeout: float = VISIBILITY_TIMEOUT,
+                 max_attempts: int = MAX_ATTEMPTS):  # conf
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        # autocommit; transaction begins its own
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS task (
+                id INTEGER PRIMARY KEY,
+                queue TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'ready',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                visible_at REAL NOT NULL DEFAULT 0,
+                lease TEXT,
+                error TEXT,
+                UNIQUE (queue, payload));
+            CREATE INDEX IF NOT EXISTS task_ready ON task (queue, state, visible_at);
+        """)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Take the write lock up front, so two workers can't both claim a task they each read as visible
+        """
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.connection
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    def put(self, queue: str, payloads: Iterable) -> int:
+        """
+        :param payloads: JSON serializable task descriptions
+        :return: how many of them were new to the queue, or done and queued again
+        """
+        with self.transaction() as connection:
+            cursor = connection.executemany(
+                "INSERT INTO task (queue, payload) VALUES (?, ?) ON CONFLICT (queue, payload) DO UPDATE SET "
+                "state = 'ready', attempts = 0, visible_at = 0, lease = NULL, error = NULL WHERE state = 'done'",
+                ((queue, json.dumps(payload, sort_keys=True)) for payload in payloads))
+            return cursor.rowcount
+
+    def get(self, queue: str, batch_size: int = 1, visibility_timeout: float = None) -> List[Task]:
+        """
+        Take up to batch_size visible tasks, hiding them from other workers for the visibility timeout
+        """
+        now = time.time()
+        lease = uuid.uuid4().hex
+        with self.transaction() as connection:
+            rows = connection.execute(
+                "SELECT id, payload, attempts FROM task WHERE queue = ? AND state = 'ready' AND visible_at <= ? "
+                "ORDER BY id LIMIT ?", (queue, now, batch_size)).fetchall()
+            connection.executemany(
+                "UPDATE task SET attempts = attempts + 1, visible_at = ?, lease = ? WHERE id = ?",
+                [(now + (visibility_timeout or self.visibility_timeout), lease, row[0]) for row in rows])
+        return [Task(row[0], queue, json.loads(row[1]), row[2] + 1, lease) for row in rows]
+
+    def ack(self, tasks: Iterable[Task]):
+        """
+        Mark tasks done; a task whose visibility timeout ran out and was taken by another worker stays theirs
+        """
+        with self.transaction() as connection:
+            connection.executemany("UPDATE task SET state = 'done', error = NULL WHERE id = ? AND lease = ?",
+                                        [(task.id, task.lease) for task in tasks])
+
+    def fail(self, tasks: Iterable[Task], error: str = None, retry_delay: float = 60):  # conf
+        """
+        Return tasks to the queue after retry_delay seconds, or set them aside once they're out of attempts
+        """
+        now = time.time()
+        with self.transaction() as connection:
+            for task in tasks:
+                state = 'failed' if task.attempts >= self.max_attempts else 'ready'
+                if state == 'failed':
+                    logger.error(f"giving up on {task.queue} task {task.payload} after {task.attempts} attempts: {error}")
+                connection.execute(
+                    "UPDATE task SET state = ?, visible_at = ?, error = ? WHERE id = ? AND lease = ?",
+                    (state, now + retry_delay, error, task.id, task.lease))
+
+    def retry_failed(self, queue: str) -> int:
+        """
+        Give the tasks that ran out of attempts another round
+        """
+        with self.transaction() as connection:
+            return connection.execute(
+                "UPDATE task SET state = 'ready', attempts = 0, visible_at = 0 WHERE queue = ? AND state = 'failed'",
+                (queue,)).rowcount
+
+    def counts(self, queue: str) -> dict:
+        """
+        :return: task counts by state; 'invisible' are ready tasks a worker holds or that wait out a retry delay
+        """
+        return dict(self.connection.execute(
+            "SELECT CASE WHEN state = 'ready' AND visible_at > ? THEN 'invisible' ELSE state END, count(*) "
+            "FROM task WHERE queue = ? GROUP BY 1", (time.time(), queue)).fetchall())
+
+    def close(self):
+        self.connection.close()